@@ -1,6 +1,8 @@
 import logging
 import asyncio
-from datetime import datetime, timedelta
+import functools
+from collections import OrderedDict
+from datetime import datetime
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, KeyboardButton
 from telegram.ext import (
     Application,
@@ -11,9 +13,27 @@ from telegram.ext import (
     ContextTypes,
     filters
 )
-from database import Database
-from config import ADMIN_IDS, DM_CONTACT, DB_NAME
+from telegram.ext import BaseHandler
+from telegram.request import BaseRequest
+from callbacks import CallbackRouter, encode_callback
+from database import REGISTRATION_WAITLIST, AsyncDatabase
+from records import Event, Review
+from config import (
+    ADMIN_IDS, DM_CONTACT, DB_NAME, REMINDER_CATCHUP_MINUTES, CONCURRENT_UPDATES, SLOW_QUERY_MS, GROUP_COMMIT_MS,
+    check_legacy_database,
+)
+from reminders import DueReminder, ReminderScheduler
+from broadcast import Broadcaster, dead_chat_reason
+from export import XLSX_AVAILABLE, export_registrations
+from webserver import application_dispatcher, make_web_app, start_http_server
+from persistence import SQLitePersistence
+from querylog import QueryLog
+from update_processor import PerUserUpdateProcessor
+from metrics import DEAD_CHATS, HANDLER_DURATION, HANDLER_ERRORS, CallbackMetric, InstrumentedRequest, gauge
+from workers import COORDINATION_INTERVAL, JobLease, WorkerPool, run_intake
 import re
+import signal
+import time
 
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -21,258 +41,441 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-db = Database(db_name=DB_NAME)
+# До создания базы: AsyncDatabase создаёт файл, если его нет
+check_legacy_database(DB_NAME)
+db = AsyncDatabase(
+    db_name=DB_NAME,
+    query_log=QueryLog(threshold=SLOW_QUERY_MS / 1000) if SLOW_QUERY_MS is not None else None,
+    group_commit_window=GROUP_COMMIT_MS / 1000 if GROUP_COMMIT_MS is not None else None,
+)
 
 # Состояния для админ-панели и отзывов
 (WAITING_ONESHOT_NAME, WAITING_ONESHOT_DATE, WAITING_ONESHOT_STORY,
  WAITING_ONESHOT_LOCATION, WAITING_ONESHOT_PRICE, WAITING_ONESHOT_DRINK,
  WAITING_CAMPAIGN_NAME, WAITING_CAMPAIGN_DATE, WAITING_CAMPAIGN_DURATION,
  WAITING_CAMPAIGN_STORY, WAITING_CAMPAIGN_LOCATION, WAITING_CAMPAIGN_PRICE,
- WAITING_CAMPAIGN_DRINK, WAITING_REVIEW_TEXT) = range(14)
+ WAITING_CAMPAIGN_DRINK, WAITING_REVIEW_TEXT,
+ WAITING_ONESHOT_CAPACITY, WAITING_CAMPAIGN_CAPACITY) = range(16)
+
+# Черновик мероприятия в админ-панели хранится в context.user_data под этим ключом
+# и переживает перезапуск бота вместе с состоянием диалога (см. persistence.py)
+ADMIN_DRAFT = "admin_draft"
+
+# Очередь напоминаний: следующее напоминание планируется через job_queue.run_once
+REMINDER_JOB_NAME = "reminders"
+reminder_scheduler = ReminderScheduler(catchup=REMINDER_CATCHUP_MINUTES * 60)
+
 
-# Временное хранилище данных для админ-панели
-admin_data = {}
+async def mark_chat_dead(chat_id: int, reason: str):
+    # Бот заблокирован или чат удалён: чат исключается из рассылок, напоминаний
+    # и пересылок, пока пользователь снова не напишет боту (/start, кнопки)
+    DEAD_CHATS.inc(reason)
+    logger.info(f"Чат {chat_id} недоступен ({reason}), больше ему не пишем")
+    await db.mark_chat_dead(chat_id, reason)
+
+
+async def handle_send_error(chat_id: int, error: Exception):
+    # Для всех путей отправки: ошибки недоступного чата запоминаются в базе
+    reason = dead_chat_reason(error)
+    if reason is None:
+        return
+    try:
+        await mark_chat_dead(chat_id, reason)
+    except Exception as e:
+        logger.error(f"Не удалось отметить недоступный чат {chat_id}: {e}")
 
 
-def format_oneshot_info(oneshot: dict) -> str:
-    text = f'Ваншот "{oneshot["name"]}"\n\n'
-    text += f'Дата и время: {oneshot["date_time"]}\n'
-    text += f'Сюжет: {oneshot["story"]}\n'
-    text += f'Локация: {oneshot["location"]}\n'
-    text += f'Стоимость: {oneshot["price"]}\n'
-    if oneshot["free_drink"]:
+async def live_admin_ids() -> list:
+    if not ADMIN_IDS:
+        return []
+    dead = await db.get_dead_chats(ADMIN_IDS)
+    return [admin_id for admin_id in ADMIN_IDS if admin_id not in dead]
+
+
+# Рассылки о новых мероприятиях с учётом лимитов Bot API
+broadcaster = Broadcaster(on_dead_chat=mark_chat_dead)
+
+# Напоминания и рассылки выполняет только владелец аренды — процесс бота,
+# который первым её взял (см. workers.py)
+COORDINATION_JOB_NAME = "coordination"
+job_lease = JobLease(db)
+
+
+# Кэш статичных частей карточек мероприятий по (тип, id, версия)
+EVENT_CARD_CACHE_SIZE = 256
+_event_card_cache: "OrderedDict[tuple, tuple]" = OrderedDict()
+
+
+def _cached_event_card(event_type: str, event: Event, build):
+    key = (event_type, event.id, event.version)
+    card = _event_card_cache.get(key)
+    if card is None:
+        card = build(event)
+        _event_card_cache[key] = card
+        if len(_event_card_cache) > EVENT_CARD_CACHE_SIZE:
+            _event_card_cache.popitem(last=False)
+    else:
+        _event_card_cache.move_to_end(key)
+    return card
+
+
+def _build_oneshot_card(oneshot: Event) -> str:
+    text = f'Ваншот "{oneshot.name}"\n\n'
+    text += f'Дата и время: {oneshot.date_time}\n'
+    text += f'Сюжет: {oneshot.story}\n'
+    text += f'Локация: {oneshot.location}\n'
+    text += f'Стоимость: {oneshot.price}\n'
+    if oneshot.capacity:
+        text += f'Мест: {oneshot.capacity}\n'
+    if oneshot.free_drink:
         text += '\nВ стоимость входит бесплатный напиток!'
     return text
 
 
-def format_campaign_info(campaign: dict) -> str:
-    text = f'Кампания "{campaign["name"]}"\n\n'
-    text += f'Дата и время: {campaign["date_time"]}\n'
-    text += f'Длительность: {campaign["duration"]}\n'
-    text += f'Сюжет: {campaign["story"]}\n'
-    text += f'Локация: {campaign["location"]}\n'
-    text += f'Стоимость: {campaign["price"]}\n'
+def _build_campaign_card(campaign: Event) -> tuple:
+    head = f'Кампания "{campaign.name}"\n\n'
+    head += f'Дата и время: {campaign.date_time}\n'
+    head += f'Длительность: {campaign.duration}\n'
+    head += f'Сюжет: {campaign.story}\n'
+    head += f'Локация: {campaign.location}\n'
+    head += f'Стоимость: {campaign.price}\n'
+    if campaign.capacity:
+        head += f'Мест: {campaign.capacity}\n'
 
-    # Статус кампании
     try:
         # ВАЖНО: здесь предполагаем формат "YYYY-MM-DD HH:MM"
-        event_dt = datetime.strptime(campaign["date_time"], "%Y-%m-%d %H:%M")
-        now = datetime.now()
-        if event_dt > now:
+        event_dt = datetime.strptime(campaign.date_time, "%Y-%m-%d %H:%M")
+    except ValueError:
+        # Если дата введена в другом формате — просто не показываем статус
+        event_dt = None
+
+    tail = '\nВ стоимость входит бесплатный напиток!' if campaign.free_drink else ''
+    return head, event_dt, tail
+
+
+def format_oneshot_info(oneshot: Event) -> str:
+    return _cached_event_card("oneshot", oneshot, _build_oneshot_card)
+
+
+def format_campaign_info(campaign: Event) -> str:
+    head, event_dt, tail = _cached_event_card("campaign", campaign, _build_campaign_card)
+    text = head
+
+    # Статус кампании зависит от текущего времени, поэтому не кэшируется
+    if event_dt is not None:
+        if event_dt > datetime.now():
             status = "Еще не стартовала"
         else:
             status = f"Стартовала от {event_dt.strftime('%d/%m')}"
         text += f'\nСтатус: {status}'
-    except ValueError:
-        # Если дата введена в другом формате — просто не показываем статус
-        pass
 
-    if campaign["free_drink"]:
-        text += '\nВ стоимость входит бесплатный напиток!'
+    return text + tail
+
+
+# Карточка, название и подписи для каждого типа мероприятия
+EVENT_FORMATTERS = {"oneshot": format_oneshot_info, "campaign": format_campaign_info}
+EVENT_TYPE_TITLES = {"oneshot": "Ваншот", "campaign": "Кампания"}
+EVENT_TYPE_NAMES = {"oneshot": "ваншот", "campaign": "кампания"}
+NEW_EVENT_HEADERS = {"oneshot": "Появился новый ваншот!", "campaign": "Появилась новая кампания!"}
+NEW_REGISTRATION_HEADERS = {"oneshot": "Новая запись на ваншот!", "campaign": "Новая запись на кампанию!"}
+
+
+def format_event_info(event_type: str, event: Event) -> str:
+    return EVENT_FORMATTERS[event_type](event)
 
-    return text
 
+# Готовые клавиатуры: объекты telegram неизменяемы, их можно переиспользовать
+MAIN_MENU_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("Записаться на ваншот", callback_data=encode_callback("view", "oneshot"))],
+    [InlineKeyboardButton("Присоединиться к D&D кампании", callback_data=encode_callback("view", "campaign"))],
+    [InlineKeyboardButton("Посмотреть все отзывы", callback_data=encode_callback("reviews"))],
+    [InlineKeyboardButton("Оставить отзыв", callback_data=encode_callback("leave_review"))]
+])
 
+ADMIN_MENU_MARKUP = ReplyKeyboardMarkup([
+    [KeyboardButton("Зарегистрировать ваншот")],
+    [KeyboardButton("Зарегистрировать кампанию")],
+    [KeyboardButton("Посмотреть все регистрации")],
+    [KeyboardButton("Удалить мероприятие")],
+    [KeyboardButton("Удалить отзыв")],
+], resize_keyboard=True)
+
+NOTIFY_MARKUPS = {
+    event_type: InlineKeyboardMarkup([[
+        InlineKeyboardButton("Уведомить о появлении", callback_data=encode_callback("notify", event_type))
+    ]])
+    for event_type in ("oneshot", "campaign")
+}
+
+DRINK_MARKUPS = {
+    "oneshot": InlineKeyboardMarkup([[InlineKeyboardButton("Да", callback_data="oneshot_drink_yes"),
+                                      InlineKeyboardButton("Нет", callback_data="oneshot_drink_no")]]),
+    "campaign": InlineKeyboardMarkup([[InlineKeyboardButton("Да", callback_data="campaign_drink_yes"),
+                                       InlineKeyboardButton("Нет", callback_data="campaign_drink_no")]]),
+}
+
+
+@functools.lru_cache(maxsize=256)
+def register_markup(event_type: str, event_id: int) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup([[
+        InlineKeyboardButton("Записаться", callback_data=encode_callback("register", event_type, event_id))
+    ]])
+
+
+@functools.lru_cache(maxsize=256)
+def unregister_markup(event_type: str, event_id: int) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup([[
+        InlineKeyboardButton("Отменить запись", callback_data=encode_callback("unregister", event_type, event_id))
+    ]])
 
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
+    # Пользователь, который разблокировал бота, снова получает сообщения
+    await db.revive_chat(user_id)
     
     if user_id in ADMIN_IDS:
-        keyboard = [
-            [KeyboardButton("Зарегистрировать ваншот")],
-            [KeyboardButton("Зарегистрировать кампанию")],
-            [KeyboardButton("Посмотреть все регистрации")],
-            [KeyboardButton("Удалить мероприятие")],
-            [KeyboardButton("Удалить отзыв")],
-        ]
-        reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
         await update.message.reply_text(
             "Добро пожаловать в админ-панель!\n\n"
             "Выберите действие:",
-            reply_markup=reply_markup
+            reply_markup=ADMIN_MENU_MARKUP
         )
         return ConversationHandler.END
     else:
-        keyboard = [
-            [InlineKeyboardButton("Записаться на ваншот", callback_data="view_oneshots")],
-            [InlineKeyboardButton("Присоединиться к D&D кампании", callback_data="view_campaigns")],
-            [InlineKeyboardButton("Посмотреть все отзывы", callback_data="view_reviews")],
-            [InlineKeyboardButton("Оставить отзыв", callback_data="leave_review")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
         await update.message.reply_text(
             "Добро пожаловать в ДНД-клуб! 🎲\n\n"
             "Выберите, на что вы хотите записаться:",
-            reply_markup=reply_markup
+            reply_markup=MAIN_MENU_MARKUP
         )
 
 
+# Отзывы показываются страницами: стоимость страницы не зависит от числа отзывов
+REVIEWS_PAGE_SIZE = 5
+REVIEWS_ADMIN_PAGE_SIZE = 10
+# Длинные отзывы обрезаются, чтобы страница не превысила лимит Telegram в 4096 символов
+REVIEW_PREVIEW_LENGTH = 600
+
+
+def reviews_nav_row(route: str, reviews: list, direction: str, cursor, has_more: bool) -> list:
+    if cursor is None or direction == "n":
+        has_prev, has_next = cursor is not None, has_more
+    else:
+        has_prev, has_next = has_more, True
+    first, last = reviews[0], reviews[-1]
+    row = []
+    if has_prev:
+        row.append(InlineKeyboardButton("« Назад", callback_data=encode_callback(route, "p", first.created_at, first.id)))
+    if has_next:
+        row.append(InlineKeyboardButton("Дальше »", callback_data=encode_callback(route, "n", last.created_at, last.id)))
+    return row
+
+
+def review_author(review: Review) -> str:
+    return f"@{review.username}" if review.username else review.first_name or "Пользователь"
+
+
+async def show_reviews_page(query, user_id: int, direction: str = "n", cursor=None):
+    reviews, has_more = await db.get_reviews_page(cursor, direction, REVIEWS_PAGE_SIZE)
+    if not reviews and cursor is not None:
+        # Отзывы вокруг курсора удалили — начинаем с первой страницы
+        cursor = None
+        reviews, has_more = await db.get_reviews_page(None, "n", REVIEWS_PAGE_SIZE)
+
+    keyboard = []
+    if not reviews:
+        text = "Пока нет отзывов."
+    else:
+        text = "Отзывы:\n\n"
+        for review in reviews:
+            review_text = review.text
+            if len(review_text) > REVIEW_PREVIEW_LENGTH:
+                review_text = review_text[:REVIEW_PREVIEW_LENGTH] + "…"
+            text += f"{review_author(review)} ({review.created_at[:16]}):\n{review_text}"
+            if user_id in ADMIN_IDS:
+                text += f"\n[Удалить](/delete_review_{review.id})"
+            text += "\n\n"
+        nav_row = reviews_nav_row("reviews", reviews, direction, cursor, has_more)
+        if nav_row:
+            keyboard.append(nav_row)
+    keyboard.extend(MAIN_MENU_MARKUP.inline_keyboard)
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    if user_id in ADMIN_IDS:
+        await query.edit_message_text(text, parse_mode="Markdown", disable_web_page_preview=True, reply_markup=reply_markup)
+    else:
+        await query.edit_message_text(text, reply_markup=reply_markup)
+
+
+async def build_delete_reviews_page(direction: str = "n", cursor=None):
+    reviews, has_more = await db.get_reviews_page(cursor, direction, REVIEWS_ADMIN_PAGE_SIZE)
+    if not reviews and cursor is not None:
+        cursor = None
+        reviews, has_more = await db.get_reviews_page(None, "n", REVIEWS_ADMIN_PAGE_SIZE)
+    if not reviews:
+        return "Пока нет отзывов для удаления.", None
+    keyboard = []
+    for review in reviews:
+        label = f"{review_author(review)} ({review.created_at[:16]})"
+        keyboard.append([InlineKeyboardButton(f"Удалить: {label}", callback_data=encode_callback("delete_review", review.id))])
+    nav_row = reviews_nav_row("reviews_admin", reviews, direction, cursor, has_more)
+    if nav_row:
+        keyboard.append(nav_row)
+    return "Выберите отзыв для удаления:", InlineKeyboardMarkup(keyboard)
+
+
+# Нажатия inline-кнопок: маршрут и поля берутся из callback_data (callbacks.py)
+callback_router = CallbackRouter(is_admin=lambda user_id: user_id in ADMIN_IDS)
+
+NO_EVENTS_TEXTS = {
+    "oneshot": "На данный момент не запланировано ваншотов",
+    "campaign": "На данный момент не запланировано кампаний",
+}
+NOTIFY_CONFIRM_TEXTS = {
+    "oneshot": "Вы будете уведомлены, когда появится новый ваншот!",
+    "campaign": "Вы будете уведомлены, когда появится новая кампания!",
+}
+EVENT_DELETED_TEXTS = {"oneshot": "Ваншот удалён.", "campaign": "Кампания удалена."}
+
+
 async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    await query.answer()
-    
+    await callback_router.dispatch(update, context)
+
+
+@callback_router.route("view")
+async def view_events(query, context: ContextTypes.DEFAULT_TYPE, event_type: str):
+    events = await db.get_upcoming(event_type)
+    if not events:
+        await query.edit_message_text(NO_EVENTS_TEXTS[event_type], reply_markup=NOTIFY_MARKUPS[event_type])
+    else:
+        event = events[0]
+        text = "На данный момент планируется:\n\n" + format_event_info(event_type, event)
+        await query.edit_message_text(text, reply_markup=register_markup(event_type, event.id))
+
+
+@callback_router.route("notify")
+async def notify_about_events(query, context: ContextTypes.DEFAULT_TYPE, event_type: str):
+    await db.add_notification_request(query.from_user.id, event_type)
+    await query.edit_message_text(NOTIFY_CONFIRM_TEXTS[event_type])
+
+
+@callback_router.route("delete_event", admin_only=True)
+async def delete_event(query, context: ContextTypes.DEFAULT_TYPE, event_type: str, event_id: int):
+    await db.delete_event(event_type, event_id)
+    untrack_event_reminders(context.job_queue, event_type, event_id)
+    await query.edit_message_text(EVENT_DELETED_TEXTS[event_type])
+
+
+@callback_router.route("reviews")
+async def view_reviews(query, context: ContextTypes.DEFAULT_TYPE, direction: str, created_at: str, review_id: int):
+    cursor = (created_at, review_id) if created_at is not None else None
+    await show_reviews_page(query, query.from_user.id, direction or "n", cursor)
+
+
+@callback_router.route("reviews_admin", admin_only=True)
+async def view_reviews_for_deletion(query, context: ContextTypes.DEFAULT_TYPE, direction: str, created_at: str,
+                                    review_id: int):
+    cursor = (created_at, review_id) if created_at is not None else None
+    text, reply_markup = await build_delete_reviews_page(direction or "n", cursor)
+    await query.edit_message_text(text, reply_markup=reply_markup)
+
+
+@callback_router.route("delete_review", admin_only=True)
+async def delete_review(query, context: ContextTypes.DEFAULT_TYPE, review_id: int):
+    await db.delete_review(review_id)
+    await query.edit_message_text("Отзыв удалён.")
+
+
+@callback_router.route("regs_menu", admin_only=True)
+async def registrations_menu(query, context: ContextTypes.DEFAULT_TYPE):
+    text, reply_markup = await build_registrations_menu()
+    await query.edit_message_text(text, reply_markup=reply_markup)
+
+
+@callback_router.route("regs", admin_only=True)
+async def registrations_page(query, context: ContextTypes.DEFAULT_TYPE, code: str, *cursor):
+    # cursor — ключ REGISTRATION_ORDER последней показанной записи, на первой странице его нет
+    text, reply_markup = await build_registrations_page(code, cursor if cursor[1] is not None else None)
+    await query.edit_message_text(text, reply_markup=reply_markup)
+
+
+@callback_router.route("leave_review")
+async def leave_review(query, context: ContextTypes.DEFAULT_TYPE):
+    context.user_data['leave_review'] = True
+    await query.edit_message_text("Напишите ваш отзыв одним сообщением:")
+
+
+@callback_router.route("register")
+async def register_user(query, context: ContextTypes.DEFAULT_TYPE, event_type: str, event_id: int):
+    event = await db.get_event(event_type, event_id)
+    if not event:
+        return
+
     user_id = query.from_user.id
-    
-    if query.data == "view_oneshots":
-        oneshots = db.get_upcoming_oneshots()
-        if not oneshots:
-            keyboard = [[InlineKeyboardButton("Уведомить о появлении", callback_data="notify_oneshot")]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await query.edit_message_text(
-                "На данный момент не запланировано ваншотов",
-                reply_markup=reply_markup
-            )
-        else:
-            oneshot = oneshots[0]
-            keyboard = [[InlineKeyboardButton("Записаться", callback_data=f"register_oneshot_{oneshot['id']}")]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            text = "На данный момент планируется:\n\n" + format_oneshot_info(oneshot)
-            await query.edit_message_text(text, reply_markup=reply_markup)
-    
-    elif query.data == "view_campaigns":
-        campaigns = db.get_upcoming_campaigns()
-        if not campaigns:
-            keyboard = [[InlineKeyboardButton("Уведомить о появлении", callback_data="notify_campaign")]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await query.edit_message_text(
-                "На данный момент не запланировано кампаний",
-                reply_markup=reply_markup
-            )
-        else:
-            campaign = campaigns[0]
-            keyboard = [[InlineKeyboardButton("Записаться", callback_data=f"register_campaign_{campaign['id']}")]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            text = "На данный момент планируется:\n\n" + format_campaign_info(campaign)
-            await query.edit_message_text(text, reply_markup=reply_markup)
-    
-    elif query.data == "notify_oneshot":
-        db.add_notification_request(user_id, "oneshot")
-        await query.edit_message_text("Вы будете уведомлены, когда появится новый ваншот!")
-    
-    elif query.data == "notify_campaign":
-        db.add_notification_request(user_id, "campaign")
-        await query.edit_message_text("Вы будете уведомлены, когда появится новая кампания!")
-    
-    elif query.data.startswith("register_oneshot_"):
-        oneshot_id = int(query.data.split("_")[2])
-        oneshot = db.get_oneshot_by_id(oneshot_id)
-        
-        if oneshot:
-            username = query.from_user.username
-            first_name = query.from_user.first_name
-            
-            if db.register_for_oneshot(oneshot_id, user_id, username, first_name):
-                await query.edit_message_text(
-                    f'Спасибо! Вы записаны на "{oneshot["name"]}". '
-                    "Ближе ко дню мероприятия я пришлю вам напоминание!"
-                )
-                
-                # Уведомление админам
-                for admin_id in ADMIN_IDS:
-                    try:
-                        registrations = db.get_registered_users_for_oneshot(oneshot_id)
-                        user_info = f"@{username}" if username else first_name
-                        await context.bot.send_message(
-                            admin_id,
-                            f"Новая запись на ваншот!\n\n"
-                            f"Ваншот: {oneshot['name']}\n"
-                            f"Пользователь: {user_info}\n"
-                            f"Всего записей: {len(registrations)}"
-                        )
-                    except Exception as e:
-                        logger.error(f"Ошибка отправки уведомления админу {admin_id}: {e}")
-            else:
-                await query.edit_message_text("Вы уже записаны на это мероприятие!")
-    
-    elif query.data.startswith("register_campaign_"):
-        campaign_id = int(query.data.split("_")[2])
-        campaign = db.get_campaign_by_id(campaign_id)
-        
-        if campaign:
-            username = query.from_user.username
-            first_name = query.from_user.first_name
-            
-            if db.register_for_campaign(campaign_id, user_id, username, first_name):
-                await query.edit_message_text(
-                    f'Спасибо! Вы записаны на "{campaign["name"]}". '
-                    "Ближе ко дню мероприятия я пришлю вам напоминание!"
-                )
-                
-                # Уведомление админам
-                for admin_id in ADMIN_IDS:
-                    try:
-                        registrations = db.get_registered_users_for_campaign(campaign_id)
-                        user_info = f"@{username}" if username else first_name
-                        await context.bot.send_message(
-                            admin_id,
-                            f"Новая запись на кампанию!\n\n"
-                            f"Кампания: {campaign['name']}\n"
-                            f"Пользователь: {user_info}\n"
-                            f"Всего записей: {len(registrations)}"
-                        )
-                    except Exception as e:
-                        logger.error(f"Ошибка отправки уведомления админу {admin_id}: {e}")
-            else:
-                await query.edit_message_text("Вы уже записаны на это мероприятие!")
-    elif query.data.startswith("delete_event_"):
-        # delete_event_oneshot_123 или delete_event_campaign_456
-        if user_id not in ADMIN_IDS:
-            await query.answer("Недостаточно прав", show_alert=True)
-            return
+    username = query.from_user.username
+    first_name = query.from_user.first_name
 
-        parts = query.data.split("_")
-        # ["delete", "event", "oneshot", "123"]
-        if len(parts) != 4:
-            await query.edit_message_text("Не удалось распознать мероприятие для удаления.")
-            return
+    # Место выдаёт сама база одним выражением, поэтому одновременные записи не переполнят мероприятие
+    status = await db.register(event_type, event_id, user_id, username, first_name)
+    if status is None:
+        await query.edit_message_text("Вы уже записаны на это мероприятие!")
+        return
 
-        _, _, event_type, event_id_str = parts
-        event_id = int(event_id_str)
+    if status == REGISTRATION_WAITLIST:
+        await query.edit_message_text(
+            f'Свободных мест на "{event.name}" нет, вы в листе ожидания. '
+            "Если место освободится, я сразу вас запишу и сообщу!",
+            reply_markup=unregister_markup(event_type, event_id),
+        )
+    else:
+        await query.edit_message_text(
+            f'Спасибо! Вы записаны на "{event.name}". '
+            "Ближе ко дню мероприятия я пришлю вам напоминание!",
+            reply_markup=unregister_markup(event_type, event_id),
+        )
 
-        if event_type == "oneshot":
-            db.delete_oneshot(event_id)
-            await query.edit_message_text("Ваншот удалён.")
-        elif event_type == "campaign":
-            db.delete_campaign(event_id)
-            await query.edit_message_text("Кампания удалена.")
-        else:
-            await query.edit_message_text("Неизвестный тип мероприятия.")
-    elif query.data == "view_reviews":
-        reviews = db.get_all_reviews()
-        if not reviews:
-            text = "Пока нет отзывов."
-        else:
-            text = "Отзывы:\n\n"
-            for review_id, username, first_name, review_text, created_at in reviews:
-                user = f"@{username}" if username else first_name or "Пользователь"
-                text += f"{user} ({created_at[:16]}):\n{review_text}"
-                if user_id in ADMIN_IDS:
-                    text += f"\n[Удалить](/delete_review_{review_id})"
-                text += "\n\n"
-        keyboard = [
-            [InlineKeyboardButton("Записаться на ваншот", callback_data="view_oneshots")],
-            [InlineKeyboardButton("Присоединиться к D&D кампании", callback_data="view_campaigns")],
-            [InlineKeyboardButton("Посмотреть все отзывы", callback_data="view_reviews")],
-            [InlineKeyboardButton("Оставить отзыв", callback_data="leave_review")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        if user_id in ADMIN_IDS:
-            await query.edit_message_text(text, parse_mode="Markdown", disable_web_page_preview=True, reply_markup=reply_markup)
-        else:
-            await query.edit_message_text(text, reply_markup=reply_markup)
-    elif query.data.startswith("delete_review_"):
-        if user_id not in ADMIN_IDS:
-            await query.answer("Недостаточно прав", show_alert=True)
-            return
-        review_id = int(query.data.split("_")[2])
-        db.delete_review(review_id)
-        await query.edit_message_text("Отзыв удалён.")
-    elif query.data == "leave_review":
-        context.user_data['leave_review'] = True
-        await query.edit_message_text("Напишите ваш отзыв одним сообщением:")
-        # Не возвращаем WAITING_REVIEW_TEXT, просто завершаем функцию
+    # Уведомление админам
+    if not ADMIN_IDS:
+        return
+    confirmed, waitlist = await db.get_registration_counts(event_type, event_id)
+    user_info = f"@{username}" if username else first_name
+    text = (
+        f"{NEW_REGISTRATION_HEADERS[event_type]}\n\n"
+        f"{EVENT_TYPE_TITLES[event_type]}: {event.name}\n"
+        f"Пользователь: {user_info}"
+        f"{' (лист ожидания)' if status == REGISTRATION_WAITLIST else ''}\n"
+        f"Всего записей: {confirmed}"
+    )
+    if event.capacity:
+        text += f" из {event.capacity}"
+    if waitlist:
+        text += f", в листе ожидания: {waitlist}"
+    for admin_id in await live_admin_ids():
+        try:
+            await context.bot.send_message(admin_id, text)
+        except Exception as e:
+            logger.error(f"Ошибка отправки уведомления админу {admin_id}: {e}")
+            await handle_send_error(admin_id, e)
+
+
+@callback_router.route("unregister")
+async def unregister_user(query, context: ContextTypes.DEFAULT_TYPE, event_type: str, event_id: int):
+    removed, promoted_user_id = await db.cancel_registration(event_type, event_id, query.from_user.id)
+    if not removed:
+        await query.edit_message_text("Вы не записаны на это мероприятие.")
         return
+    await query.edit_message_text("Запись отменена.")
+
+    if promoted_user_id is not None:
+        event = await db.get_event(event_type, event_id)
+        try:
+            await context.bot.send_message(
+                promoted_user_id,
+                f'Освободилось место: вы записаны на "{event.name}"! '
+                "Ближе ко дню мероприятия я пришлю вам напоминание!",
+                reply_markup=unregister_markup(event_type, event_id),
+            )
+        except Exception as e:
+            logger.error(f"Ошибка отправки уведомления о месте пользователю {promoted_user_id}: {e}")
+            await handle_send_error(promoted_user_id, e)
 
 
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -284,7 +487,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     # Пересылаем сообщение админам
-    for admin_id in ADMIN_IDS:
+    for admin_id in await live_admin_ids():
         try:
             await context.bot.forward_message(
                 chat_id=admin_id,
@@ -293,47 +496,136 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
         except Exception as e:
             logger.error(f"Ошибка пересылки сообщения админу {admin_id}: {e}")
+            await handle_send_error(admin_id, e)
     
     # Отвечаем пользователю
     await message.reply_text(
         f"Передал ваше сообщение админам! Если необходимо связаться с Мастером Днд: {DM_CONTACT}"
     )
 
-async def show_all_registrations(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = update.effective_user.id
-    if user_id not in ADMIN_IDS:
-        return  # чужих сюда не пускаем
-
-    registrations = db.get_all_registrations()
-
-    if not registrations:
-        await update.message.reply_text("Пока что нет записей.")
-        return
+# Регистрации для админа показываются страницами с фильтрами
+REGISTRATIONS_PAGE_SIZE = 15
+EVENT_TYPE_BY_CODE = {"o": "oneshot", "c": "campaign"}
+
+
+def parse_registrations_filter(code: str) -> dict:
+    # u — предстоящие, uo/uc — предстоящие ваншоты/кампании,
+    # a — за всё время, eo<id>/ec<id> — одно мероприятие
+    if code.startswith("e"):
+        return {"event_type": EVENT_TYPE_BY_CODE[code[1]], "event_id": int(code[2:]), "upcoming_only": False}
+    if code == "a":
+        return {"event_type": None, "event_id": None, "upcoming_only": False}
+    return {"event_type": EVENT_TYPE_BY_CODE.get(code[1:2]), "event_id": None, "upcoming_only": True}
+
+
+async def build_registrations_menu():
+    keyboard = [
+        [InlineKeyboardButton("Все предстоящие", callback_data=encode_callback("regs", "u"))],
+        [InlineKeyboardButton("Ваншоты", callback_data=encode_callback("regs", "uo")),
+         InlineKeyboardButton("Кампании", callback_data=encode_callback("regs", "uc"))],
+        [InlineKeyboardButton("За всё время", callback_data=encode_callback("regs", "a"))],
+    ]
+    for o in await db.get_upcoming_oneshots():
+        keyboard.append([InlineKeyboardButton(f'Ваншот: {o.name} ({o.date_time})', callback_data=encode_callback("regs", f"eo{o.id}"))])
+    for c in await db.get_upcoming_campaigns():
+        keyboard.append([InlineKeyboardButton(f'Кампания: {c.name} ({c.date_time})', callback_data=encode_callback("regs", f"ec{c.id}"))])
+    return "Какие регистрации показать?", InlineKeyboardMarkup(keyboard)
+
+
+async def build_registrations_page(code: str, cursor=None):
+    registrations = await db.get_registrations_page(
+        **parse_registrations_filter(code),
+        cursor=cursor,
+        limit=REGISTRATIONS_PAGE_SIZE,
+    )
 
     lines = []
     for reg in registrations:
         # Ник / имя
-        if reg["username"]:
-            user_part = f"@{reg['username']}"
-        elif reg["first_name"]:
-            user_part = reg["first_name"]
+        if reg.username:
+            user_part = f"@{reg.username}"
+        elif reg.first_name:
+            user_part = reg.first_name
         else:
             user_part = "Пользователь"
 
-        # Ваншот или Кампания
-        if reg["event_type"] == "oneshot":
-            event_type_text = "Ваншот"
-        else:
-            event_type_text = "Кампания"
-
         line = (
-            f"{event_type_text}: \"{reg['event_name']}\"\n"
-            f"Пользователь {user_part}, id {reg['user_id']}"
+            f"{EVENT_TYPE_TITLES[reg.event_type]}: \"{reg.event_name}\" ({reg.date_time})\n"
+            f"Пользователь {user_part}, id {reg.user_id}"
         )
+        if reg.status == REGISTRATION_WAITLIST:
+            line += " — лист ожидания"
         lines.append(line)
 
-    text = "Все регистрации:\n\n" + "\n\n".join(lines)
-    await update.message.reply_text(text)
+    if lines:
+        text = "Регистрации:\n\n" + "\n\n".join(lines)
+    elif cursor is None:
+        text = "Пока что нет записей."
+    else:
+        text = "Больше записей нет."
+
+    nav_row = []
+    if cursor is not None:
+        nav_row.append(InlineKeyboardButton("« В начало", callback_data=encode_callback("regs", code)))
+    if len(registrations) == REGISTRATIONS_PAGE_SIZE:
+        last = registrations[-1]
+        nav_row.append(InlineKeyboardButton(
+            "Дальше »",
+            callback_data=encode_callback(
+                "regs", code, last.starts_at, last.event_id, last.event_type, last.registration_id
+            ),
+        ))
+    keyboard = [nav_row] if nav_row else []
+    keyboard.append([InlineKeyboardButton("К фильтрам", callback_data=encode_callback("regs_menu"))])
+    return text, InlineKeyboardMarkup(keyboard)
+
+
+async def show_all_registrations(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    if user_id not in ADMIN_IDS:
+        return  # чужих сюда не пускаем
+
+    text, reply_markup = await build_registrations_menu()
+    await update.message.reply_text(text, reply_markup=reply_markup)
+
+
+async def export_registrations_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # /export или /export xlsx — выгрузка всех регистраций файлом
+    user_id = update.effective_user.id
+    if user_id not in ADMIN_IDS:
+        return
+
+    file_format = "xlsx" if context.args and context.args[0].lower() == "xlsx" else "csv"
+    if file_format == "xlsx" and not XLSX_AVAILABLE:
+        await update.message.reply_text("Для XLSX нужен пакет openpyxl, выгружаю в CSV.")
+        file_format = "csv"
+
+    fileobj, count = await db.run_read(export_registrations, db.sync, file_format)
+    try:
+        if not count:
+            await update.message.reply_text("Пока что нет записей.")
+            return
+        await update.message.reply_document(
+            document=fileobj,
+            filename=f"registrations.{file_format}",
+            caption=f"Регистраций: {count}",
+        )
+    finally:
+        fileobj.close()
+
+
+CAPACITY_PROMPT = "Введите число мест (0 — без ограничения):"
+
+
+def parse_capacity(text: str):
+    # Число мест из сообщения админа: None — без ограничения, False — не число
+    try:
+        capacity = int(text.strip())
+    except ValueError:
+        return False
+    if capacity < 0:
+        return False
+    return capacity or None
 
 
 # Админ-панель для ваншотов
@@ -341,46 +633,48 @@ async def start_oneshot_registration(update: Update, context: ContextTypes.DEFAU
     if update.effective_user.id not in ADMIN_IDS:
         return ConversationHandler.END
     
-    admin_data[update.effective_user.id] = {}
+    context.user_data[ADMIN_DRAFT] = {}
     await update.message.reply_text("Введите название ваншота:")
     return WAITING_ONESHOT_NAME
 
 
 async def oneshot_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = update.effective_user.id
-    admin_data[user_id]["name"] = update.message.text
+    context.user_data[ADMIN_DRAFT]["name"] = update.message.text
     await update.message.reply_text("Введите дату и время (формат: ГГГГ-ММ-ДД ЧЧ:ММ):")
     return WAITING_ONESHOT_DATE
 
 
 async def oneshot_date(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = update.effective_user.id
-    admin_data[user_id]["date_time"] = update.message.text
+    context.user_data[ADMIN_DRAFT]["date_time"] = update.message.text
     await update.message.reply_text("Введите сюжет:")
     return WAITING_ONESHOT_STORY
 
 
 async def oneshot_story(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = update.effective_user.id
-    admin_data[user_id]["story"] = update.message.text
+    context.user_data[ADMIN_DRAFT]["story"] = update.message.text
     await update.message.reply_text("Введите локацию:")
     return WAITING_ONESHOT_LOCATION
 
 
 async def oneshot_location(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = update.effective_user.id
-    admin_data[user_id]["location"] = update.message.text
+    context.user_data[ADMIN_DRAFT]["location"] = update.message.text
     await update.message.reply_text("Введите стоимость:")
     return WAITING_ONESHOT_PRICE
 
 
 async def oneshot_price(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = update.effective_user.id
-    admin_data[user_id]["price"] = update.message.text
-    keyboard = [[InlineKeyboardButton("Да", callback_data="oneshot_drink_yes"),
-                 InlineKeyboardButton("Нет", callback_data="oneshot_drink_no")]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await update.message.reply_text("В стоимость входит бесплатный напиток?", reply_markup=reply_markup)
+    context.user_data[ADMIN_DRAFT]["price"] = update.message.text
+    await update.message.reply_text(CAPACITY_PROMPT)
+    return WAITING_ONESHOT_CAPACITY
+
+
+async def oneshot_capacity(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    capacity = parse_capacity(update.message.text)
+    if capacity is False:
+        await update.message.reply_text(CAPACITY_PROMPT)
+        return WAITING_ONESHOT_CAPACITY
+    context.user_data[ADMIN_DRAFT]["capacity"] = capacity
+    await update.message.reply_text("В стоимость входит бесплатный напиток?", reply_markup=DRINK_MARKUPS["oneshot"])
     return WAITING_ONESHOT_DRINK
 
 
@@ -390,33 +684,27 @@ async def oneshot_drink(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = query.from_user.id
     
     free_drink = query.data == "oneshot_drink_yes"
-    admin_data[user_id]["free_drink"] = free_drink
+    context.user_data[ADMIN_DRAFT]["free_drink"] = free_drink
     
     # Сохраняем ваншот
-    data = admin_data[user_id]
-    oneshot_id = db.add_oneshot(
+    data = context.user_data[ADMIN_DRAFT]
+    oneshot_id = await db.add_oneshot(
         data["name"],
         data["date_time"],
         data["story"],
         data["location"],
         data["price"],
-        data["free_drink"]
+        data["free_drink"],
+        capacity=data.get("capacity"),
     )
     
-    # Уведомляем пользователей, которые подписались на уведомления
-    user_ids = db.get_users_to_notify("oneshot")
-    oneshot = db.get_oneshot_by_id(oneshot_id)
-    
-    for uid in user_ids:
-        try:
-            keyboard = [[InlineKeyboardButton("Записаться", callback_data=f"register_oneshot_{oneshot_id}")]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            text = "Появился новый ваншот!\n\n" + format_oneshot_info(oneshot)
-            await context.bot.send_message(uid, text, reply_markup=reply_markup)
-        except Exception as e:
-            logger.error(f"Ошибка отправки уведомления пользователю {uid}: {e}")
-    
-    del admin_data[user_id]
+    oneshot = await db.get_oneshot_by_id(oneshot_id)
+    track_event_reminders(context.job_queue, "oneshot", oneshot)
+
+    # Рассылка подписчикам идёт в фоне, админ сразу получает ответ
+    await enqueue_announcement(context, user_id, "oneshot", oneshot_id)
+
+    context.user_data.pop(ADMIN_DRAFT, None)
     await query.edit_message_text(f"Ваншот '{data['name']}' успешно зарегистрирован!")
     return ConversationHandler.END
 
@@ -426,53 +714,54 @@ async def start_campaign_registration(update: Update, context: ContextTypes.DEFA
     if update.effective_user.id not in ADMIN_IDS:
         return ConversationHandler.END
     
-    admin_data[update.effective_user.id] = {}
+    context.user_data[ADMIN_DRAFT] = {}
     await update.message.reply_text("Введите название кампании:")
     return WAITING_CAMPAIGN_NAME
 
 
 async def campaign_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = update.effective_user.id
-    admin_data[user_id]["name"] = update.message.text
+    context.user_data[ADMIN_DRAFT]["name"] = update.message.text
     await update.message.reply_text("Введите дату и время (формат: ГГГГ-ММ-ДД ЧЧ:ММ):")
     return WAITING_CAMPAIGN_DATE
 
 
 async def campaign_date(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = update.effective_user.id
-    admin_data[user_id]["date_time"] = update.message.text
+    context.user_data[ADMIN_DRAFT]["date_time"] = update.message.text
     await update.message.reply_text("Введите длительность:")
     return WAITING_CAMPAIGN_DURATION
 
 
 async def campaign_duration(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = update.effective_user.id
-    admin_data[user_id]["duration"] = update.message.text
+    context.user_data[ADMIN_DRAFT]["duration"] = update.message.text
     await update.message.reply_text("Введите сюжет:")
     return WAITING_CAMPAIGN_STORY
 
 
 async def campaign_story(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = update.effective_user.id
-    admin_data[user_id]["story"] = update.message.text
+    context.user_data[ADMIN_DRAFT]["story"] = update.message.text
     await update.message.reply_text("Введите локацию:")
     return WAITING_CAMPAIGN_LOCATION
 
 
 async def campaign_location(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = update.effective_user.id
-    admin_data[user_id]["location"] = update.message.text
+    context.user_data[ADMIN_DRAFT]["location"] = update.message.text
     await update.message.reply_text("Введите стоимость:")
     return WAITING_CAMPAIGN_PRICE
 
 
 async def campaign_price(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = update.effective_user.id
-    admin_data[user_id]["price"] = update.message.text
-    keyboard = [[InlineKeyboardButton("Да", callback_data="campaign_drink_yes"),
-                 InlineKeyboardButton("Нет", callback_data="campaign_drink_no")]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await update.message.reply_text("В стоимость входит бесплатный напиток?", reply_markup=reply_markup)
+    context.user_data[ADMIN_DRAFT]["price"] = update.message.text
+    await update.message.reply_text(CAPACITY_PROMPT)
+    return WAITING_CAMPAIGN_CAPACITY
+
+
+async def campaign_capacity(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    capacity = parse_capacity(update.message.text)
+    if capacity is False:
+        await update.message.reply_text(CAPACITY_PROMPT)
+        return WAITING_CAMPAIGN_CAPACITY
+    context.user_data[ADMIN_DRAFT]["capacity"] = capacity
+    await update.message.reply_text("В стоимость входит бесплатный напиток?", reply_markup=DRINK_MARKUPS["campaign"])
     return WAITING_CAMPAIGN_DRINK
 
 
@@ -482,117 +771,196 @@ async def campaign_drink(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = query.from_user.id
     
     free_drink = query.data == "campaign_drink_yes"
-    admin_data[user_id]["free_drink"] = free_drink
+    context.user_data[ADMIN_DRAFT]["free_drink"] = free_drink
     
     # Сохраняем кампанию
-    data = admin_data[user_id]
-    campaign_id = db.add_campaign(
+    data = context.user_data[ADMIN_DRAFT]
+    campaign_id = await db.add_campaign(
         data["name"],
         data["date_time"],
         data["duration"],
         data["story"],
         data["location"],
         data["price"],
-        data["free_drink"]
+        data["free_drink"],
+        capacity=data.get("capacity"),
     )
     
-    # Уведомляем пользователей, которые подписались на уведомления
-    user_ids = db.get_users_to_notify("campaign")
-    campaign = db.get_campaign_by_id(campaign_id)
-    
-    for uid in user_ids:
-        try:
-            keyboard = [[InlineKeyboardButton("Записаться", callback_data=f"register_campaign_{campaign_id}")]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            text = "Появилась новая кампания!\n\n" + format_campaign_info(campaign)
-            await context.bot.send_message(uid, text, reply_markup=reply_markup)
-        except Exception as e:
-            logger.error(f"Ошибка отправки уведомления пользователю {uid}: {e}")
-    
-    del admin_data[user_id]
+    campaign = await db.get_campaign_by_id(campaign_id)
+    track_event_reminders(context.job_queue, "campaign", campaign)
+
+    # Рассылка подписчикам идёт в фоне, админ сразу получает ответ
+    await enqueue_announcement(context, user_id, "campaign", campaign_id)
+
+    context.user_data.pop(ADMIN_DRAFT, None)
     await query.edit_message_text(f"Кампания '{data['name']}' успешно зарегистрирована!")
     return ConversationHandler.END
 
 
+async def enqueue_announcement(context: ContextTypes.DEFAULT_TYPE, admin_id: int, event_type: str, event_id: int):
+    # Рассылку запускает владелец аренды: сразу, если это мы, иначе — при следующей проверке
+    await db.enqueue_broadcast(event_type, event_id, admin_id)
+    if job_lease.held:
+        context.application.create_task(start_pending_broadcasts(context.application))
+
+
+async def start_pending_broadcasts(application: Application):
+    # Рассылки забираются из базы один раз: если владелец упадёт посреди рассылки,
+    # её не повторят, чтобы никто не получил уведомление дважды
+    for broadcast in await db.claim_broadcasts(job_lease.owner):
+        application.create_task(run_broadcast(application.bot, broadcast))
+
+
+async def run_broadcast(bot, broadcast: dict):
+    try:
+        event = await db.get_event(broadcast["event_type"], broadcast["event_id"])
+        if event is not None:
+            await announce_event(bot, broadcast["admin_id"], broadcast["event_type"], event)
+    except Exception as e:
+        logger.error(f"Ошибка рассылки {broadcast['id']}: {e}")
+    finally:
+        await db.finish_broadcast(broadcast["id"])
+
+
+async def announce_event(bot, admin_id: int, event_type: str, event: Event):
+    # Уведомляем пользователей, которые подписались на уведомления. Подписчики читаются
+    # из базы страницами по ходу рассылки, а не загружаются в память все сразу
+    total = await db.get_subscriber_count(event_type)
+    if not total:
+        return
+
+    text = f"{NEW_EVENT_HEADERS[event_type]}\n\n" + format_event_info(event_type, event)
+    reply_markup = register_markup(event_type, event.id)
+
+    # Прогресс — не повод отменять рассылку: если админу не написать, шлём без него
+    try:
+        status = await bot.send_message(admin_id, f"Рассылка: отправлено 0 из {total}")
+    except Exception as e:
+        logger.error(f"Не удалось отправить прогресс рассылки админу {admin_id}: {e}")
+        await handle_send_error(admin_id, e)
+        status = None
+
+    async def report_progress(sent: int, failed: int, total: int, done: bool):
+        progress = f"отправлено {sent} из {total}"
+        if failed:
+            progress += f", ошибок: {failed}"
+        try:
+            if done:
+                await status.edit_text(f"Рассылка завершена: {progress}")
+            else:
+                await status.edit_text(f"Рассылка: {progress}")
+        except Exception as e:
+            logger.warning(f"Не удалось обновить прогресс рассылки: {e}")
+
+    await broadcaster.run(
+        bot, db.iter_users_to_notify(event_type), text,
+        on_progress=report_progress if status else None, total=total, reply_markup=reply_markup,
+    )
+
+
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = update.effective_user.id
-    if user_id in admin_data:
-        del admin_data[user_id]
+    context.user_data.pop(ADMIN_DRAFT, None)
     await update.message.reply_text("Отменено.")
     return ConversationHandler.END
 
 
-async def check_and_send_reminders(context: ContextTypes.DEFAULT_TYPE):
-    registrations = db.get_all_registrations_for_reminders()
-    now = datetime.now()
-    
-    for reg in registrations:
+# Сколько отправленных напоминаний отмечать в базе одним коммитом
+REMINDER_MARK_BATCH = 100
+# Через сколько секунд повторить напоминание тем, кому отправка не удалась
+REMINDER_RETRY_DELAY = 60
+
+
+async def send_event_reminders(context: ContextTypes.DEFAULT_TYPE, reminder: DueReminder, now: int = None):
+    # Одним запросом получаем только тех, кому это напоминание ещё не отправлялось
+    event, user_ids = await db.get_pending_reminders(reminder.event_type, reminder.event_id, reminder.reminder_type)
+    if not user_ids:
+        return
+
+    message = (
+        f'Напоминание: через {reminder.reminder_text} начнется '
+        f'{EVENT_TYPE_NAMES[reminder.event_type]} "{event.name}"!\n\n'
+    )
+    message += format_event_info(reminder.event_type, event)
+
+    # Отправка через broadcaster: общий с рассылками лимит Bot API, повторы после
+    # RetryAfter и сетевых ошибок, недоступные чаты отмечаются в dead_chats
+    sent = []
+
+    async def record(user_id: int, delivered: bool):
+        nonlocal sent
+        if not delivered:
+            return
+        sent.append((reminder.event_type, reminder.event_id, user_id, reminder.reminder_type))
+        if len(sent) >= REMINDER_MARK_BATCH:
+            batch, sent = sent, []
+            await db.mark_reminders_sent(batch)
+
+    delivered, failed = await broadcaster.run(context.bot, user_ids, message, on_result=record)
+    if sent:
+        await db.mark_reminders_sent(sent)
+    logger.info(f"Напоминание {reminder.reminder_type} о {event.name}: отправлено {delivered}, ошибок {failed}")
+
+    # Неотмеченные получат напоминание при повторе; заблокировавших бота
+    # get_pending_reminders уже не вернёт
+    if failed:
+        retry_at = (int(time.time()) if now is None else now) + REMINDER_RETRY_DELAY
+        if reminder_scheduler.retry(reminder, retry_at):
+            logger.warning(
+                f"Напоминание {reminder.reminder_type} о {event.name} не дошло до {failed} пользователей, "
+                f"повтор через {REMINDER_RETRY_DELAY} с"
+            )
+
+
+async def check_and_send_reminders(context: ContextTypes.DEFAULT_TYPE, now: int = None):
+    # now задаётся в бенчмарке (tools/bench_reminders.py), чтобы остановить часы на границе напоминаний
+    if not job_lease.held:
+        return
+    now = int(time.time()) if now is None else now
+    for reminder in reminder_scheduler.pop_due(now):
         try:
-            event_date = datetime.strptime(reg["date_time"], "%Y-%m-%d %H:%M")
-            
-            # Проверяем разные типы напоминаний
-            reminders_to_check = [
-                (timedelta(days=3), "3_days", "3 дня"),
-                (timedelta(days=1), "1_day", "1 день"),
-                (timedelta(hours=6), "6_hours", "6 часов")
-            ]
-            
-            for time_delta, reminder_type, reminder_text in reminders_to_check:
-                reminder_time = event_date - time_delta
-                
-                # Проверяем, нужно ли отправить напоминание (за последний час)
-                time_diff = (now - reminder_time).total_seconds()
-                if 0 <= time_diff < 3600:
-                    # Проверяем, не было ли уже отправлено это напоминание
-                    if not db.was_reminder_sent(
-                        reg["event_type"],
-                        reg["event_id"],
-                        reg["user_id"],
-                        reminder_type
-                    ):
-                        message = None
-                        # Отправляем напоминание
-                        if reg["event_type"] == "oneshot":
-                            event = db.get_oneshot_by_id(reg["event_id"])
-                            if event:
-                                message = f'Напоминание: через {reminder_text} начнется ваншот "{reg["name"]}"!\n\n'
-                                message += format_oneshot_info(event)
-                        else:  # campaign
-                            event = db.get_campaign_by_id(reg["event_id"])
-                            if event:
-                                message = f'Напоминание: через {reminder_text} начнется кампания "{reg["name"]}"!\n\n'
-                                message += format_campaign_info(event)
-                        
-                        if message:
-                            try:
-                                await context.bot.send_message(reg["user_id"], message)
-                                db.mark_reminder_sent(
-                                    reg["event_type"],
-                                    reg["event_id"],
-                                    reg["user_id"],
-                                    reminder_type
-                                )
-                                logger.info(f"Отправлено напоминание {reminder_type} пользователю {reg['user_id']} о {reg['name']}")
-                            except Exception as e:
-                                logger.error(f"Ошибка отправки напоминания пользователю {reg['user_id']}: {e}")
-        
-        except ValueError as e:
-            logger.error(f"Ошибка парсинга даты для {reg.get('name', 'unknown')}: {e}")
+            await send_event_reminders(context, reminder, now)
         except Exception as e:
             logger.error(f"Ошибка обработки напоминания: {e}")
+            # Неотмеченные пользователи получат его при повторе
+            reminder_scheduler.retry(reminder, now + REMINDER_RETRY_DELAY)
+    schedule_next_reminder(context.job_queue)
 
 
 async def reminder_job(context: ContextTypes.DEFAULT_TYPE):
     await check_and_send_reminders(context)
 
 
+def schedule_next_reminder(job_queue):
+    if job_queue is None:
+        return
+    for job in job_queue.get_jobs_by_name(REMINDER_JOB_NAME):
+        job.schedule_removal()
+    due_at = reminder_scheduler.next_due_at()
+    if due_at is not None:
+        job_queue.run_once(reminder_job, when=max(0, due_at - time.time()), name=REMINDER_JOB_NAME)
+
+
+def track_event_reminders(job_queue, event_type: str, event: Event):
+    # Без аренды очередь напоминаний не ведём: владелец увидит мероприятие
+    # по счётчику изменений при следующей проверке
+    if not job_lease.held:
+        return
+    reminder_scheduler.add_event(event_type, event.id, event.starts_at, int(time.time()))
+    schedule_next_reminder(job_queue)
+
+
+def untrack_event_reminders(job_queue, event_type: str, event_id: int):
+    reminder_scheduler.remove_event(event_type, event_id)
+    schedule_next_reminder(job_queue)
+
+
 async def start_delete_event(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     if user_id not in ADMIN_IDS:
         return
 
-    oneshots = db.get_upcoming_oneshots()
-    campaigns = db.get_upcoming_campaigns()
+    oneshots = await db.get_upcoming_oneshots()
+    campaigns = await db.get_upcoming_campaigns()
 
     if not oneshots and not campaigns:
         await update.message.reply_text("Пока нет мероприятий для удаления.")
@@ -603,16 +971,16 @@ async def start_delete_event(update: Update, context: ContextTypes.DEFAULT_TYPE)
     for o in oneshots:
         keyboard.append(
             [InlineKeyboardButton(
-                f'Ваншот: {o["name"]} ({o["date_time"]})',
-                callback_data=f'delete_event_oneshot_{o["id"]}',
+                f'Ваншот: {o.name} ({o.date_time})',
+                callback_data=encode_callback("delete_event", "oneshot", o.id),
             )]
         )
 
     for c in campaigns:
         keyboard.append(
             [InlineKeyboardButton(
-                f'Кампания: {c["name"]} ({c["date_time"]})',
-                callback_data=f'delete_event_campaign_{c["id"]}',
+                f'Кампания: {c.name} ({c.date_time})',
+                callback_data=encode_callback("delete_event", "campaign", c.id),
             )]
         )
 
@@ -624,17 +992,8 @@ async def start_delete_review(update: Update, context: ContextTypes.DEFAULT_TYPE
     user_id = update.effective_user.id
     if user_id not in ADMIN_IDS:
         return
-    reviews = db.get_all_reviews()
-    if not reviews:
-        await update.message.reply_text("Пока нет отзывов для удаления.")
-        return
-    keyboard = []
-    for review_id, username, first_name, review_text, created_at in reviews:
-        user = f"@{username}" if username else first_name or "Пользователь"
-        label = f"{user} ({created_at[:16]})"
-        keyboard.append([InlineKeyboardButton(f"Удалить: {label}", callback_data=f"delete_review_{review_id}")])
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await update.message.reply_text("Выберите отзыв для удаления:", reply_markup=reply_markup)
+    text, reply_markup = await build_delete_reviews_page()
+    await update.message.reply_text(text, reply_markup=reply_markup)
 
 
 # --- Обработчик обычных сообщений (отзыв или пересылка админу) ---
@@ -644,33 +1003,137 @@ async def universal_message_handler(update: Update, context: ContextTypes.DEFAUL
         username = update.effective_user.username
         first_name = update.effective_user.first_name
         text = update.message.text
-        db.add_review(user_id, username, first_name, text)
-        keyboard = [
-            [InlineKeyboardButton("Записаться на ваншот", callback_data="view_oneshots")],
-            [InlineKeyboardButton("Присоединиться к D&D кампании", callback_data="view_campaigns")],
-            [InlineKeyboardButton("Посмотреть все отзывы", callback_data="view_reviews")],
-            [InlineKeyboardButton("Оставить отзыв", callback_data="leave_review")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await update.message.reply_text("Спасибо за ваш отзыв!", reply_markup=reply_markup)
+        await db.add_review(user_id, username, first_name, text)
+        await update.message.reply_text("Спасибо за ваш отзыв!", reply_markup=MAIN_MENU_MARKUP)
         context.user_data.pop('leave_review', None)
     else:
         await handle_message(update, context)
 
 
-def main():
-    from config import BOT_TOKEN
+async def load_event_reminders(job_queue, now: int = None):
+    # Восстанавливаем очередь напоминаний; пропущенные за время простоя
+    # напоминания в пределах REMINDER_CATCHUP_MINUTES отправятся сразу
+    events = [("oneshot", o.id, o.starts_at) for o in await db.get_upcoming_oneshots()]
+    events += [("campaign", c.id, c.starts_at) for c in await db.get_upcoming_campaigns()]
+    reminder_scheduler.replace_events(events, int(time.time()) if now is None else now)
+    schedule_next_reminder(job_queue)
+
+
+async def coordination_job(context: ContextTypes.DEFAULT_TYPE):
+    # Мероприятия могли измениться в другом процессе: сбрасываем кэш списков
+    events_changed = await db.refresh_events_version()
+    was_held = job_lease.held
+    if await job_lease.renew():
+        if not was_held:
+            logger.info("Получена аренда фоновых задач: напоминания и рассылки выполняет этот процесс")
+        if not was_held or events_changed:
+            await load_event_reminders(context.job_queue)
+        await start_pending_broadcasts(context.application)
+    elif was_held:
+        logger.warning("Аренда фоновых задач потеряна")
+        reminder_scheduler.replace_events([], int(time.time()))
+        schedule_next_reminder(context.job_queue)
+
+
+async def on_startup(application: Application):
+    if application.job_queue is None:
+        logger.warning("JobQueue не инициализирован, напоминания работать не будут")
+        return
+    # first=0 у интервального триггера APScheduler уже в прошлом, и первый запуск
+    # случился бы только через interval
+    application.job_queue.run_repeating(
+        coordination_job, interval=COORDINATION_INTERVAL, first=1, name=COORDINATION_JOB_NAME
+    )
+
 
-    application = Application.builder().token(BOT_TOKEN).build()
+async def on_shutdown(application: Application):
+    await job_lease.release()
+    await db.close()
+
+
+def instrument_handler(callback):
+    # Время работы и исключения обработчика
+    handler = callback.__name__
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        started = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except Exception:
+            HANDLER_ERRORS.inc(handler)
+            raise
+        finally:
+            HANDLER_DURATION.observe(time.perf_counter() - started, handler)
+
+    return wrapper
+
+
+def instrument_handlers(handlers):
+    for handler in handlers:
+        if isinstance(handler, ConversationHandler):
+            instrument_handlers(handler.entry_points)
+            for state_handlers in handler.states.values():
+                instrument_handlers(state_handlers)
+            instrument_handlers(handler.fallbacks)
+        elif isinstance(handler, BaseHandler):
+            if handler.callback is button_callback:
+                # Время и ошибки по маршрутам пишет callback_router
+                continue
+            handler.callback = instrument_handler(handler.callback)
+
+
+def register_runtime_metrics(application: Application):
+    gauge("bot_update_queue_size", "Обновления, ожидающие обработки", application.update_queue.qsize)
+    gauge(
+        "bot_update_users_in_progress", "Пользователи, чьи обновления обрабатываются или ждут очереди",
+        lambda: getattr(application.update_processor, "active_users", 0),
+    )
+    gauge("bot_reminder_queue_size", "Запланированные напоминания в очереди", lambda: len(reminder_scheduler))
+    gauge("bot_broadcast_pending_messages", "Сообщения рассылок, ожидающие отправки", lambda: broadcaster.pending)
+    gauge("bot_job_lease_held", "1, если этот процесс выполняет напоминания и рассылки", lambda: int(job_lease.held))
+    cache = db.upcoming_cache
+    CallbackMetric(
+        "bot_cache_requests_total", "Обращения к кэшу предстоящих мероприятий",
+        lambda: [(("upcoming_events", "hit"), cache.hits), (("upcoming_events", "miss"), cache.misses)],
+        labelnames=["cache", "result"], kind="counter",
+    )
+
+
+def build_application(
+    token: str,
+    request: BaseRequest = None,
+    get_updates_request: BaseRequest = None,
+    post_init=on_startup,
+) -> Application:
+    builder = (
+        Application.builder()
+        .token(token)
+        .post_init(post_init)
+        .post_shutdown(on_shutdown)
+        .persistence(SQLitePersistence(db))
+        # Свой транспорт Bot API (например, заглушка в бенчмарках из tools/) тоже замеряется
+        .request(InstrumentedRequest(request))
+    )
+    # Обновления разных пользователей обрабатываются параллельно, одного — по очереди
+    if CONCURRENT_UPDATES > 1:
+        builder = builder.concurrent_updates(PerUserUpdateProcessor(CONCURRENT_UPDATES))
+    if get_updates_request is not None:
+        builder = builder.get_updates_request(get_updates_request)
+    application = builder.build()
 
     # --- Базовые хэндлеры ---
     # /start
     application.add_handler(CommandHandler("start", start))
+    # /export — выгрузка регистраций для админов
+    application.add_handler(CommandHandler("export", export_registrations_command))
 
     # --- Админские диалоги (ConversationHandler-ы) ---
 
     # Ваншоты
     oneshot_conv_handler = ConversationHandler(
+        name="oneshot_registration",
+        persistent=True,
         entry_points=[
             MessageHandler(
                 filters.Regex("^Зарегистрировать ваншот$"),
@@ -693,6 +1156,9 @@ def main():
             WAITING_ONESHOT_PRICE: [
                 MessageHandler(filters.TEXT & ~filters.COMMAND, oneshot_price)
             ],
+            WAITING_ONESHOT_CAPACITY: [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, oneshot_capacity)
+            ],
             WAITING_ONESHOT_DRINK: [
                 CallbackQueryHandler(oneshot_drink, pattern="^oneshot_drink_")
             ],
@@ -702,6 +1168,8 @@ def main():
 
     # Кампании
     campaign_conv_handler = ConversationHandler(
+        name="campaign_registration",
+        persistent=True,
         entry_points=[
             MessageHandler(
                 filters.Regex("^Зарегистрировать кампанию$"),
@@ -727,6 +1195,9 @@ def main():
             WAITING_CAMPAIGN_PRICE: [
                 MessageHandler(filters.TEXT & ~filters.COMMAND, campaign_price)
             ],
+            WAITING_CAMPAIGN_CAPACITY: [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, campaign_capacity)
+            ],
             WAITING_CAMPAIGN_DRINK: [
                 CallbackQueryHandler(campaign_drink, pattern="^campaign_drink_")
             ],
@@ -771,14 +1242,101 @@ def main():
     # --- Обработчик обычных сообщений (универсальный) ---
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, universal_message_handler), group=-1)
 
-    # --- JobQueue для напоминаний ---
-    job_queue = application.job_queue
-    if job_queue is not None:
-        job_queue.run_repeating(reminder_job, interval=1800, first=60)
-    else:
-        logger.warning("JobQueue не инициализирован, напоминания работать не будут")
+    for handlers in application.handlers.values():
+        instrument_handlers(handlers)
+    register_runtime_metrics(application)
+    return application
+
+
+async def run_webhook(application: Application):
+    # Свой HTTP-сервер вместо Application.run_webhook, чтобы на том же порту
+    # можно было обслуживать и другие адреса
+    from config import WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET, HTTP_LISTEN, HTTP_PORT
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
 
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    # post_init/post_shutdown сами вызываются только в run_polling/run_webhook
+    await application.initialize()
+    await on_startup(application)
+    await application.start()
+    server = start_http_server(
+        make_web_app(application_dispatcher(application), WEBHOOK_PATH, WEBHOOK_SECRET), HTTP_PORT, HTTP_LISTEN
+    )
+    await application.bot.set_webhook(
+        url=WEBHOOK_URL + WEBHOOK_PATH,
+        secret_token=WEBHOOK_SECRET,
+        allowed_updates=Update.ALL_TYPES,
+    )
+    try:
+        await stop.wait()
+    finally:
+        server.stop()
+        await application.stop()
+        await application.shutdown()
+        await on_shutdown(application)
+
+
+async def serve_worker(application: Application, updates, metrics_port: int = None):
+    # Процесс-обработчик: обновления приходят из очереди главного процесса, None — остановка
+    from config import HTTP_LISTEN
+
+    loop = asyncio.get_running_loop()
+    await application.initialize()
+    await on_startup(application)
+    await application.start()
+    server = start_http_server(make_web_app(), metrics_port, HTTP_LISTEN) if metrics_port else None
+    try:
+        while True:
+            data = await loop.run_in_executor(None, updates.get)
+            if data is None:
+                break
+            update = Update.de_json(data, application.bot)
+            if update is not None:
+                await application.update_queue.put(update)
+    finally:
+        if server is not None:
+            server.stop()
+        # stop() дожидается обработки обновлений, уже лежащих в очереди приложения
+        await application.stop()
+        await application.shutdown()
+        await on_shutdown(application)
+
+
+def run_worker_process(index: int, updates, request: BaseRequest = None, metrics_port: int = None):
+    # Точка входа процесса-обработчика (см. workers.WorkerPool); /metrics процесса
+    # отдаётся на своём порту metrics_port + index
+    from config import BOT_TOKEN
+
+    logger.info(f"Процесс-обработчик {index} запущен")
+    application = build_application(BOT_TOKEN, request=request)
+    asyncio.run(serve_worker(application, updates, metrics_port + index if metrics_port else None))
+
+
+async def on_startup_polling(application: Application):
+    # В режиме long polling HTTP-сервер нужен только для /metrics
+    from config import HTTP_LISTEN, HTTP_PORT
+
+    start_http_server(make_web_app(), HTTP_PORT, HTTP_LISTEN)
+    await on_startup(application)
+
+
+def main():
+    from config import BOT_TOKEN, WEBHOOK_URL, WORKERS, HTTP_PORT
+
+    if WORKERS > 1:
+        # Главный процесс занимает HTTP_PORT, процессы-обработчики — следующие порты
+        pool = WorkerPool(WORKERS, run_worker_process, None, HTTP_PORT + 1)
+        asyncio.run(run_intake(pool, BOT_TOKEN))
+        return
+
+    if WEBHOOK_URL:
+        asyncio.run(run_webhook(build_application(BOT_TOKEN)))
+    else:
+        application = build_application(BOT_TOKEN, post_init=on_startup_polling)
+        application.run_polling(allowed_updates=Update.ALL_TYPES)
 
 
 
@@ -0,0 +1,191 @@
+import asyncio
+import logging
+import time
+from typing import AsyncIterable, Awaitable, Callable, Dict, Iterable, Optional, Union
+
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TimedOut
+
+logger = logging.getLogger(__name__)
+
+# Колбэк прогресса: (отправлено, ошибок, всего, завершено)
+ProgressCallback = Callable[[int, int, int, bool], Awaitable[None]]
+# Колбэк результата отправки в один чат: (chat_id, доставлено)
+ResultCallback = Callable[[int, bool], Awaitable[None]]
+# Колбэк недоступного чата: (chat_id, причина из dead_chat_reason)
+DeadChatCallback = Callable[[int, str], Awaitable[None]]
+
+
+def dead_chat_reason(error: Exception) -> Optional[str]:
+    # Ошибки, после которых писать в чат бесполезно: бот заблокирован
+    # (или пользователь удалён), либо чата больше нет
+    if isinstance(error, Forbidden):
+        return "forbidden"
+    if isinstance(error, BadRequest) and "chat not found" in error.message.lower():
+        return "chat_not_found"
+    return None
+
+
+async def _iterate(chat_ids: Iterable[int]):
+    for chat_id in chat_ids:
+        yield chat_id
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    async def acquire(self):
+        # Под замком, чтобы ожидающие получали токены по очереди
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        # После RetryAfter Telegram не принимает сообщения — обнуляем запас токенов
+        self._refill()
+        self.tokens = -seconds * self.rate
+
+
+class Broadcaster:
+    """Фоновая рассылка с ограничением скорости под лимиты Bot API.
+
+    Общий лимит — около 30 сообщений в секунду на бота, в один чат — не чаще
+    одного сообщения в секунду. RetryAfter приостанавливает всю рассылку
+    на указанное Telegram время, после чего сообщение отправляется повторно.
+    Чаты, которые заблокировали бота или удалены, передаются в on_dead_chat.
+    """
+
+    def __init__(
+        self,
+        global_rate: float = 25,
+        per_chat_interval: float = 1.0,
+        concurrency: int = 10,
+        max_retries: int = 3,
+        on_dead_chat: Optional[DeadChatCallback] = None,
+    ):
+        self.global_bucket = TokenBucket(rate=global_rate, capacity=global_rate)
+        self.per_chat_interval = per_chat_interval
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.on_dead_chat = on_dead_chat
+        self._chat_next_at: Dict[int, float] = {}
+        # Сколько сообщений ещё ждут отправки во всех активных рассылках
+        self.pending = 0
+
+    async def _wait_for_chat(self, chat_id: int):
+        now = time.monotonic()
+        next_at = self._chat_next_at.get(chat_id, now)
+        self._chat_next_at[chat_id] = max(now, next_at) + self.per_chat_interval
+        if next_at > now:
+            await asyncio.sleep(next_at - now)
+        if len(self._chat_next_at) > 10000:
+            self._chat_next_at = {cid: t for cid, t in self._chat_next_at.items() if t > now}
+
+    async def send(self, bot, chat_id: int, text: str, **kwargs) -> bool:
+        for attempt in range(self.max_retries + 1):
+            await self._wait_for_chat(chat_id)
+            await self.global_bucket.acquire()
+            try:
+                await bot.send_message(chat_id, text, **kwargs)
+                return True
+            except RetryAfter as e:
+                logger.warning(f"RetryAfter {e.retry_after} с при отправке пользователю {chat_id}")
+                self.global_bucket.pause(e.retry_after)
+            except (Forbidden, BadRequest) as e:
+                # Повтор не поможет (BadRequest — подкласс NetworkError, поэтому ловится раньше)
+                reason = dead_chat_reason(e)
+                if reason is not None and self.on_dead_chat is not None:
+                    try:
+                        await self.on_dead_chat(chat_id, reason)
+                    except Exception as dead_error:
+                        logger.error(f"Не удалось отметить недоступный чат {chat_id}: {dead_error}")
+                logger.warning(f"Не удалось отправить уведомление пользователю {chat_id}: {e}")
+                return False
+            except (TimedOut, NetworkError) as e:
+                logger.warning(f"Сетевая ошибка при отправке пользователю {chat_id} (попытка {attempt + 1}): {e}")
+                await asyncio.sleep(2 ** attempt)
+            except Exception as e:
+                logger.error(f"Ошибка отправки уведомления пользователю {chat_id}: {e}")
+                return False
+        logger.error(f"Не удалось отправить уведомление пользователю {chat_id} после {self.max_retries + 1} попыток")
+        return False
+
+    async def run(
+        self,
+        bot,
+        chat_ids: Union[Iterable[int], AsyncIterable[int]],
+        text: str,
+        on_progress: Optional[ProgressCallback] = None,
+        progress_interval: float = 5.0,
+        total: Optional[int] = None,
+        on_result: Optional[ResultCallback] = None,
+        **kwargs,
+    ):
+        # chat_ids — список или асинхронный итератор (подписчики читаются из базы
+        # страницами); для итератора total — ожидаемое число получателей для прогресса.
+        # on_result вызывается после каждой отправки (например, чтобы отметить её в базе)
+        if not isinstance(chat_ids, AsyncIterable):
+            chat_ids = list(chat_ids)
+            total = len(chat_ids)
+            chat_ids = _iterate(chat_ids)
+        total = total or 0
+        sent = failed = 0
+        last_report = time.monotonic()
+        # Очередь ограничена: в памяти только ближайшие получатели, а не весь список
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        self.pending += total
+
+        async def produce():
+            async for chat_id in chat_ids:
+                await queue.put(chat_id)
+            for _ in range(self.concurrency):
+                await queue.put(None)
+
+        async def worker():
+            nonlocal sent, failed, last_report
+            while True:
+                chat_id = await queue.get()
+                if chat_id is None:
+                    return
+                try:
+                    delivered = await self.send(bot, chat_id, text, **kwargs)
+                finally:
+                    self.pending -= 1
+                if delivered:
+                    sent += 1
+                else:
+                    failed += 1
+                if on_result:
+                    await on_result(chat_id, delivered)
+                if on_progress and time.monotonic() - last_report >= progress_interval:
+                    last_report = time.monotonic()
+                    await on_progress(sent, failed, max(total, sent + failed), False)
+
+        tasks = [asyncio.create_task(produce())]
+        tasks += [asyncio.create_task(worker()) for _ in range(self.concurrency)]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            # Если одна задача упала (например, чтение подписчиков из базы), остальные
+            # не должны навсегда остаться ждать очереди
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            # Получателей могло оказаться не столько, сколько ожидалось
+            self.pending += sent + failed - total
+        if on_progress:
+            await on_progress(sent, failed, sent + failed, True)
+        return sent, failed
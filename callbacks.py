@@ -0,0 +1,213 @@
+"""Данные inline-кнопок: компактный версионированный формат и маршрутизация нажатий.
+
+Формат v1: цифра версии, код маршрута и поля через ":", например "1r:o:42" —
+запись на ваншот 42. Типы полей маршрутов описаны в CALLBACK_ROUTES, последние
+поля можно не передавать (тогда обработчик получит None). Telegram ограничивает
+callback_data 64 байтами, encode_callback проверяет это при создании кнопки.
+
+Кнопки в уже отправленных сообщениях остаются со старыми строками вида
+"register_oneshot_42", их разбирает parse_legacy_callback.
+
+CallbackRouter находит обработчик по имени маршрута в словаре, проверяет права
+админа, отвечает на нажатие и замеряет время и ошибки каждого маршрута.
+"""
+import re
+import time
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from metrics import HANDLER_DURATION, HANDLER_ERRORS, Counter
+
+CALLBACK_VERSION = "1"
+CALLBACK_SEPARATOR = ":"
+MAX_CALLBACK_DATA = 64
+
+EVENT_TYPE_CODES = {"oneshot": "o", "campaign": "c"}
+EVENT_TYPES_BY_CODE = {code: event_type for event_type, code in EVENT_TYPE_CODES.items()}
+
+
+class CallbackDataError(ValueError):
+    pass
+
+
+TIMESTAMP_RE = re.compile(r"(\d{4})-(\d\d)-(\d\d) (\d\d):(\d\d):(\d\d)")
+
+
+def _encode_str(value: str) -> str:
+    if CALLBACK_SEPARATOR in value:
+        raise CallbackDataError(f"недопустимый символ в поле: {value!r}")
+    return value
+
+
+def _encode_timestamp(value: str) -> str:
+    # "2030-01-01 19:00:00" (CURRENT_TIMESTAMP SQLite) -> "20300101190000"
+    match = TIMESTAMP_RE.fullmatch(value)
+    if match is None:
+        raise CallbackDataError(f"неожиданный формат времени: {value!r}")
+    return "".join(match.groups())
+
+
+def _decode_timestamp(value: str) -> str:
+    if len(value) != 14 or not value.isdigit():
+        raise ValueError(value)
+    return f"{value[:4]}-{value[4:6]}-{value[6:8]} {value[8:10]}:{value[10:12]}:{value[12:]}"
+
+
+def _encode_optional_int(value: Optional[int]) -> str:
+    return "" if value is None else str(value)
+
+
+def _decode_optional_int(value: str) -> Optional[int]:
+    return None if value == "" else int(value)
+
+
+# Тип поля -> (в строку, из строки)
+FIELD_TYPES = {
+    "int": (str, int),
+    # None посреди полей — пустая строка
+    "optional_int": (_encode_optional_int, _decode_optional_int),
+    "str": (_encode_str, str),
+    "event_type": (EVENT_TYPE_CODES.__getitem__, EVENT_TYPES_BY_CODE.__getitem__),
+    "timestamp": (_encode_timestamp, _decode_timestamp),
+}
+
+# Маршрут -> (код в callback_data, типы полей). Коды не меняются и не переиспользуются:
+# кнопки со старыми кодами живут в чатах сколько угодно
+CALLBACK_ROUTES = {
+    "view": ("v", ("event_type",)),
+    "notify": ("n", ("event_type",)),
+    "register": ("r", ("event_type", "int")),
+    "unregister": ("u", ("event_type", "int")),
+    "delete_event": ("de", ("event_type", "int")),
+    # Страница отзывов: направление и курсор (created_at, id) крайнего отзыва
+    "reviews": ("rv", ("str", "timestamp", "int")),
+    "reviews_admin": ("ra", ("str", "timestamp", "int")),
+    "delete_review": ("dr", ("int",)),
+    "leave_review": ("l", ()),
+    "regs_menu": ("gm", ()),
+    # Фильтр регистраций и курсор в порядке REGISTRATION_ORDER (starts_at, id мероприятия,
+    # тип, id регистрации); starts_at пуст у мероприятий с неразобранной датой
+    "regs": ("g", ("str", "optional_int", "int", "event_type", "int")),
+}
+ROUTES_BY_CODE = {code: name for name, (code, _) in CALLBACK_ROUTES.items()}
+
+
+def encode_callback(name: str, *args) -> str:
+    code, fields = CALLBACK_ROUTES[name]
+    if len(args) > len(fields):
+        raise CallbackDataError(f"{name}: лишние поля {args[len(fields):]!r}")
+    # Необязательные поля в конце не пишутся
+    while args and args[-1] is None:
+        args = args[:-1]
+    parts = [CALLBACK_VERSION + code]
+    parts.extend(FIELD_TYPES[field][0](value) for field, value in zip(fields, args))
+    data = CALLBACK_SEPARATOR.join(parts)
+    if len(data.encode("utf-8")) > MAX_CALLBACK_DATA:
+        raise CallbackDataError(f"callback_data длиннее {MAX_CALLBACK_DATA} байт: {data!r}")
+    return data
+
+
+def decode_callback(data: str) -> Tuple[str, tuple]:
+    """Возвращает (маршрут, поля) для callback_data любого поддерживаемого формата."""
+    if not data.startswith(CALLBACK_VERSION):
+        legacy = parse_legacy_callback(data)
+        if legacy is None:
+            raise CallbackDataError(f"неизвестный формат callback_data: {data!r}")
+        return legacy
+    code, *values = data[len(CALLBACK_VERSION):].split(CALLBACK_SEPARATOR)
+    name = ROUTES_BY_CODE.get(code)
+    if name is None:
+        raise CallbackDataError(f"неизвестный маршрут: {data!r}")
+    fields = CALLBACK_ROUTES[name][1]
+    if len(values) > len(fields):
+        raise CallbackDataError(f"лишние поля: {data!r}")
+    try:
+        args = tuple(FIELD_TYPES[field][1](value) for field, value in zip(fields, values))
+    except (KeyError, ValueError) as e:
+        raise CallbackDataError(f"некорректное поле в {data!r}: {e}") from e
+    return name, args + (None,) * (len(fields) - len(args))
+
+
+# Старые строки без параметров
+LEGACY_EXACT = {
+    "view_oneshots": ("view", ("oneshot",)),
+    "view_campaigns": ("view", ("campaign",)),
+    "notify_oneshot": ("notify", ("oneshot",)),
+    "notify_campaign": ("notify", ("campaign",)),
+    "view_reviews": ("reviews", (None, None, None)),
+    "leave_review": ("leave_review", ()),
+}
+
+
+def parse_legacy_callback(data: str) -> Optional[Tuple[str, tuple]]:
+    # Форматы до callbacks.py: register_oneshot_42, delete_event_oneshot_3, delete_review_5
+    if data in LEGACY_EXACT:
+        return LEGACY_EXACT[data]
+    try:
+        for prefix, name in (("register_", "register"), ("delete_event_", "delete_event")):
+            if data.startswith(prefix):
+                event_type, event_id = data[len(prefix):].split("_")
+                if event_type not in EVENT_TYPE_CODES:
+                    return None
+                return name, (event_type, int(event_id))
+        if data.startswith("delete_review_"):
+            return "delete_review", (int(data[len("delete_review_"):]),)
+    except ValueError:
+        return None
+    return None
+
+
+CALLBACK_LEGACY = Counter(
+    "bot_callback_legacy_total", "Нажатия кнопок со старым форматом callback_data", ["route"]
+)
+
+CallbackHandler = Callable[..., Awaitable[None]]
+
+
+class CallbackRouter:
+    """Обработчики нажатий по маршрутам CALLBACK_ROUTES.
+
+    Обработчик получает (query, context, *поля маршрута). Метрики пишутся
+    в bot_handler_duration_seconds / bot_handler_errors_total с меткой
+    handler="button_callback:<маршрут>".
+    """
+
+    def __init__(self, is_admin: Callable[[int], bool]):
+        self.is_admin = is_admin
+        self._handlers: Dict[str, Tuple[CallbackHandler, bool]] = {}
+
+    def route(self, name: str, admin_only: bool = False):
+        if name not in CALLBACK_ROUTES:
+            raise KeyError(f"маршрут {name!r} не описан в CALLBACK_ROUTES")
+
+        def register(handler: CallbackHandler) -> CallbackHandler:
+            self._handlers[name] = (handler, admin_only)
+            return handler
+
+        return register
+
+    async def dispatch(self, update, context):
+        query = update.callback_query
+        try:
+            name, args = decode_callback(query.data)
+        except CallbackDataError:
+            name, args = "unknown", ()
+        handler, admin_only = self._handlers.get(name, (None, False))
+        label = f"button_callback:{name if handler is not None else 'unknown'}"
+        if handler is not None and not query.data.startswith(CALLBACK_VERSION):
+            CALLBACK_LEGACY.inc(name)
+
+        started = time.perf_counter()
+        try:
+            if handler is None:
+                await query.answer()
+                return
+            if admin_only and not self.is_admin(query.from_user.id):
+                await query.answer("Недостаточно прав", show_alert=True)
+                return
+            await query.answer()
+            await handler(query, context, *args)
+        except Exception:
+            HANDLER_ERRORS.inc(label)
+            raise
+        finally:
+            HANDLER_DURATION.observe(time.perf_counter() - started, label)
@@ -7,7 +7,52 @@ BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 ADMIN_IDS = [int(admin_id.strip()) for admin_id in os.getenv("ADMIN_IDS", "").split(",") if admin_id.strip()]
 DM_CONTACT = os.getenv("DM_CONTACT", "@nmyaso")
 DB_NAME = os.getenv("DB_NAME", "dnd_bot.db")
+# Сколько минут после положенного времени ещё можно догнать пропущенное напоминание
+REMINDER_CATCHUP_MINUTES = int(os.getenv("REMINDER_CATCHUP_MINUTES", "60"))
+
+# Журнал медленных запросов SQLite: запросы дольше SLOW_QUERY_MS миллисекунд пишутся
+# в лог (0 — все запросы); если не задано, запросы не замеряются
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS")) if os.getenv("SLOW_QUERY_MS") else None
+
+# Групповая запись: регистрации, подписки и отметки напоминаний копятся GROUP_COMMIT_MS
+# миллисекунд и коммитятся одной транзакцией. При 0 пачку составляет всё, что пришло
+# за время предыдущего коммита; пустое значение — каждая запись своим коммитом
+GROUP_COMMIT_MS = float(os.getenv("GROUP_COMMIT_MS", "0")) if os.getenv("GROUP_COMMIT_MS", "0") else None
+
+# Сколько обновлений разных пользователей обрабатывается одновременно (1 — по очереди)
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", "64"))
+
+# Webhook-режим: если задан WEBHOOK_URL (публичный https-адрес бота), обновления
+# принимаются HTTP-сервером на HTTP_PORT вместо long polling
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "").rstrip("/")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+HTTP_LISTEN = os.getenv("HTTP_LISTEN", "0.0.0.0")
+HTTP_PORT = int(os.getenv("HTTP_PORT", "8080"))
+
+# Число процессов-обработчиков обновлений; при WORKERS > 1 главный процесс только
+# принимает обновления и раздаёт их процессам по user_id (см. workers.py)
+WORKERS = int(os.getenv("WORKERS", "1"))
 
 if not BOT_TOKEN:
     raise ValueError("TELEGRAM_BOT_TOKEN не установлен в .env файле")
 
+if WEBHOOK_URL and not WEBHOOK_SECRET:
+    raise ValueError("WEBHOOK_SECRET обязателен в webhook-режиме (WEBHOOK_URL)")
+
+# Раньше docker-compose монтировал базу файлом /app/dnd_bot.db, теперь — каталогом ./data
+DOCKER_DB_NAME = "/app/data/dnd_bot.db"
+LEGACY_DOCKER_DB_NAME = "/app/dnd_bot.db"
+
+
+def check_legacy_database(db_name: str):
+    # Вызывается ботом до открытия базы. Если в контейнере базы по новому пути ещё нет,
+    # а старый файл попал в образ, бот не стартует: иначе он молча создал бы пустую базу
+    # и все записи «пропали» бы. Локальные запуски и инструменты с другим DB_NAME не затрагивает
+    if os.path.abspath(db_name) != DOCKER_DB_NAME:
+        return
+    if not os.path.exists(db_name) and os.path.exists(LEGACY_DOCKER_DB_NAME):
+        raise ValueError(
+            f"База {db_name} не найдена, но есть старая {LEGACY_DOCKER_DB_NAME}. Остановите бота и перенесите "
+            f"её (вместе с файлами -wal/-shm, если есть) в ./data, затем запустите снова"
+        )
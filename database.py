@@ -1,432 +1,1266 @@
+import asyncio
+import functools
 import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Iterator, Tuple, Set, AsyncIterator
 import os
 
+from group_commit import GroupCommit
+from metrics import DB_QUERY_DURATION, DB_QUERY_ERRORS
+from querylog import QueryLog, TimedConnection
+from records import Event, Registration, Review
 
-class Database:
-    def __init__(self, db_name: str = "dnd_bot.db"):
-        self.db_name = db_name
-        self.init_database()
 
-    def get_connection(self):
-        conn = sqlite3.connect(self.db_name)
-        conn.execute("PRAGMA foreign_keys = ON")
-        return conn
+# Форматы, в которых админы вводят дату мероприятия (локальное время сервера)
+DATE_FORMATS = ("%Y-%m-%d %H:%M", "%Y-%m-%d %H:%M:%S", "%Y-%m-%d")
 
 
-    def init_database(self):
-        conn = self.get_connection()
-        cursor = conn.cursor()
+def to_epoch(date_time: str) -> Optional[int]:
+    for date_format in DATE_FORMATS:
+        try:
+            return int(datetime.strptime(date_time, date_format).timestamp())
+        except (TypeError, ValueError):
+            continue
+    return None
 
-        # Таблица для ваншотов
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS oneshots (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                date_time TEXT NOT NULL,
-                story TEXT,
-                location TEXT,
-                price TEXT,
-                free_drink BOOLEAN DEFAULT 0,
-                created_at TEXT DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
 
-        # Таблица для кампаний
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS campaigns (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                date_time TEXT NOT NULL,
-                duration TEXT,
-                story TEXT,
-                location TEXT,
-                price TEXT,
-                free_drink BOOLEAN DEFAULT 0,
-                created_at TEXT DEFAULT CURRENT_TIMESTAMP
-            )
+def _migration_event_starts_at(conn: sqlite3.Connection):
+    # Время начала в UTC epoch, чтобы фильтр и сортировка шли по индексу,
+    # а не через datetime(date_time) с полным сканированием
+    for table in ("oneshots", "campaigns"):
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN starts_at INTEGER")
+        rows = conn.execute(f"SELECT id, date_time FROM {table}").fetchall()
+        conn.executemany(
+            f"UPDATE {table} SET starts_at = ? WHERE id = ?",
+            [(to_epoch(date_time), event_id) for event_id, date_time in rows],
+        )
+        conn.execute(f"""
+            CREATE INDEX IF NOT EXISTS idx_{table}_starts_at
+            ON {table}(starts_at, id, name, date_time)
         """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_oneshot_registrations_oneshot
+        ON oneshot_registrations(oneshot_id, registered_at, user_id)
+    """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_campaign_registrations_campaign
+        ON campaign_registrations(campaign_id, registered_at, user_id)
+    """)
 
-        # Таблица для регистраций на ваншоты
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS oneshot_registrations (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                oneshot_id INTEGER NOT NULL,
-                user_id INTEGER NOT NULL,
-                username TEXT,
-                first_name TEXT,
-                registered_at TEXT DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (oneshot_id) REFERENCES oneshots(id) ON DELETE CASCADE,
-                UNIQUE(oneshot_id, user_id)
-            )
-        """)
 
-        # Таблица для регистраций на кампании
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS campaign_registrations (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                campaign_id INTEGER NOT NULL,
-                user_id INTEGER NOT NULL,
-                username TEXT,
-                first_name TEXT,
-                registered_at TEXT DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (campaign_id) REFERENCES campaigns(id) ON DELETE CASCADE,
-                UNIQUE(campaign_id, user_id)
-            )
-        """)
+def _migration_event_version(conn: sqlite3.Connection):
+    # Версия карточки мероприятия: ключ кэша отрисовки, увеличивается при изменении
+    # (триггер из _migration_event_version_trigger)
+    for table in ("oneshots", "campaigns"):
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN version INTEGER NOT NULL DEFAULT 1")
 
-        # Таблица для уведомлений о новых мероприятиях
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS notifications (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                event_type TEXT NOT NULL,
-                notified_at TEXT DEFAULT CURRENT_TIMESTAMP,
-                UNIQUE(user_id, event_type)
-            )
+
+def _migration_reviews_keyset_index(conn: sqlite3.Connection):
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_reviews_created_at ON reviews(created_at, id)")
+
+
+def _migration_registrations_keyset_index(conn: sqlite3.Connection):
+    # Регистрации мероприятия в порядке id — для постраничного просмотра без сортировки
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_oneshot_registrations_keyset
+        ON oneshot_registrations(oneshot_id, id)
+    """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_campaign_registrations_keyset
+        ON campaign_registrations(campaign_id, id)
+    """)
+
+
+def _migration_persistence(conn: sqlite3.Connection):
+    # Данные python-telegram-bot: user_data, chat_data, bot_data и состояния диалогов
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS persistence (
+            kind TEXT NOT NULL,
+            key TEXT NOT NULL,
+            data TEXT NOT NULL,
+            PRIMARY KEY (kind, key)
+        ) WITHOUT ROWID
+    """)
+
+
+def _migration_worker_coordination(conn: sqlite3.Connection):
+    # Общее состояние для нескольких процессов бота (см. workers.py):
+    # аренда фоновых задач, очередь рассылок и счётчик изменений мероприятий
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS leases (
+            name TEXT PRIMARY KEY,
+            owner TEXT NOT NULL,
+            expires_at INTEGER NOT NULL
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            event_type TEXT NOT NULL,
+            event_id INTEGER NOT NULL,
+            admin_id INTEGER NOT NULL,
+            created_at INTEGER NOT NULL,
+            claimed_by TEXT,
+            finished_at INTEGER
+        )
+    """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_broadcasts_unclaimed
+        ON broadcasts(id) WHERE claimed_by IS NULL
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS versions (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        )
+    """)
+    conn.execute("INSERT OR IGNORE INTO versions (name, value) VALUES ('events', 0)")
+    for table in ("oneshots", "campaigns"):
+        for operation in ("INSERT", "UPDATE", "DELETE"):
+            conn.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_{table}_{operation.lower()}_version
+                AFTER {operation} ON {table}
+                BEGIN
+                    UPDATE versions SET value = value + 1 WHERE name = 'events';
+                END
+            """)
+
+
+def _migration_notifications_event_index(conn: sqlite3.Connection):
+    # Подписчики по типу мероприятия (get_users_to_notify): уникальный индекс
+    # (user_id, event_type) для этого запроса годится только полным проходом
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_notifications_event_type
+        ON notifications(event_type, user_id)
+    """)
+
+
+def _migration_event_capacity(conn: sqlite3.Connection):
+    # Число мест на мероприятии (NULL — без ограничения) и статус регистрации:
+    # confirmed — место есть, waitlist — лист ожидания
+    for event_type, (events_table, registrations_table, event_column) in EVENT_TABLES.items():
+        conn.execute(f"ALTER TABLE {events_table} ADD COLUMN capacity INTEGER")
+        conn.execute(f"""
+            ALTER TABLE {registrations_table}
+            ADD COLUMN status TEXT NOT NULL DEFAULT '{REGISTRATION_CONFIRMED}'
+        """)
+        # Подсчёт занятых мест и первый в листе ожидания — по индексу, без сканирования
+        conn.execute(f"""
+            CREATE INDEX IF NOT EXISTS idx_{registrations_table}_status
+            ON {registrations_table}({event_column}, status, id)
         """)
 
-        # Таблица для отслеживания отправленных напоминаний
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS reminders (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                event_type TEXT NOT NULL,
-                event_id INTEGER NOT NULL,
-                user_id INTEGER NOT NULL,
-                reminder_type TEXT NOT NULL,
-                sent_at TEXT DEFAULT CURRENT_TIMESTAMP,
-                UNIQUE(event_type, event_id, user_id, reminder_type)
-            )
+
+def _migration_dead_chats(conn: sqlite3.Connection):
+    # Чаты, куда бот больше не может писать (заблокировал пользователь, чат удалён):
+    # их не включаем в рассылки, напоминания и пересылки админам
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS dead_chats (
+            chat_id INTEGER PRIMARY KEY,
+            reason TEXT NOT NULL,
+            marked_at INTEGER NOT NULL
+        )
+    """)
+
+
+# Поля мероприятия, из которых собирается карточка (bot.format_event_info)
+EVENT_CARD_COLUMNS = {
+    "oneshots": ("name", "date_time", "starts_at", "story", "location", "price", "free_drink", "capacity"),
+    "campaigns": ("name", "date_time", "starts_at", "duration", "story", "location", "price", "free_drink", "capacity"),
+}
+
+
+def _migration_event_version_trigger(conn: sqlite3.Connection):
+    # Изменение любого поля карточки увеличивает version, и закэшированная карточка
+    # с прежней версией больше не используется. Сам UPDATE version не входит
+    # в список полей, поэтому триггер не срабатывает повторно
+    for table, columns in EVENT_CARD_COLUMNS.items():
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_card_version
+            AFTER UPDATE OF {", ".join(columns)} ON {table}
+            BEGIN
+                UPDATE {table} SET version = OLD.version + 1 WHERE id = NEW.id;
+            END
         """)
 
-        # Таблица для отзывов
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS reviews (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                username TEXT,
-                first_name TEXT,
-                text TEXT NOT NULL,
-                created_at TEXT DEFAULT CURRENT_TIMESTAMP
+
+# Таблицы мероприятия и регистраций для каждого типа мероприятия
+EVENT_TABLES = {
+    "oneshot": ("oneshots", "oneshot_registrations", "oneshot_id"),
+    "campaign": ("campaigns", "campaign_registrations", "campaign_id"),
+}
+
+# Статусы регистрации: место подтверждено или пользователь в листе ожидания
+REGISTRATION_CONFIRMED = "confirmed"
+REGISTRATION_WAITLIST = "waitlist"
+
+
+# Колонки выгрузки регистраций (Database.iter_registrations)
+EXPORT_COLUMNS = (
+    "event_type", "event_id", "event_name", "date_time",
+    "user_id", "username", "first_name", "registered_at", "status",
+)
+
+# Колонки запросов по регистрациям всех типов мероприятий: e — мероприятие,
+# r — регистрация; event_type подставляется строкой в каждой ветке UNION ALL
+REGISTRATION_COLUMNS = {
+    "event_id": "e.id",
+    "event_name": "e.name",
+    "date_time": "e.date_time",
+    "starts_at": "e.starts_at",
+    "registration_id": "r.id",
+    "user_id": "r.user_id",
+    "username": "r.username",
+    "first_name": "r.first_name",
+    "registered_at": "r.registered_at",
+    "status": "r.status",
+}
+
+# Колонки регистрации вместе с основными полями мероприятия (records.Registration)
+REGISTRATION_FIELDS = Registration.__slots__
+
+# Порядок потока регистраций всех типов: по времени начала, мероприятию и записи.
+# Тип стоит после id мероприятия: тогда каждая ветка UNION ALL уже упорядочена
+# по своим индексам и SQLite только сливает их, ничего не досортировывая
+REGISTRATION_ORDER = ("starts_at", "event_id", "event_type", "registration_id")
+
+
+def _registrations_select(event_type: str, columns, conditions=()) -> str:
+    # Ветка запроса по регистрациям одного типа мероприятия
+    events_table, registrations_table, event_column = EVENT_TABLES[event_type]
+    select = ", ".join(
+        f"'{event_type}' AS event_type" if column == "event_type" else f"{REGISTRATION_COLUMNS[column]} AS {column}"
+        for column in columns
+    )
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    return f"""
+        SELECT {select}
+        FROM {events_table} e
+        CROSS JOIN {registrations_table} r ON r.{event_column} = e.id
+        {where}
+    """
+
+
+# Миграции применяются по порядку, номер версии схемы хранится в PRAGMA user_version.
+# Новые миграции добавляются только в конец списка.
+MIGRATIONS = [
+    _migration_event_starts_at,
+    _migration_event_version,
+    _migration_reviews_keyset_index,
+    _migration_registrations_keyset_index,
+    _migration_persistence,
+    _migration_worker_coordination,
+    _migration_notifications_event_index,
+    _migration_event_capacity,
+    _migration_dead_chats,
+    _migration_event_version_trigger,
+]
+
+
+class ConnectionPool:
+    """Пул соединений SQLite: одно долгоживущее соединение на поток.
+
+    Соединения открываются в режиме WAL, поэтому читатели не ждут писателя,
+    а подготовленные выражения переиспользуются через cached_statements.
+    """
+
+    PRAGMAS = (
+        "PRAGMA journal_mode = WAL",
+        "PRAGMA synchronous = NORMAL",
+        "PRAGMA cache_size = -16000",
+        "PRAGMA mmap_size = 134217728",
+        "PRAGMA busy_timeout = 5000",
+        "PRAGMA foreign_keys = ON",
+    )
+
+    def __init__(self, db_name: str, cached_statements: int = 256, query_log: Optional[QueryLog] = None):
+        self.db_name = db_name
+        self.cached_statements = cached_statements
+        # Журнал медленных запросов (querylog.py), по умолчанию выключен
+        self.query_log = query_log
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+
+    def acquire(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # check_same_thread=False нужен только для close_all из другого потока,
+            # запросы через соединение идут из потока-владельца
+            conn = sqlite3.connect(
+                self.db_name,
+                cached_statements=self.cached_statements,
+                check_same_thread=False,
+                factory=TimedConnection if self.query_log is not None else sqlite3.Connection,
             )
-        """)
+            if self.query_log is not None:
+                self.query_log.attach(conn)
+            for pragma in self.PRAGMAS:
+                conn.execute(pragma)
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
 
-        conn.commit()
-        conn.close()
+    def close_all(self):
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+        self._local = threading.local()
+        if self.query_log is not None and connections:
+            self.query_log.log_summary()
 
-    def add_oneshot(self, name: str, date_time: str, story: str, location: str, price: str, free_drink: bool) -> int:
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute("""
-            INSERT INTO oneshots (name, date_time, story, location, price, free_drink)
-            VALUES (?, ?, ?, ?, ?, ?)
-        """, (name, date_time, story, location, price, 1 if free_drink else 0))
-        oneshot_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
-        return oneshot_id
 
-    def add_campaign(self, name: str, date_time: str, duration: str, story: str, location: str, price: str, free_drink: bool) -> int:
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute("""
-            INSERT INTO campaigns (name, date_time, duration, story, location, price, free_drink)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        """, (name, date_time, duration, story, location, price, 1 if free_drink else 0))
-        campaign_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
-        return campaign_id
+class Database:
+    def __init__(self, db_name: str = "dnd_bot.db", pool: Optional[ConnectionPool] = None, query_log: Optional[QueryLog] = None):
+        self.db_name = db_name
+        self.pool = pool or ConnectionPool(db_name, query_log=query_log)
+        self.init_database()
 
-    def get_upcoming_oneshots(self) -> List[Dict[str, Any]]:
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT * FROM oneshots 
-            WHERE datetime(date_time) > datetime('now')
-            ORDER BY datetime(date_time) ASC
-        """)
-        columns = [description[0] for description in cursor.description]
-        oneshots = [dict(zip(columns, row)) for row in cursor.fetchall()]
-        conn.close()
-        return oneshots
+    def get_connection(self):
+        return self.pool.acquire()
 
-    def get_upcoming_campaigns(self) -> List[Dict[str, Any]]:
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT * FROM campaigns 
-            WHERE datetime(date_time) > datetime('now')
-            ORDER BY datetime(date_time) ASC
-        """)
-        columns = [description[0] for description in cursor.description]
-        campaigns = [dict(zip(columns, row)) for row in cursor.fetchall()]
-        conn.close()
-        return campaigns
+    def release_connection(self, conn: sqlite3.Connection):
+        # Соединение остаётся в пуле, но без незавершённых транзакций
+        if conn.in_transaction:
+            conn.rollback()
 
-    def register_for_oneshot(self, oneshot_id: int, user_id: int, username: str = None, first_name: str = None) -> bool:
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        # Соединение потока одно на все вызовы, поэтому транзакция завершается здесь же:
+        # коммит при успехе, откат при любом исключении. Иначе незавершённые изменения
+        # закоммитил бы следующий метод, выполненный в этом потоке.
         conn = self.get_connection()
-        cursor = conn.cursor()
         try:
-            cursor.execute("""
-                INSERT INTO oneshot_registrations (oneshot_id, user_id, username, first_name)
-                VALUES (?, ?, ?, ?)
-            """, (oneshot_id, user_id, username, first_name))
+            yield conn
             conn.commit()
-            conn.close()
-            return True
-        except sqlite3.IntegrityError:
-            conn.close()
-            return False
+        finally:
+            self.release_connection(conn)
 
-    def register_for_campaign(self, campaign_id: int, user_id: int, username: str = None, first_name: str = None) -> bool:
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        try:
+    def close(self):
+        self.pool.close_all()
+
+    def init_database(self):
+        with self.transaction() as conn:
+            cursor = conn.cursor()
+
+            # Таблица для ваншотов
             cursor.execute("""
-                INSERT INTO campaign_registrations (campaign_id, user_id, username, first_name)
-                VALUES (?, ?, ?, ?)
-            """, (campaign_id, user_id, username, first_name))
+                CREATE TABLE IF NOT EXISTS oneshots (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    name TEXT NOT NULL,
+                    date_time TEXT NOT NULL,
+                    story TEXT,
+                    location TEXT,
+                    price TEXT,
+                    free_drink BOOLEAN DEFAULT 0,
+                    created_at TEXT DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+
+            # Таблица для кампаний
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS campaigns (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    name TEXT NOT NULL,
+                    date_time TEXT NOT NULL,
+                    duration TEXT,
+                    story TEXT,
+                    location TEXT,
+                    price TEXT,
+                    free_drink BOOLEAN DEFAULT 0,
+                    created_at TEXT DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+
+            # Таблица для регистраций на ваншоты
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS oneshot_registrations (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    oneshot_id INTEGER NOT NULL,
+                    user_id INTEGER NOT NULL,
+                    username TEXT,
+                    first_name TEXT,
+                    registered_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (oneshot_id) REFERENCES oneshots(id) ON DELETE CASCADE,
+                    UNIQUE(oneshot_id, user_id)
+                )
+            """)
+
+            # Таблица для регистраций на кампании
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS campaign_registrations (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    campaign_id INTEGER NOT NULL,
+                    user_id INTEGER NOT NULL,
+                    username TEXT,
+                    first_name TEXT,
+                    registered_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (campaign_id) REFERENCES campaigns(id) ON DELETE CASCADE,
+                    UNIQUE(campaign_id, user_id)
+                )
+            """)
+
+            # Таблица для уведомлений о новых мероприятиях
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS notifications (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER NOT NULL,
+                    event_type TEXT NOT NULL,
+                    notified_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                    UNIQUE(user_id, event_type)
+                )
+            """)
+
+            # Таблица для отслеживания отправленных напоминаний
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS reminders (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    event_type TEXT NOT NULL,
+                    event_id INTEGER NOT NULL,
+                    user_id INTEGER NOT NULL,
+                    reminder_type TEXT NOT NULL,
+                    sent_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                    UNIQUE(event_type, event_id, user_id, reminder_type)
+                )
+            """)
+
+            # Таблица для отзывов
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS reviews (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER NOT NULL,
+                    username TEXT,
+                    first_name TEXT,
+                    text TEXT NOT NULL,
+                    created_at TEXT DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+
             conn.commit()
-            conn.close()
-            return True
+            self.migrate(conn)
+
+    def migrate(self, conn: sqlite3.Connection):
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        for number in range(version + 1, len(MIGRATIONS) + 1):
+            conn.execute("BEGIN")
+            try:
+                MIGRATIONS[number - 1](conn)
+                conn.execute(f"PRAGMA user_version = {number}")
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+
+    def add_oneshot(self, name: str, date_time: str, story: str, location: str, price: str, free_drink: bool,
+                    capacity: Optional[int] = None) -> int:
+        with self.transaction() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                INSERT INTO oneshots (name, date_time, starts_at, story, location, price, free_drink, capacity)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """, (name, date_time, to_epoch(date_time), story, location, price, 1 if free_drink else 0, capacity))
+            oneshot_id = cursor.lastrowid
+        return oneshot_id
+
+    def add_campaign(self, name: str, date_time: str, duration: str, story: str, location: str, price: str, free_drink: bool,
+                     capacity: Optional[int] = None) -> int:
+        with self.transaction() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                INSERT INTO campaigns (name, date_time, starts_at, duration, story, location, price, free_drink, capacity)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (name, date_time, to_epoch(date_time), duration, story, location, price, 1 if free_drink else 0, capacity))
+            campaign_id = cursor.lastrowid
+        return campaign_id
+
+    def get_upcoming(self, event_type: str) -> List[Event]:
+        events_table = EVENT_TABLES[event_type][0]
+        with self.transaction() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"""
+                SELECT '{event_type}' AS event_type, * FROM {events_table}
+                WHERE starts_at > ?
+                ORDER BY starts_at ASC
+            """, (int(time.time()),))
+            cursor.row_factory = Event.row_factory(cursor)
+            events = cursor.fetchall()
+        return events
+
+    def get_upcoming_oneshots(self) -> List[Event]:
+        return self.get_upcoming("oneshot")
+
+    def get_upcoming_campaigns(self) -> List[Event]:
+        return self.get_upcoming("campaign")
+
+    def register(self, event_type: str, event_id: int, user_id: int, username: str = None,
+                 first_name: str = None) -> Optional[str]:
+        # Запись с выдачей места одним INSERT ... SELECT: число занятых мест считается
+        # внутри того же выражения, которое пишет строку, поэтому одновременные записи
+        # не займут больше capacity мест. Возвращает статус регистрации или None,
+        # если пользователь уже записан или мероприятия нет.
+        try:
+            with self.transaction() as conn:
+                cursor = conn.cursor()
+                return self._register_row(cursor, event_type, event_id, user_id, username, first_name)
         except sqlite3.IntegrityError:
-            conn.close()
-            return False
+            return None
 
-    def get_oneshot_by_id(self, oneshot_id: int) -> Optional[Dict[str, Any]]:
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM oneshots WHERE id = ?", (oneshot_id,))
+    def _register_row(self, cursor: sqlite3.Cursor, event_type: str, event_id: int, user_id: int,
+                      username: str = None, first_name: str = None) -> Optional[str]:
+        # Сама вставка без коммита: используется register и групповой записью (apply_writes)
+        events_table, registrations_table, event_column = EVENT_TABLES[event_type]
+        cursor.execute(f"""
+            INSERT INTO {registrations_table} ({event_column}, user_id, username, first_name, status)
+            SELECT e.id, ?, ?, ?,
+                CASE
+                    WHEN e.capacity IS NULL OR (
+                        SELECT COUNT(*) FROM {registrations_table}
+                        WHERE {event_column} = e.id AND status = '{REGISTRATION_CONFIRMED}'
+                    ) < e.capacity THEN '{REGISTRATION_CONFIRMED}'
+                    ELSE '{REGISTRATION_WAITLIST}'
+                END
+            FROM {events_table} e
+            WHERE e.id = ?
+            RETURNING status
+        """, (user_id, username, first_name, event_id))
         row = cursor.fetchone()
-        conn.close()
-        if row:
-            columns = [description[0] for description in cursor.description]
-            return dict(zip(columns, row))
-        return None
+        if row is None:
+            return None
+        # Пользователь нажал кнопку — значит, снова доступен
+        self._revive_chat_row(cursor, user_id)
+        return row[0]
 
-    def get_campaign_by_id(self, campaign_id: int) -> Optional[Dict[str, Any]]:
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM campaigns WHERE id = ?", (campaign_id,))
-        row = cursor.fetchone()
-        conn.close()
-        if row:
-            columns = [description[0] for description in cursor.description]
-            return dict(zip(columns, row))
-        return None
+    def register_for_oneshot(self, oneshot_id: int, user_id: int, username: str = None,
+                             first_name: str = None) -> Optional[str]:
+        return self.register("oneshot", oneshot_id, user_id, username, first_name)
 
-    def get_registered_users_for_oneshot(self, oneshot_id: int) -> List[Dict[str, Any]]:
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM oneshot_registrations WHERE oneshot_id = ?", (oneshot_id,))
-        columns = [description[0] for description in cursor.description]
-        registrations = [dict(zip(columns, row)) for row in cursor.fetchall()]
-        conn.close()
-        return registrations
+    def register_for_campaign(self, campaign_id: int, user_id: int, username: str = None,
+                              first_name: str = None) -> Optional[str]:
+        return self.register("campaign", campaign_id, user_id, username, first_name)
 
-    def get_registered_users_for_campaign(self, campaign_id: int) -> List[Dict[str, Any]]:
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM campaign_registrations WHERE campaign_id = ?", (campaign_id,))
-        columns = [description[0] for description in cursor.description]
-        registrations = [dict(zip(columns, row)) for row in cursor.fetchall()]
-        conn.close()
+    def cancel_registration(self, event_type: str, event_id: int, user_id: int) -> Tuple[bool, Optional[int]]:
+        # Отмена записи и перевод первого из листа ожидания на освободившееся место
+        # в одной транзакции. Возвращает (была ли запись, id переведённого пользователя).
+        events_table, registrations_table, event_column = EVENT_TABLES[event_type]
+        with self.transaction() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                f"DELETE FROM {registrations_table} WHERE {event_column} = ? AND user_id = ?",
+                (event_id, user_id),
+            )
+            removed = cursor.rowcount > 0
+            promoted = None
+            if removed:
+                # Если ушёл человек из листа ожидания, мест не прибавилось и условие не выполнится
+                cursor.execute(f"""
+                    UPDATE {registrations_table} SET status = '{REGISTRATION_CONFIRMED}'
+                    WHERE id = (
+                        SELECT id FROM {registrations_table}
+                        WHERE {event_column} = ? AND status = '{REGISTRATION_WAITLIST}'
+                        ORDER BY id LIMIT 1
+                    )
+                    AND (
+                        SELECT COUNT(*) FROM {registrations_table}
+                        WHERE {event_column} = ? AND status = '{REGISTRATION_CONFIRMED}'
+                    ) < (SELECT capacity FROM {events_table} WHERE id = ?)
+                    RETURNING user_id
+                """, (event_id, event_id, event_id))
+                row = cursor.fetchone()
+                promoted = row[0] if row else None
+        return removed, promoted
+
+    def get_registration_counts(self, event_type: str, event_id: int) -> Tuple[int, int]:
+        # (подтверждённые места, лист ожидания) — по индексу статуса
+        _, registrations_table, event_column = EVENT_TABLES[event_type]
+        with self.transaction() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"""
+                SELECT
+                    COUNT(*) FILTER (WHERE status = '{REGISTRATION_CONFIRMED}'),
+                    COUNT(*) FILTER (WHERE status = '{REGISTRATION_WAITLIST}')
+                FROM {registrations_table}
+                WHERE {event_column} = ?
+            """, (event_id,))
+            confirmed, waitlist = cursor.fetchone()
+        return confirmed, waitlist
+
+    def get_event(self, event_type: str, event_id: int) -> Optional[Event]:
+        events_table = EVENT_TABLES[event_type][0]
+        with self.transaction() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"SELECT '{event_type}' AS event_type, * FROM {events_table} WHERE id = ?", (event_id,))
+            cursor.row_factory = Event.row_factory(cursor)
+            event = cursor.fetchone()
+        return event
+
+    def get_oneshot_by_id(self, oneshot_id: int) -> Optional[Event]:
+        return self.get_event("oneshot", oneshot_id)
+
+    def get_campaign_by_id(self, campaign_id: int) -> Optional[Event]:
+        return self.get_event("campaign", campaign_id)
+
+    def get_registrations(self, event_type: str, event_id: int) -> List[Registration]:
+        with self.transaction() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                _registrations_select(event_type, REGISTRATION_FIELDS, ["e.id = ?"]) + " ORDER BY r.id",
+                (event_id,),
+            )
+            cursor.row_factory = Registration.row_factory(cursor)
+            registrations = cursor.fetchall()
         return registrations
 
+    def get_registered_users_for_oneshot(self, oneshot_id: int) -> List[Registration]:
+        return self.get_registrations("oneshot", oneshot_id)
+
+    def get_registered_users_for_campaign(self, campaign_id: int) -> List[Registration]:
+        return self.get_registrations("campaign", campaign_id)
+
     def add_notification_request(self, user_id: int, event_type: str):
-        conn = self.get_connection()
-        cursor = conn.cursor()
+        with self.transaction() as conn:
+            cursor = conn.cursor()
+            self._notification_row(cursor, user_id, event_type)
+
+    def _notification_row(self, cursor: sqlite3.Cursor, user_id: int, event_type: str):
         cursor.execute("""
             INSERT OR IGNORE INTO notifications (user_id, event_type)
             VALUES (?, ?)
         """, (user_id, event_type))
-        conn.commit()
-        conn.close()
+        self._revive_chat_row(cursor, user_id)
 
-    def get_users_to_notify(self, event_type: str) -> List[int]:
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT user_id FROM notifications WHERE event_type = ?", (event_type,))
-        user_ids = [row[0] for row in cursor.fetchall()]
-        conn.close()
+    def get_subscribers_page(self, event_type: str, after_user_id: int = 0, limit: int = 1000) -> List[int]:
+        # Keyset-страница подписчиков по индексу (event_type, user_id): следующая
+        # страница начинается после последнего user_id предыдущей
+        with self.transaction() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT user_id FROM notifications
+                WHERE event_type = ? AND user_id > ?
+                ORDER BY user_id
+                LIMIT ?
+            """, (event_type, after_user_id, limit))
+            user_ids = [row[0] for row in cursor.fetchall()]
         return user_ids
 
-    def get_all_registrations_for_reminders(self) -> List[Dict[str, Any]]:
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        # Получаем все регистрации на ваншоты
-        cursor.execute("""
-            SELECT 'oneshot' as event_type, o.id as event_id, r.user_id, o.date_time, o.name
-            FROM oneshot_registrations r
-            JOIN oneshots o ON r.oneshot_id = o.id
-            WHERE datetime(o.date_time) > datetime('now')
-        """)
-        
-        oneshot_reminders = []
-        for row in cursor.fetchall():
-            oneshot_reminders.append({
-                'event_type': row[0],
-                'event_id': row[1],
-                'user_id': row[2],
-                'date_time': row[3],
-                'name': row[4]
-            })
-        
-        # Получаем все регистрации на кампании
-        cursor.execute("""
-            SELECT 'campaign' as event_type, c.id as event_id, r.user_id, c.date_time, c.name
-            FROM campaign_registrations r
-            JOIN campaigns c ON r.campaign_id = c.id
-            WHERE datetime(c.date_time) > datetime('now')
-        """)
-        
-        campaign_reminders = []
-        for row in cursor.fetchall():
-            campaign_reminders.append({
-                'event_type': row[0],
-                'event_id': row[1],
-                'user_id': row[2],
-                'date_time': row[3],
-                'name': row[4]
-            })
-        
-        conn.close()
-        return oneshot_reminders + campaign_reminders
-
-
-    def get_all_registrations(self) -> List[Dict[str, Any]]:
-        conn = self.get_connection()
-        cursor = conn.cursor()
+    def iter_users_to_notify(self, event_type: str, batch_size: int = 1000) -> Iterator[int]:
+        # Подписчики страницами (get_subscribers_page); соединение между страницами
+        # не держится, поэтому итератор можно читать сколько угодно долго
+        after_user_id = 0
+        while True:
+            user_ids = self.get_subscribers_page(event_type, after_user_id, batch_size)
+            yield from user_ids
+            if len(user_ids) < batch_size:
+                return
+            after_user_id = user_ids[-1]
 
-        registrations: List[Dict[str, Any]] = []
+    def get_users_to_notify(self, event_type: str) -> List[int]:
+        return list(self.iter_users_to_notify(event_type))
 
-        # Ваншоты
-        cursor.execute("""
-            SELECT
-                'oneshot' AS event_type,
-                o.name AS event_name,
-                o.date_time AS date_time,
-                r.user_id AS user_id,
-                r.username AS username,
-                r.first_name AS first_name,
-                r.registered_at AS registered_at
-            FROM oneshot_registrations r
-            JOIN oneshots o ON r.oneshot_id = o.id
-            ORDER BY datetime(o.date_time) ASC, datetime(r.registered_at) ASC
-        """)
-        for row in cursor.fetchall():
-            registrations.append({
-                "event_type": row[0],
-                "event_name": row[1],
-                "date_time": row[2],
-                "user_id": row[3],
-                "username": row[4],
-                "first_name": row[5],
-                "registered_at": row[6],
-            })
-
-        # Кампании
+    def get_subscriber_count(self, event_type: str) -> int:
+        with self.transaction() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT COUNT(*) FROM notifications WHERE event_type = ?", (event_type,))
+            count = cursor.fetchone()[0]
+        return count
+
+    def mark_chat_dead(self, chat_id: int, reason: str):
+        with self.transaction() as conn:
+            cursor = conn.cursor()
+            self._dead_chat_row(cursor, chat_id, reason)
+
+    def _dead_chat_row(self, cursor: sqlite3.Cursor, chat_id: int, reason: str):
+        # Подписки недоступного чата удаляются сразу: рассылки больше не тратят на него
+        # отправки, а вернувшийся пользователь подпишется заново
         cursor.execute("""
-            SELECT
-                'campaign' AS event_type,
-                c.name AS event_name,
-                c.date_time AS date_time,
-                r.user_id AS user_id,
-                r.username AS username,
-                r.first_name AS first_name,
-                r.registered_at AS registered_at
-            FROM campaign_registrations r
-            JOIN campaigns c ON r.campaign_id = c.id
-            ORDER BY datetime(c.date_time) ASC, datetime(r.registered_at) ASC
-        """)
-        for row in cursor.fetchall():
-            registrations.append({
-                "event_type": row[0],
-                "event_name": row[1],
-                "date_time": row[2],
-                "user_id": row[3],
-                "username": row[4],
-                "first_name": row[5],
-                "registered_at": row[6],
-            })
-
-        conn.close()
+            INSERT OR REPLACE INTO dead_chats (chat_id, reason, marked_at)
+            VALUES (?, ?, ?)
+        """, (chat_id, reason, int(time.time())))
+        cursor.execute("DELETE FROM notifications WHERE user_id = ?", (chat_id,))
+
+    def revive_chat(self, chat_id: int):
+        with self.transaction() as conn:
+            cursor = conn.cursor()
+            self._revive_chat_row(cursor, chat_id)
+
+    def _revive_chat_row(self, cursor: sqlite3.Cursor, chat_id: int):
+        cursor.execute("DELETE FROM dead_chats WHERE chat_id = ?", (chat_id,))
+
+    def get_dead_chats(self, chat_ids: List[int]) -> Set[int]:
+        # Какие из chat_ids помечены недоступными
+        if not chat_ids:
+            return set()
+        with self.transaction() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                f"SELECT chat_id FROM dead_chats WHERE chat_id IN ({', '.join('?' * len(chat_ids))})",
+                list(chat_ids),
+            )
+            dead = {row[0] for row in cursor.fetchall()}
+        return dead
+
+    def get_all_registrations_for_reminders(self) -> Iterator[Registration]:
+        # Подтверждённые регистрации на предстоящие мероприятия, потоком (см. stream_registrations)
+        columns = ("event_type", "event_id", "event_name", "date_time", "user_id")
+        return self.stream_registrations(
+            columns, upcoming_only=True, record=Registration, status=REGISTRATION_CONFIRMED
+        )
+
+    def stream_registrations(
+        self, columns=EXPORT_COLUMNS, upcoming_only: bool = False, batch_size: int = 1000, record=None,
+        status: Optional[str] = None,
+    ) -> Iterator:
+        # Регистрации всех типов мероприятий одним запросом UNION ALL в порядке
+        # REGISTRATION_ORDER: SQLite сливает ветки, уже упорядоченные по индексам.
+        # Строки читаются пачками по batch_size и отдаются кортежами в порядке columns
+        # или записями класса record (records.Registration). status оставляет
+        # только регистрации с этим статусом.
+        # Генератор держит соединение своего потока, поэтому его нужно дочитывать в нём же.
+        columns = tuple(columns)
+        selected = columns + tuple(column for column in REGISTRATION_ORDER if column not in columns)
+        conditions = []
+        branch_params = []
+        if upcoming_only:
+            conditions.append("e.starts_at > ?")
+            branch_params.append(int(time.time()))
+        if status is not None:
+            conditions.append("r.status = ?")
+            branch_params.append(status)
+        params = branch_params * len(EVENT_TABLES)
+        sql = (
+            " UNION ALL ".join(_registrations_select(kind, selected, conditions) for kind in sorted(EVENT_TABLES))
+            + " ORDER BY " + ", ".join(REGISTRATION_ORDER)
+        )
+        width = len(columns)
+        with self.transaction() as conn:
+            cursor = conn.cursor()
+            cursor.execute(sql, params)
+            if record is not None:
+                cursor.row_factory = record.row_factory(cursor)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                if record is None and len(selected) > width:
+                    # Колонки сортировки, которые не запрашивали
+                    rows = [row[:width] for row in rows]
+                yield from rows
+
+    def iter_registrations(self, batch_size: int = 1000) -> Iterator[Tuple]:
+        # Все регистрации потоком в порядке EXPORT_COLUMNS
+        return self.stream_registrations(EXPORT_COLUMNS, batch_size=batch_size)
+
+    def get_all_registrations(self) -> Iterator[Registration]:
+        return self.stream_registrations(REGISTRATION_FIELDS, record=Registration)
+
+    def get_registrations_page(
+        self,
+        event_type: Optional[str] = None,
+        event_id: Optional[int] = None,
+        upcoming_only: bool = True,
+        cursor: Optional[Tuple[Optional[int], int, str, int]] = None,
+        limit: int = 20,
+    ) -> List[Registration]:
+        # Keyset-страница регистраций в порядке REGISTRATION_ORDER — том же, что у потока
+        # stream_registrations (выгрузка). cursor — ключ (starts_at, event_id, event_type,
+        # registration_id) последней строки предыдущей страницы. Каждая ветка UNION ALL
+        # читает по индексу не больше limit строк, итог сливается без сортировки всей таблицы.
+        # Мероприятия с неразобранной датой (starts_at NULL) идут первыми, как в выгрузке.
+        event_types = [event_type] if event_type else sorted(EVENT_TABLES)
+        parts = []
+        params: List[Any] = []
+        for kind in event_types:
+            conditions = []
+            if upcoming_only:
+                conditions.append("e.starts_at > ?")
+                params.append(int(time.time()))
+            if event_id is not None:
+                conditions.append("e.id = ?")
+                params.append(event_id)
+            if cursor is not None:
+                starts_at, cursor_event_id, cursor_type, cursor_registration_id = cursor
+                if kind == cursor_type:
+                    after = (starts_at, cursor_event_id, cursor_registration_id)
+                elif kind > cursor_type:
+                    # Этот тип идёт после типа курсора при тех же времени начала и id мероприятия
+                    after = (starts_at, cursor_event_id, -1)
+                else:
+                    after = (starts_at, cursor_event_id, 2 ** 62)
+                if starts_at is None:
+                    # NULL не сравнивается: дочитываем мероприятия без даты, затем все остальные
+                    conditions.append("(e.starts_at IS NULL AND (e.id, r.id) > (?, ?) OR e.starts_at IS NOT NULL)")
+                    params.extend(after[1:])
+                else:
+                    conditions.append("(e.starts_at, e.id, r.id) > (?, ?, ?)")
+                    params.extend(after)
+            params.append(limit)
+            parts.append(
+                "SELECT * FROM ("
+                + _registrations_select(kind, REGISTRATION_FIELDS, conditions)
+                + " ORDER BY e.starts_at, e.id, r.id LIMIT ?)"
+            )
+        params.append(limit)
+        with self.transaction() as conn:
+            cursor_db = conn.cursor()
+            cursor_db.execute(
+                " UNION ALL ".join(parts) + " ORDER BY " + ", ".join(REGISTRATION_ORDER) + " LIMIT ?",
+                params,
+            )
+            cursor_db.row_factory = Registration.row_factory(cursor_db)
+            registrations = cursor_db.fetchall()
         return registrations
 
     def mark_reminder_sent(self, event_type: str, event_id: int, user_id: int, reminder_type: str):
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute("""
+        self.mark_reminders_sent([(event_type, event_id, user_id, reminder_type)])
+
+    def mark_reminders_sent(self, reminders: List[Tuple[str, int, int, str]]):
+        # reminders: (event_type, event_id, user_id, reminder_type), один коммит на всю пачку
+        with self.transaction() as conn:
+            cursor = conn.cursor()
+            self._reminder_rows(cursor, reminders)
+
+    def _reminder_rows(self, cursor: sqlite3.Cursor, reminders: List[Tuple[str, int, int, str]]):
+        cursor.executemany("""
             INSERT OR IGNORE INTO reminders (event_type, event_id, user_id, reminder_type)
             VALUES (?, ?, ?, ?)
-        """, (event_type, event_id, user_id, reminder_type))
-        conn.commit()
-        conn.close()
+        """, reminders)
+
+    def get_pending_reminders(self, event_type: str, event_id: int, reminder_type: str) -> Tuple[Optional[Event], List[int]]:
+        # Мероприятие и пользователи, которым это напоминание ещё не отправлено, одним запросом.
+        # Колонки мероприятия есть в каждой строке, запись Event строится по первой;
+        # если отправлять некому, мероприятие не нужно и возвращается None
+        events_table, registrations_table, event_column = EVENT_TABLES[event_type]
+        with self.transaction() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"""
+                SELECT '{event_type}' AS event_type, e.*, r.user_id AS pending_user_id
+                FROM {events_table} e
+                JOIN {registrations_table} r ON r.{event_column} = e.id
+                WHERE e.id = ? AND r.status = '{REGISTRATION_CONFIRMED}'
+                  AND NOT EXISTS (
+                      SELECT 1 FROM reminders rm
+                      WHERE rm.event_type = ? AND rm.event_id = e.id
+                        AND rm.user_id = r.user_id AND rm.reminder_type = ?
+                  )
+                  AND NOT EXISTS (SELECT 1 FROM dead_chats d WHERE d.chat_id = r.user_id)
+            """, (event_id, event_type, reminder_type))
+            rows = cursor.fetchall()
+            event = Event.row_factory(cursor)(cursor, rows[0]) if rows else None
+        return event, [row[-1] for row in rows]
 
     def was_reminder_sent(self, event_type: str, event_id: int, user_id: int, reminder_type: str) -> bool:
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT COUNT(*) FROM reminders
-            WHERE event_type = ? AND event_id = ? AND user_id = ? AND reminder_type = ?
-        """, (event_type, event_id, user_id, reminder_type))
-        count = cursor.fetchone()[0]
-        conn.close()
+        with self.transaction() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT COUNT(*) FROM reminders
+                WHERE event_type = ? AND event_id = ? AND user_id = ? AND reminder_type = ?
+            """, (event_type, event_id, user_id, reminder_type))
+            count = cursor.fetchone()[0]
         return count > 0
 
+    def delete_event(self, event_type: str, event_id: int) -> None:
+        events_table = EVENT_TABLES[event_type][0]
+        with self.transaction() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"DELETE FROM {events_table} WHERE id = ?", (event_id,))
+
     def delete_oneshot(self, oneshot_id: int) -> None:
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM oneshots WHERE id = ?", (oneshot_id,))
-        conn.commit()
-        conn.close()
+        self.delete_event("oneshot", oneshot_id)
 
     def delete_campaign(self, campaign_id: int) -> None:
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM campaigns WHERE id = ?", (campaign_id,))
-        conn.commit()
-        conn.close()
+        self.delete_event("campaign", campaign_id)
 
     def add_review(self, user_id: int, username: str, first_name: str, text: str):
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute("""
-            INSERT INTO reviews (user_id, username, first_name, text)
-            VALUES (?, ?, ?, ?)
-        """, (user_id, username, first_name, text))
-        conn.commit()
-        conn.close()
+        with self.transaction() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                INSERT INTO reviews (user_id, username, first_name, text)
+                VALUES (?, ?, ?, ?)
+            """, (user_id, username, first_name, text))
 
-    def get_latest_reviews(self, limit: int = 5):
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT username, first_name, text, created_at FROM reviews
-            ORDER BY created_at DESC
-            LIMIT ?
-        """, (limit,))
-        reviews = cursor.fetchall()
-        conn.close()
+    def get_latest_reviews(self, limit: int = 5) -> List[Review]:
+        with self.transaction() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT id, username, first_name, text, created_at FROM reviews
+                ORDER BY created_at DESC
+                LIMIT ?
+            """, (limit,))
+            cursor.row_factory = Review.row_factory(cursor)
+            reviews = cursor.fetchall()
         return reviews
 
-    def get_all_reviews(self):
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT id, username, first_name, text, created_at FROM reviews
-            ORDER BY created_at DESC
-        """)
-        reviews = cursor.fetchall()
-        conn.close()
+    def get_all_reviews(self) -> List[Review]:
+        with self.transaction() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT id, username, first_name, text, created_at FROM reviews
+                ORDER BY created_at DESC
+            """)
+            cursor.row_factory = Review.row_factory(cursor)
+            reviews = cursor.fetchall()
         return reviews
 
+    def get_reviews_page(
+        self, cursor: Optional[Tuple[str, int]] = None, direction: str = "n", limit: int = 5
+    ) -> Tuple[List[Review], bool]:
+        # Keyset-пагинация от новых отзывов к старым. cursor — (created_at, id) крайнего
+        # отзыва текущей страницы, direction "n" — следующая страница, "p" — предыдущая.
+        # Возвращает отзывы страницы и признак, что в этом направлении есть ещё.
+        with self.transaction() as conn:
+            cursor_db = conn.cursor()
+            if cursor is None:
+                cursor_db.execute("""
+                    SELECT id, username, first_name, text, created_at FROM reviews
+                    ORDER BY created_at DESC, id DESC
+                    LIMIT ?
+                """, (limit + 1,))
+            elif direction == "n":
+                cursor_db.execute("""
+                    SELECT id, username, first_name, text, created_at FROM reviews
+                    WHERE (created_at, id) < (?, ?)
+                    ORDER BY created_at DESC, id DESC
+                    LIMIT ?
+                """, (*cursor, limit + 1))
+            else:
+                cursor_db.execute("""
+                    SELECT id, username, first_name, text, created_at FROM reviews
+                    WHERE (created_at, id) > (?, ?)
+                    ORDER BY created_at ASC, id ASC
+                    LIMIT ?
+                """, (*cursor, limit + 1))
+            cursor_db.row_factory = Review.row_factory(cursor_db)
+            reviews = cursor_db.fetchall()
+        has_more = len(reviews) > limit
+        reviews = reviews[:limit]
+        if cursor is not None and direction == "p":
+            reviews.reverse()
+        return reviews, has_more
+
+    def get_persistence_data(self, kind: str) -> Dict[str, str]:
+        with self.transaction() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT key, data FROM persistence WHERE kind = ?", (kind,))
+            data = dict(cursor.fetchall())
+        return data
+
+    def save_persistence_data(self, upserts: List[Tuple[str, str, str]], deletes: List[Tuple[str, str]]):
+        # upserts: (kind, key, data), deletes: (kind, key) — всё одним коммитом
+        with self.transaction() as conn:
+            cursor = conn.cursor()
+            cursor.executemany("""
+                INSERT INTO persistence (kind, key, data) VALUES (?, ?, ?)
+                ON CONFLICT(kind, key) DO UPDATE SET data = excluded.data
+            """, upserts)
+            cursor.executemany("DELETE FROM persistence WHERE kind = ? AND key = ?", deletes)
+
+    def acquire_lease(self, name: str, owner: str, expires_at: int, now: int) -> bool:
+        # Берёт свободную или истёкшую аренду либо продлевает свою; True, если аренда наша
+        with self.transaction() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                INSERT INTO leases (name, owner, expires_at) VALUES (?, ?, ?)
+                ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at
+                WHERE leases.owner = excluded.owner OR leases.expires_at <= ?
+            """, (name, owner, expires_at, now))
+            held = cursor.rowcount > 0
+        return held
+
+    def release_lease(self, name: str, owner: str):
+        with self.transaction() as conn:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM leases WHERE name = ? AND owner = ?", (name, owner))
+
+    def get_events_version(self) -> int:
+        with self.transaction() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT value FROM versions WHERE name = 'events'")
+            version = cursor.fetchone()[0]
+        return version
+
+    def enqueue_broadcast(self, event_type: str, event_id: int, admin_id: int) -> int:
+        with self.transaction() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                INSERT INTO broadcasts (event_type, event_id, admin_id, created_at)
+                VALUES (?, ?, ?, ?)
+            """, (event_type, event_id, admin_id, int(time.time())))
+            broadcast_id = cursor.lastrowid
+        return broadcast_id
+
+    def claim_broadcasts(self, owner: str) -> List[Dict[str, Any]]:
+        # Забирает все ещё не взятые рассылки одним UPDATE, поэтому два процесса
+        # не получат одну и ту же рассылку
+        with self.transaction() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                UPDATE broadcasts SET claimed_by = ?
+                WHERE claimed_by IS NULL
+                RETURNING id, event_type, event_id, admin_id
+            """, (owner,))
+            columns = [description[0] for description in cursor.description]
+            broadcasts = [dict(zip(columns, row)) for row in cursor.fetchall()]
+        return sorted(broadcasts, key=lambda broadcast: broadcast["id"])
+
+    def finish_broadcast(self, broadcast_id: int):
+        with self.transaction() as conn:
+            cursor = conn.cursor()
+            cursor.execute("UPDATE broadcasts SET finished_at = ? WHERE id = ?", (int(time.time()), broadcast_id))
+
     def delete_review(self, review_id: int):
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM reviews WHERE id = ?", (review_id,))
-        conn.commit()
-        conn.close()
+        with self.transaction() as conn:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM reviews WHERE id = ?", (review_id,))
+
+    def apply_writes(self, writes: List[Tuple[str, tuple]]) -> List[Tuple[bool, Any]]:
+        # Групповая запись (group_commit.py): операции из BATCHED_WRITES одной транзакцией
+        # с одним коммитом. Каждая операция идёт в своей точке сохранения, поэтому ошибка
+        # одной (IntegrityError повторной записи или любое другое исключение, например
+        # KeyError неизвестного типа мероприятия) откатывает только её.
+        # Возвращает (успех, результат или исключение) для каждой операции по порядку.
+        results = []
+        with self.transaction() as conn:
+            cursor = conn.cursor()
+            # Блокировка записи берётся сразу, а не при первой вставке посреди пачки
+            cursor.execute("BEGIN IMMEDIATE")
+            for name, args in writes:
+                cursor.execute("SAVEPOINT batched_write")
+                try:
+                    results.append((True, BATCHED_WRITES[name](self, cursor, *args)))
+                except Exception as e:
+                    cursor.execute("ROLLBACK TO batched_write")
+                    results.append((False, e))
+                cursor.execute("RELEASE batched_write")
+        return results
+
+
+# Операции, которые можно выполнять в групповой записи (Database.apply_writes):
+# имя метода -> вставка без коммита на переданном курсоре
+BATCHED_WRITES = {
+    "register": Database._register_row,
+    "add_notification_request": Database._notification_row,
+    "mark_reminders_sent": Database._reminder_rows,
+    "mark_chat_dead": Database._dead_chat_row,
+    "revive_chat": Database._revive_chat_row,
+}
+
+
+class UpcomingEventsCache:
+    """Кэш списков предстоящих мероприятий по типу мероприятия.
+
+    Запись сбрасывается явно при добавлении или удалении мероприятия и сама
+    устаревает в момент начала ближайшего мероприятия из списка, чтобы
+    не показывать уже начавшиеся. Закэшированные списки нельзя изменять.
+    """
+
+    def __init__(self):
+        self._entries: Dict[str, Tuple[Optional[int], List[Event]]] = {}
+        # Поколение растёт при каждом сбросе: результат запроса, начатого
+        # до сброса, в кэш уже не попадёт
+        self._generation: Dict[str, int] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, event_type: str, now: float) -> Optional[List[Event]]:
+        entry = self._entries.get(event_type)
+        if entry is not None:
+            expires_at, events = entry
+            if expires_at is None or now < expires_at:
+                self.hits += 1
+                return events
+            del self._entries[event_type]
+        self.misses += 1
+        return None
+
+    def generation(self, event_type: str) -> int:
+        return self._generation.get(event_type, 0)
+
+    def put(self, event_type: str, events: List[Event], generation: int):
+        if generation != self.generation(event_type):
+            return
+        expires_at = events[0].starts_at if events else None
+        self._entries[event_type] = (expires_at, events)
+
+    def invalidate(self, event_type: str):
+        self._entries.pop(event_type, None)
+        self._generation[event_type] = self.generation(event_type) + 1
+
+
+def _timed_call(func, *args, **kwargs):
+    # Выполняется в потоке базы: время считается без ожидания в очереди пула
+    name = getattr(func, "__name__", "unknown")
+    started = time.perf_counter()
+    try:
+        return func(*args, **kwargs)
+    except Exception:
+        DB_QUERY_ERRORS.inc(name)
+        raise
+    finally:
+        DB_QUERY_DURATION.observe(time.perf_counter() - started, name)
+
+
+class AsyncDatabase:
+    """Асинхронный интерфейс к Database с теми же методами.
+
+    Запросы выполняются в отдельных потоках с постоянными соединениями из пула,
+    поэтому event loop бота не ждёт sqlite3. Запись идёт через один поток,
+    чтение — через несколько, и в режиме WAL читатели не ждут писателя.
+    Записи на мероприятия, подписки и отметки напоминаний копятся и коммитятся
+    пачками (group_commit.py), если задан group_commit_window.
+    """
+
+    READ_PREFIXES = ("get_", "was_")
+    # Методы-генераторы: в потоке базы создаётся только генератор, а запросы шли бы уже
+    # в event loop при его чтении. Их нужно дочитывать целиком внутри run_read
+    # (как export_registrations); подписчиков читает iter_users_to_notify ниже.
+    STREAMING_METHODS = frozenset({
+        "stream_registrations", "iter_registrations", "get_all_registrations",
+        "get_all_registrations_for_reminders", "iter_users_to_notify",
+    })
+
+    def __init__(self, db_name: str = "dnd_bot.db", readers: int = 4, query_log: Optional[QueryLog] = None,
+                 group_commit_window: Optional[float] = None):
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")
+        self._readers = ThreadPoolExecutor(max_workers=readers, thread_name_prefix="db-reader")
+        self.sync = Database(db_name=db_name, query_log=query_log)
+        # None — каждая запись своим коммитом
+        self.group_commit = (
+            GroupCommit(self.run, self.sync.apply_writes, window=group_commit_window)
+            if group_commit_window is not None else None
+        )
+        self.upcoming_cache = UpcomingEventsCache()
+        # Последний увиденный счётчик изменений мероприятий (таблица versions)
+        self._events_version: Optional[int] = None
+
+    async def run(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._writer, functools.partial(_timed_call, func, *args, **kwargs))
+
+    async def run_read(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._readers, functools.partial(_timed_call, func, *args, **kwargs))
+
+    def __getattr__(self, name: str):
+        if name in self.STREAMING_METHODS:
+            raise AttributeError(f"{name} читает базу при итерации: вызывайте его внутри run_read")
+        method = getattr(self.sync, name)
+        if name.startswith("_") or not callable(method):
+            raise AttributeError(name)
+        runner = self.run_read if name.startswith(self.READ_PREFIXES) else self.run
+
+        @functools.wraps(method)
+        async def wrapper(*args, **kwargs):
+            return await runner(method, *args, **kwargs)
+
+        # Кэшируем обёртку, чтобы __getattr__ вызывался один раз на метод
+        setattr(self, name, wrapper)
+        return wrapper
+
+    async def get_upcoming(self, event_type: str) -> List[Event]:
+        events = self.upcoming_cache.get(event_type, time.time())
+        if events is None:
+            generation = self.upcoming_cache.generation(event_type)
+            events = await self.run_read(self.sync.get_upcoming, event_type)
+            self.upcoming_cache.put(event_type, events, generation)
+        return events
+
+    async def get_upcoming_oneshots(self) -> List[Event]:
+        return await self.get_upcoming("oneshot")
+
+    async def get_upcoming_campaigns(self) -> List[Event]:
+        return await self.get_upcoming("campaign")
+
+    async def _write_event(self, event_type: str, method, *args, **kwargs):
+        try:
+            return await self.run(method, *args, **kwargs)
+        finally:
+            self.upcoming_cache.invalidate(event_type)
+
+    async def add_oneshot(self, *args, **kwargs) -> int:
+        return await self._write_event("oneshot", self.sync.add_oneshot, *args, **kwargs)
+
+    async def add_campaign(self, *args, **kwargs) -> int:
+        return await self._write_event("campaign", self.sync.add_campaign, *args, **kwargs)
+
+    async def delete_event(self, event_type: str, event_id: int) -> None:
+        await self._write_event(event_type, self.sync.delete_event, event_type, event_id)
+
+    async def delete_oneshot(self, oneshot_id: int) -> None:
+        await self.delete_event("oneshot", oneshot_id)
+
+    async def delete_campaign(self, campaign_id: int) -> None:
+        await self.delete_event("campaign", campaign_id)
+
+    async def _batched_write(self, name: str, *args):
+        if self.group_commit is None:
+            return await self.run(getattr(self.sync, name), *args)
+        return await self.group_commit.submit(name, *args)
+
+    async def register(self, event_type: str, event_id: int, user_id: int, username: str = None,
+                       first_name: str = None) -> Optional[str]:
+        try:
+            return await self._batched_write("register", event_type, event_id, user_id, username, first_name)
+        except sqlite3.IntegrityError:
+            # Уже записан — как и в Database.register
+            return None
+
+    async def register_for_oneshot(self, oneshot_id: int, user_id: int, username: str = None,
+                                   first_name: str = None) -> Optional[str]:
+        return await self.register("oneshot", oneshot_id, user_id, username, first_name)
+
+    async def register_for_campaign(self, campaign_id: int, user_id: int, username: str = None,
+                                    first_name: str = None) -> Optional[str]:
+        return await self.register("campaign", campaign_id, user_id, username, first_name)
+
+    async def add_notification_request(self, user_id: int, event_type: str):
+        await self._batched_write("add_notification_request", user_id, event_type)
+
+    async def mark_reminder_sent(self, event_type: str, event_id: int, user_id: int, reminder_type: str):
+        await self._batched_write("mark_reminders_sent", [(event_type, event_id, user_id, reminder_type)])
+
+    async def mark_reminders_sent(self, reminders: List[Tuple[str, int, int, str]]):
+        await self._batched_write("mark_reminders_sent", reminders)
+
+    async def iter_users_to_notify(self, event_type: str, batch_size: int = 1000) -> AsyncIterator[int]:
+        # Как Database.iter_users_to_notify, каждая страница — отдельное чтение в потоке базы
+        after_user_id = 0
+        while True:
+            user_ids = await self.run_read(self.sync.get_subscribers_page, event_type, after_user_id, batch_size)
+            for user_id in user_ids:
+                yield user_id
+            if len(user_ids) < batch_size:
+                return
+            after_user_id = user_ids[-1]
+
+    async def mark_chat_dead(self, chat_id: int, reason: str):
+        await self._batched_write("mark_chat_dead", chat_id, reason)
+
+    async def revive_chat(self, chat_id: int):
+        # Обычно чат жив: сначала дешёвое чтение, запись — только если он был помечен
+        if await self.run_read(self.sync.get_dead_chats, [chat_id]):
+            await self._batched_write("revive_chat", chat_id)
+
+    async def refresh_events_version(self) -> bool:
+        """Сбрасывает кэш, если мероприятия изменились в другом процессе.
+
+        Возвращает True, если счётчик изменений вырос с прошлой проверки.
+        """
+        version = await self.run_read(self.sync.get_events_version)
+        changed = self._events_version is not None and version != self._events_version
+        self._events_version = version
+        if changed:
+            for event_type in EVENT_TABLES:
+                self.upcoming_cache.invalidate(event_type)
+        return changed
+
+    async def close(self):
+        if self.group_commit is not None:
+            await self.group_commit.flush()
+        self._readers.shutdown(wait=True)
+        self._writer.shutdown(wait=True)
+        self.sync.close()
@@ -0,0 +1,55 @@
+import csv
+import io
+import tempfile
+
+from database import EXPORT_COLUMNS, Database
+
+try:
+    from openpyxl import Workbook
+except ImportError:  # XLSX-выгрузка доступна только с установленным openpyxl
+    Workbook = None
+
+XLSX_AVAILABLE = Workbook is not None
+
+def write_registrations_csv(db: Database, fileobj) -> int:
+    # utf-8-sig, чтобы Excel сразу открывал кириллицу
+    text = io.TextIOWrapper(fileobj, encoding="utf-8-sig", newline="")
+    writer = csv.writer(text)
+    writer.writerow(EXPORT_COLUMNS)
+    count = 0
+    for row in db.iter_registrations():
+        writer.writerow(row)
+        count += 1
+    text.flush()
+    text.detach()
+    return count
+
+
+def write_registrations_xlsx(db: Database, fileobj) -> int:
+    # write_only-книга пишет строки сразу в XML листа, не держа их все в памяти
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("Регистрации")
+    sheet.append(EXPORT_COLUMNS)
+    count = 0
+    for row in db.iter_registrations():
+        sheet.append(row)
+        count += 1
+    workbook.save(fileobj)
+    return count
+
+
+def export_registrations(db: Database, file_format: str = "csv"):
+    """Выгружает все регистрации во временный файл и возвращает (файл, число строк).
+
+    Строки читаются из базы пачками и сразу пишутся в файл, поэтому память
+    не растёт с числом регистраций. Файл закрывает вызывающий код.
+    """
+    # Файл на диске, а не SpooledTemporaryFile: пока тот в памяти, у него name = None,
+    # и PTB не может отправить его как документ
+    fileobj = tempfile.TemporaryFile()
+    if file_format == "xlsx":
+        count = write_registrations_xlsx(db, fileobj)
+    else:
+        count = write_registrations_csv(db, fileobj)
+    fileobj.seek(0)
+    return fileobj, count
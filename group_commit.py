@@ -0,0 +1,81 @@
+"""Групповая запись: мелкие вставки многих обработчиков одним коммитом.
+
+Во время анонса сотни пользователей одновременно записываются и подписываются,
+и каждая такая вставка раньше шла своей транзакцией со своим коммитом, выстраиваясь
+в очередь за блокировкой записи SQLite. GroupCommit копит операции window секунд
+(и всё, что пришло, пока шёл предыдущий коммит, — при window = 0 только это), выполняет их в потоке записи одной
+транзакцией (Database.apply_writes) и раздаёт каждому вызывающему его результат
+или его исключение — IntegrityError повторной записи получает только её автор.
+"""
+import asyncio
+import logging
+from typing import Any, List, Optional, Tuple
+
+from metrics import DB_WRITE_BATCH_SIZE
+
+logger = logging.getLogger(__name__)
+
+
+class GroupCommit:
+    def __init__(self, run, apply_writes, window: float = 0.0, max_batch: int = 500):
+        # run(func, *args) — выполнение в потоке записи (AsyncDatabase.run),
+        # apply_writes — Database.apply_writes
+        self.run = run
+        self.apply_writes = apply_writes
+        self.window = window
+        self.max_batch = max_batch
+        self._pending: List[Tuple[str, tuple, asyncio.Future]] = []
+        self._flush_task: Optional[asyncio.Task] = None
+        # Будит ожидание окна раньше срока, когда пачка набралась
+        self._wakeup: Optional[asyncio.Future] = None
+
+    async def submit(self, name: str, *args) -> Any:
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((name, args, future))
+        if len(self._pending) >= self.max_batch:
+            self._wake()
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later())
+        return await future
+
+    async def _flush_later(self):
+        # Пачки пишутся, пока есть ожидающие: всё, что накопилось за время коммита,
+        # уходит следующим коммитом без дополнительного ожидания
+        self._wakeup = asyncio.get_running_loop().create_future()
+        try:
+            await asyncio.wait_for(self._wakeup, self.window)
+        except asyncio.TimeoutError:
+            pass
+        self._wakeup = None
+        while self._pending:
+            batch, self._pending = self._pending[:self.max_batch], self._pending[self.max_batch:]
+            await self._write(batch)
+
+    def _wake(self):
+        if self._wakeup is not None and not self._wakeup.done():
+            self._wakeup.set_result(None)
+
+    async def _write(self, batch: List[Tuple[str, tuple, asyncio.Future]]):
+        DB_WRITE_BATCH_SIZE.observe(len(batch))
+        try:
+            results = await self.run(self.apply_writes, [(name, args) for name, args, _ in batch])
+        except Exception as e:
+            # Коммит пачки не прошёл: ошибка у всех, кто в ней был
+            logger.error(f"Ошибка групповой записи ({len(batch)} операций): {e}")
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, _, future), (ok, result) in zip(batch, results):
+            if future.done():
+                continue
+            if ok:
+                future.set_result(result)
+            else:
+                future.set_exception(result)
+
+    async def flush(self):
+        # Дописывает всё накопленное, например перед закрытием базы
+        if self._flush_task is not None:
+            self._wake()
+            await self._flush_task
@@ -0,0 +1,231 @@
+"""Метрики в текстовом формате Prometheus без внешних зависимостей.
+
+Метрики объявляются на уровне модуля и регистрируются в REGISTRY, который
+отдаёт HTTP-обработчик /metrics (webserver.py). Наблюдения могут приходить
+из потоков базы данных, поэтому изменение значений идёт под замком.
+"""
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, Optional, Sequence, Tuple
+
+from telegram.error import NetworkError, TimedOut
+from telegram.request import BaseRequest, HTTPXRequest, RequestData
+
+# Границы корзин гистограмм задержек, в секундах
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+Labels = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{_escape(str(value))}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, "Metric"] = {}
+
+    def register(self, metric: "Metric"):
+        # Повторная регистрация под тем же именем заменяет метрику
+        self._metrics[metric.name] = metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), registry: Registry = REGISTRY):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def samples(self) -> Iterable[str]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self) -> Iterable[str]:
+        with self._lock:
+            values = list(self._values.items())
+        for labels, value in values:
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, *args, buckets: Sequence[float] = DEFAULT_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(buckets)
+        # labels -> [счётчики по корзинам (последняя — +Inf), сумма]
+        self._values: Dict[Labels, list] = {}
+
+    def observe(self, value: float, *labels: str):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def time(self, *labels: str) -> "_Timer":
+        return _Timer(self, labels)
+
+    def samples(self) -> Iterable[str]:
+        with self._lock:
+            values = [(labels, list(counts), total) for labels, (counts, total) in self._values.items()]
+        names = self.labelnames + ("le",)
+        for labels, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                yield f"{self.name}_bucket{_format_labels(names, labels + (_format_value(bound),))} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(total)}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}"
+
+
+class _Timer:
+    def __init__(self, histogram: Histogram, labels: Labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started, *self.labels)
+
+
+class CallbackMetric(Metric):
+    """Значения читаются в момент запроса /metrics: размеры очередей, счётчики кэшей."""
+
+    def __init__(self, name: str, help: str, read: Callable[[], Iterable[Tuple[Labels, float]]],
+                 labelnames: Sequence[str] = (), kind: str = "gauge", registry: Registry = REGISTRY):
+        self.kind = kind
+        self.read = read
+        super().__init__(name, help, labelnames, registry)
+
+    def samples(self) -> Iterable[str]:
+        for labels, value in self.read():
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+
+
+def gauge(name: str, help: str, read: Callable[[], float]) -> CallbackMetric:
+    return CallbackMetric(name, help, lambda: [((), read())])
+
+
+HANDLER_DURATION = Histogram(
+    "bot_handler_duration_seconds", "Время работы обработчика обновления", ["handler"]
+)
+HANDLER_ERRORS = Counter(
+    "bot_handler_errors_total", "Исключения в обработчиках обновлений", ["handler"]
+)
+DB_QUERY_DURATION = Histogram(
+    "bot_db_query_duration_seconds", "Время выполнения метода Database в потоке базы", ["method"]
+)
+DB_QUERY_ERRORS = Counter(
+    "bot_db_query_errors_total", "Исключения в методах Database", ["method"]
+)
+DB_WRITE_BATCH_SIZE = Histogram(
+    "bot_db_write_batch_size", "Операций в одном коммите групповой записи (group_commit.py)",
+    buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500),
+)
+BOT_API_DURATION = Histogram(
+    "bot_api_request_duration_seconds", "Время вызова метода Bot API", ["method"]
+)
+BOT_API_ERRORS = Counter(
+    "bot_api_errors_total", "Ошибки вызовов Bot API по типу", ["method", "error"]
+)
+DEAD_CHATS = Counter(
+    "bot_dead_chats_total", "Чаты, помеченные недоступными (бот заблокирован, чат удалён)", ["reason"]
+)
+
+# Коды ответа Bot API, которые различаем в bot_api_errors_total
+HTTP_ERROR_TYPES = {400: "bad_request", 401: "unauthorized", 403: "forbidden", 404: "not_found", 409: "conflict", 429: "retry_after"}
+
+
+class InstrumentedRequest(BaseRequest):
+    """Транспорт Bot API, который замеряет каждый вызов и считает ошибки.
+
+    Оборачивает другой транспорт (по умолчанию HTTPXRequest, как у ApplicationBuilder).
+    """
+
+    def __init__(self, request: Optional[BaseRequest] = None):
+        self.request = request or HTTPXRequest(connection_pool_size=256)
+
+    @property
+    def read_timeout(self) -> Optional[float]:
+        return self.request.read_timeout
+
+    async def initialize(self) -> None:
+        await self.request.initialize()
+
+    async def shutdown(self) -> None:
+        await self.request.shutdown()
+
+    async def do_request(
+        self,
+        url: str,
+        method: str,
+        request_data: Optional[RequestData] = None,
+        read_timeout=BaseRequest.DEFAULT_NONE,
+        write_timeout=BaseRequest.DEFAULT_NONE,
+        connect_timeout=BaseRequest.DEFAULT_NONE,
+        pool_timeout=BaseRequest.DEFAULT_NONE,
+    ) -> Tuple[int, bytes]:
+        api_method = url.rsplit("/", 1)[-1]
+        started = time.perf_counter()
+        try:
+            status, payload = await self.request.do_request(
+                url, method, request_data, read_timeout, write_timeout, connect_timeout, pool_timeout
+            )
+        except TimedOut:
+            BOT_API_ERRORS.inc(api_method, "timed_out")
+            raise
+        except NetworkError:
+            BOT_API_ERRORS.inc(api_method, "network")
+            raise
+        finally:
+            BOT_API_DURATION.observe(time.perf_counter() - started, api_method)
+        if status >= 400:
+            error = HTTP_ERROR_TYPES.get(status, "server_error" if status >= 500 else f"http_{status}")
+            BOT_API_ERRORS.inc(api_method, error)
+        return status, payload
@@ -0,0 +1,107 @@
+import asyncio
+import json
+import logging
+from typing import Any, Dict, Optional, Tuple
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from database import AsyncDatabase
+
+logger = logging.getLogger(__name__)
+
+
+class SQLitePersistence(BasePersistence):
+    """Хранит user_data, chat_data, bot_data и состояния диалогов в таблице persistence.
+
+    Запись отложенная: изменения копятся в памяти (повторные изменения одного ключа
+    схлопываются) и через flush_delay секунд пишутся одной транзакцией, поэтому
+    обработка обновлений не ждёт коммита.
+    """
+
+    def __init__(self, db: AsyncDatabase, update_interval: float = 5, flush_delay: float = 1.0):
+        super().__init__(store_data=PersistenceInput(callback_data=False), update_interval=update_interval)
+        self.db = db
+        self.flush_delay = flush_delay
+        # (kind, key) -> JSON или None для удаления
+        self._dirty: Dict[Tuple[str, str], Optional[str]] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+
+    async def _load(self, kind: str) -> Dict[str, Any]:
+        rows = await self.db.get_persistence_data(kind)
+        return {key: json.loads(data) for key, data in rows.items()}
+
+    def _mark(self, kind: str, key: str, data: Any):
+        # Сериализуем сразу, чтобы сохранить снимок, а не объект, который ещё будут менять
+        self._dirty[(kind, key)] = None if data is None else json.dumps(data, ensure_ascii=False)
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_delay)
+        await self._write_dirty()
+
+    async def _write_dirty(self):
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, {}
+        upserts = [(kind, key, data) for (kind, key), data in dirty.items() if data is not None]
+        deletes = [(kind, key) for (kind, key), data in dirty.items() if data is None]
+        try:
+            await self.db.save_persistence_data(upserts, deletes)
+        except Exception as e:
+            logger.error(f"Ошибка сохранения данных диалогов: {e}")
+            # Возвращаем несохранённое, если за это время ключ не изменился снова
+            for entry, data in dirty.items():
+                self._dirty.setdefault(entry, data)
+
+    async def get_user_data(self) -> Dict[int, Dict[Any, Any]]:
+        return {int(key): data for key, data in (await self._load("user")).items()}
+
+    async def get_chat_data(self) -> Dict[int, Dict[Any, Any]]:
+        return {int(key): data for key, data in (await self._load("chat")).items()}
+
+    async def get_bot_data(self) -> Dict[Any, Any]:
+        return (await self._load("bot")).get("bot", {})
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name: str) -> Dict[Tuple, object]:
+        data = await self._load(f"conversation:{name}")
+        return {tuple(json.loads(key)): state for key, state in data.items()}
+
+    async def update_user_data(self, user_id: int, data: Dict[Any, Any]) -> None:
+        # Пустые словари не храним, чтобы не заводить строку на каждого пользователя
+        self._mark("user", str(user_id), data or None)
+
+    async def update_chat_data(self, chat_id: int, data: Dict[Any, Any]) -> None:
+        self._mark("chat", str(chat_id), data or None)
+
+    async def update_bot_data(self, data: Dict[Any, Any]) -> None:
+        self._mark("bot", "bot", data or None)
+
+    async def update_callback_data(self, data) -> None:
+        pass
+
+    async def update_conversation(self, name: str, key: Tuple, new_state: Optional[object]) -> None:
+        self._mark(f"conversation:{name}", json.dumps(list(key)), new_state)
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._mark("user", str(user_id), None)
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        self._mark("chat", str(chat_id), None)
+
+    async def refresh_user_data(self, user_id: int, user_data: Dict[Any, Any]) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: Dict[Any, Any]) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: Dict[Any, Any]) -> None:
+        pass
+
+    async def flush(self) -> None:
+        if self._flush_task is not None and not self._flush_task.done():
+            await self._flush_task
+        await self._write_dirty()
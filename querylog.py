@@ -0,0 +1,153 @@
+"""Журнал медленных запросов SQLite.
+
+Включается переменной SLOW_QUERY_MS: соединения пула создаются с TimedConnection,
+и каждый запрос замеряется по времени и по числу шагов виртуальной машины SQLite
+(обработчик прогресса вызывается раз в progress_steps инструкций). Запросы
+дольше порога пишутся в лог с подставленными параметрами (trace-callback),
+а сводка по всем запросам — при закрытии пула.
+"""
+import logging
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_sql(sql: str) -> str:
+    return " ".join(sql.split())
+
+
+class QueryLog:
+    def __init__(self, threshold: float, progress_steps: int = 1000):
+        # threshold — порог в секундах; 0 пишет в лог каждый запрос
+        self.threshold = threshold
+        self.progress_steps = progress_steps
+        # Дополнительный получатель каждого выполненного запроса: (sql, параметры);
+        # для executemany передаются параметры первого выполнения
+        self.on_execute: Optional[Callable[[str, object], None]] = None
+        # sql -> [выполнений, суммарное время, максимум, шагов VM]
+        self._stats: Dict[str, list] = {}
+        self._lock = threading.Lock()
+
+    def attach(self, conn: "TimedConnection"):
+        conn.query_log = self
+        conn.set_trace_callback(conn.trace)
+        conn.set_progress_handler(conn.progress, self.progress_steps)
+
+    def record(self, sql: str, elapsed: float, steps: int, executed: bool, expanded: Optional[str] = None):
+        sql = normalize_sql(sql)
+        with self._lock:
+            entry = self._stats.get(sql)
+            if entry is None:
+                entry = self._stats[sql] = [0, 0.0, 0.0, 0]
+            entry[0] += executed
+            entry[1] += elapsed
+            entry[2] = max(entry[2], elapsed)
+            entry[3] += steps
+        if elapsed >= self.threshold:
+            stage = "запрос" if executed else "чтение результата"
+            logger.warning(
+                f"Медленный {stage}: {elapsed * 1000:.1f} мс, ~{steps} шагов VM: {normalize_sql(expanded or sql)}"
+            )
+
+    def top(self, limit: int = 10) -> List[Tuple[str, int, float, float, int]]:
+        # (sql, выполнений, суммарно, максимум, шагов VM) по убыванию суммарного времени
+        with self._lock:
+            rows = [(sql, *entry) for sql, entry in self._stats.items()]
+        return sorted(rows, key=lambda row: row[2], reverse=True)[:limit]
+
+    def log_summary(self, limit: int = 10):
+        for sql, count, total, longest, steps in self.top(limit):
+            logger.info(
+                f"{count:>7} × {total * 1000:9.1f} мс (макс. {longest * 1000:.1f} мс, ~{steps} шагов VM): {sql}"
+            )
+
+
+class TimedConnection(sqlite3.Connection):
+    """Соединение, все запросы которого идут через TimedCursor."""
+
+    query_log: Optional[QueryLog] = None
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.steps = 0
+        self.traced: Optional[str] = None
+
+    def trace(self, statement: str):
+        # Первый trace после начала запроса — сам запрос с параметрами,
+        # следующие — выражения триггеров. BEGIN перед изменяющим запросом
+        # модуль sqlite3 выполняет сам
+        if self.traced is None and statement != "BEGIN":
+            self.traced = statement
+
+    def progress(self) -> int:
+        self.steps += 1
+        return 0
+
+    def cursor(self, factory=None):
+        return super().cursor(factory or TimedCursor)
+
+    # Connection.execute в C создаёт обычный курсор, минуя cursor()
+    def execute(self, sql: str, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql: str, parameters):
+        return self.cursor().executemany(sql, parameters)
+
+    def commit(self):
+        started, steps = time.perf_counter(), self.steps
+        super().commit()
+        log = self.query_log
+        if log is not None:
+            log.record("COMMIT", time.perf_counter() - started, (self.steps - steps) * log.progress_steps, True)
+
+
+class TimedCursor(sqlite3.Cursor):
+    """Замеряет выполнение запроса и каждое чтение его результата отдельно."""
+
+    _sql: Optional[str] = None
+
+    def _measure(self, run, sql: Optional[str], executed: bool, parameters=()):
+        conn = self.connection
+        log = conn.query_log
+        if log is None:
+            return run()
+        if executed:
+            conn.traced = None
+            if log.on_execute is not None:
+                log.on_execute(sql, parameters)
+        started, steps = time.perf_counter(), conn.steps
+        try:
+            return run()
+        finally:
+            if sql is not None:
+                log.record(
+                    sql,
+                    time.perf_counter() - started,
+                    (conn.steps - steps) * log.progress_steps,
+                    executed,
+                    conn.traced if executed else None,
+                )
+
+    def execute(self, sql: str, parameters=()):
+        self._sql = sql
+        return self._measure(lambda: super(TimedCursor, self).execute(sql, parameters), sql, True, parameters)
+
+    def executemany(self, sql: str, parameters):
+        self._sql = sql
+        parameters = list(parameters)
+        return self._measure(
+            lambda: super(TimedCursor, self).executemany(sql, parameters), sql, True, parameters[0] if parameters else ()
+        )
+
+    def fetchone(self):
+        return self._measure(super().fetchone, self._sql, False)
+
+    def fetchmany(self, size: int = None):
+        size = self.arraysize if size is None else size
+        return self._measure(lambda: super(TimedCursor, self).fetchmany(size), self._sql, False)
+
+    def fetchall(self):
+        return self._measure(super().fetchall, self._sql, False)
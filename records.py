@@ -0,0 +1,83 @@
+"""Компактные записи для строк из базы: мероприятие, регистрация, отзыв.
+
+Записи используют __slots__, поэтому не держат словарь на каждую строку,
+а колонки доступны как атрибуты (event.name, registration.user_id).
+Записи строит row_factory курсора: соответствие колонок запроса и слотов
+считается один раз на запрос, а не на каждую строку. Колонки запроса,
+которых нет среди слотов, пропускаются, слоты без колонки равны None.
+"""
+import sqlite3
+from typing import Callable, Dict, Tuple
+
+
+class Record:
+    __slots__ = ()
+
+    def __init__(self, **values):
+        for name in self.__slots__:
+            setattr(self, name, values.get(name))
+
+    def __repr__(self) -> str:
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"{type(self).__name__}({fields})"
+
+    @classmethod
+    def row_factory(cls, cursor: sqlite3.Cursor) -> Callable[[sqlite3.Cursor, tuple], "Record"]:
+        # Назначается курсору после execute: cursor.row_factory = Event.row_factory(cursor)
+        columns = tuple(description[0] for description in cursor.description)
+        return _builder(cls, columns)
+
+
+_builders: Dict[Tuple[type, Tuple[str, ...]], Callable] = {}
+
+
+def _builder(cls, columns: Tuple[str, ...]) -> Callable[[sqlite3.Cursor, tuple], Record]:
+    builder = _builders.get((cls, columns))
+    if builder is not None:
+        return builder
+
+    # Дескрипторы слотов: запись через них быстрее setattr по имени
+    slots = set(cls.__slots__)
+    setters = [
+        (index, getattr(cls, name).__set__)
+        for index, name in enumerate(columns)
+        if name in slots
+    ]
+    missing = [getattr(cls, name).__set__ for name in cls.__slots__ if name not in columns]
+    new = cls.__new__
+
+    def build(cursor, row):
+        record = new(cls)
+        for index, setter in setters:
+            setter(record, row[index])
+        for setter in missing:
+            setter(record, None)
+        return record
+
+    _builders[(cls, columns)] = build
+    return build
+
+
+class Event(Record):
+    """Ваншот или кампания. duration есть только у кампаний, capacity None — мест без ограничения."""
+
+    __slots__ = (
+        "event_type", "id", "name", "date_time", "starts_at", "duration", "story",
+        "location", "price", "free_drink", "created_at", "version", "capacity",
+    )
+
+
+class Registration(Record):
+    """Запись пользователя на мероприятие вместе с основными полями мероприятия.
+
+    status — confirmed (место есть) или waitlist (лист ожидания).
+    """
+
+    __slots__ = (
+        "event_type", "event_id", "event_name", "date_time", "starts_at",
+        "registration_id", "user_id", "username", "first_name", "registered_at", "status",
+    )
+
+
+class Review(Record):
+    __slots__ = ("id", "user_id", "username", "first_name", "text", "created_at")
@@ -0,0 +1,103 @@
+import heapq
+from datetime import timedelta
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+# Смещения напоминаний относительно начала мероприятия
+REMINDER_OFFSETS = [
+    (timedelta(days=3), "3_days", "3 дня"),
+    (timedelta(days=1), "1_day", "1 день"),
+    (timedelta(hours=6), "6_hours", "6 часов"),
+]
+
+
+class DueReminder(NamedTuple):
+    due_at: int
+    event_type: str
+    event_id: int
+    reminder_type: str
+    reminder_text: str
+    starts_at: int
+
+
+class ReminderScheduler:
+    """Очередь напоминаний с приоритетом по времени отправки.
+
+    Моменты отправки считаются один раз при добавлении мероприятия, поэтому
+    проверка «есть ли что отправить» не проходит по регистрациям.
+    Регистрации читаются только в момент отправки, так что новая запись
+    на мероприятие не требует пересчёта очереди.
+    """
+
+    def __init__(self, catchup: int = 3600):
+        # Насколько поздно (в секундах) ещё можно отправить пропущенное напоминание,
+        # например после перезапуска бота
+        self.catchup = catchup
+        self._heap: List[DueReminder] = []
+        self._events: Dict[Tuple[str, int], int] = {}
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def add_event(self, event_type: str, event_id: int, starts_at: Optional[int], now: int):
+        if starts_at is None or starts_at <= now:
+            return
+        key = (event_type, event_id)
+        if self._events.get(key) == starts_at:
+            return
+        self._events[key] = starts_at
+        for offset, reminder_type, reminder_text in REMINDER_OFFSETS:
+            due_at = starts_at - int(offset.total_seconds())
+            if due_at < now - self.catchup:
+                continue
+            heapq.heappush(
+                self._heap,
+                DueReminder(due_at, event_type, event_id, reminder_type, reminder_text, starts_at),
+            )
+
+    def remove_event(self, event_type: str, event_id: int):
+        # Записи в куче удаляются лениво: при извлечении они уже не совпадут с _events
+        self._events.pop((event_type, event_id), None)
+
+    def replace_events(self, events: Iterable[Tuple[str, int, Optional[int]]], now: int):
+        # Приводит очередь к списку (тип, id, начало): мероприятия не из списка
+        # удаляются, новые и перенесённые добавляются
+        events = {(event_type, event_id): starts_at for event_type, event_id, starts_at in events}
+        for key in list(self._events):
+            if key not in events:
+                self.remove_event(*key)
+        for (event_type, event_id), starts_at in events.items():
+            self.add_event(event_type, event_id, starts_at, now)
+
+    def retry(self, reminder: DueReminder, due_at: int) -> bool:
+        # Повтор напоминания, которое дошло не до всех: отправка выберет только тех,
+        # кому оно ещё не отмечено. Повторяем в том же окне catchup, что и пропущенные
+        # напоминания, и только пока мероприятие не началось
+        offsets = {reminder_type: offset for offset, reminder_type, _ in REMINDER_OFFSETS}
+        original_due_at = reminder.starts_at - int(offsets[reminder.reminder_type].total_seconds())
+        if self._is_stale(reminder) or due_at > original_due_at + self.catchup or due_at >= reminder.starts_at:
+            return False
+        heapq.heappush(self._heap, reminder._replace(due_at=due_at))
+        return True
+
+    def _is_stale(self, reminder: DueReminder) -> bool:
+        return self._events.get((reminder.event_type, reminder.event_id)) != reminder.starts_at
+
+    def pop_due(self, now: int) -> List[DueReminder]:
+        due = []
+        while self._heap and self._heap[0].due_at <= now:
+            reminder = heapq.heappop(self._heap)
+            if self._is_stale(reminder):
+                continue
+            if reminder.due_at < now - self.catchup or reminder.starts_at <= now:
+                continue
+            due.append(reminder)
+        # Мероприятия, которые уже начались, больше не отслеживаем
+        for key, starts_at in list(self._events.items()):
+            if starts_at <= now:
+                del self._events[key]
+        return due
+
+    def next_due_at(self) -> Optional[int]:
+        while self._heap and self._is_stale(self._heap[0]):
+            heapq.heappop(self._heap)
+        return self._heap[0].due_at if self._heap else None
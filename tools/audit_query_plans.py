@@ -0,0 +1,219 @@
+"""Аудит планов запросов: EXPLAIN QUERY PLAN для каждого запроса каждого метода Database.
+
+Все публичные методы Database вызываются на временной базе с тестовыми данными,
+выполненные запросы перехватываются через журнал запросов (querylog.py) и для
+каждого строится план. Аудит не проходит (код возврата 1), если в плане есть
+полное сканирование таблицы или индекса (SCAN) либо сортировка во временном
+B-дереве (USE TEMP B-TREE), не перечисленные в ALLOWED с объяснением,
+или если какой-то метод Database не вызывается аудитом (нет в CALLS).
+
+Запуск: python tools/audit_query_plans.py [--verbose]
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import Database  # noqa: E402
+from querylog import QueryLog, normalize_sql  # noqa: E402
+
+# Служебные методы без собственных запросов к данным
+SKIP_METHODS = {"close", "get_connection", "release_connection", "transaction", "init_database", "migrate"}
+
+NOW = int(time.time())
+
+# Вызовы каждого метода: варианты аргументов покрывают все ветки построения запроса
+CALLS = {
+    "add_oneshot": [("Ваншот", "2030-01-01 19:00", "Сюжет", "Локация", "500", True)],
+    "add_campaign": [("Кампания", "2030-02-01 19:00", "10 сессий", "Сюжет", "Локация", "700", False)],
+    "get_upcoming": [("oneshot",), ("campaign",)],
+    "get_upcoming_oneshots": [()],
+    "get_upcoming_campaigns": [()],
+    "get_event": [("oneshot", 1), ("campaign", 1)],
+    "get_oneshot_by_id": [(1,)],
+    "get_campaign_by_id": [(1,)],
+    "register": [("oneshot", 3, 100, "user100", "Игрок"), ("campaign", 3, 100, "user100", "Игрок")],
+    "register_for_oneshot": [(1, 100, "user100", "Игрок")],
+    "register_for_campaign": [(1, 100, "user100", "Игрок")],
+    "cancel_registration": [("oneshot", 3, 100), ("campaign", 3, 100)],
+    "get_registration_counts": [("oneshot", 1), ("campaign", 1)],
+    "get_registrations": [("oneshot", 1), ("campaign", 1)],
+    "get_registered_users_for_oneshot": [(1,)],
+    "get_registered_users_for_campaign": [(1,)],
+    "add_notification_request": [(100, "oneshot")],
+    "get_subscribers_page": [("oneshot",), ("oneshot", 100, 10)],
+    "iter_users_to_notify": [("oneshot",)],
+    "get_users_to_notify": [("oneshot",)],
+    "get_subscriber_count": [("oneshot",)],
+    "mark_chat_dead": [(109, "forbidden")],
+    "get_dead_chats": [([100, 109],), ([],)],
+    "revive_chat": [(109,)],
+    "get_all_registrations_for_reminders": [()],
+    "iter_registrations": [()],
+    "stream_registrations": [(), (("user_id", "starts_at"), True)],
+    "get_all_registrations": [()],
+    "get_registrations_page": [
+        (),
+        (None, None, True, (NOW, 1, "oneshot", 1)),
+        ("oneshot", 1),
+        ("campaign", 1, True, (NOW, 1, "campaign", 1)),
+        (None, None, False),
+        (None, None, False, (NOW, 1, "campaign", 1)),
+        # Курсор на мероприятии с неразобранной датой (starts_at NULL)
+        (None, None, False, (None, 1, "oneshot", 1)),
+        ("oneshot",),
+    ],
+    "mark_reminder_sent": [("oneshot", 1, 100, "1_day")],
+    "mark_reminders_sent": [([("oneshot", 1, 101, "1_day"), ("oneshot", 1, 102, "1_day")],)],
+    "get_pending_reminders": [("oneshot", 1, "1_day"), ("campaign", 1, "1_day")],
+    "was_reminder_sent": [("oneshot", 1, 100, "1_day")],
+    "add_review": [(100, "user100", "Игрок", "Отличная игра")],
+    "get_latest_reviews": [()],
+    "get_all_reviews": [()],
+    "get_reviews_page": [(), (("2030-01-01 00:00:00", 5), "n"), (("2030-01-01 00:00:00", 5), "p")],
+    "get_persistence_data": [("user",)],
+    "save_persistence_data": [([("user", "100", "{}")], [("user", "101")])],
+    "acquire_lease": [("jobs", "audit", NOW + 30, NOW)],
+    "release_lease": [("jobs", "audit")],
+    "get_events_version": [()],
+    "enqueue_broadcast": [("oneshot", 1, 1)],
+    "claim_broadcasts": [("audit",)],
+    "finish_broadcast": [(1,)],
+    "delete_review": [(1,)],
+    "apply_writes": [([
+        ("register", ("oneshot", 3, 100, "user100", "Игрок")),
+        ("register", ("oneshot", 3, 100, "user100", "Игрок")),
+        ("add_notification_request", (101, "campaign")),
+        ("mark_reminders_sent", ([("campaign", 1, 103, "1_day")],)),
+        ("mark_chat_dead", (108, "chat_not_found")),
+        ("revive_chat", (108,)),
+    ],)],
+    "delete_event": [("oneshot", 3), ("campaign", 3)],
+    "delete_oneshot": [(2,)],
+    "delete_campaign": [(2,)],
+}
+
+# Допустимые полные сканирования и сортировки: (метод, начало строки плана) -> причина
+ALLOWED = {
+    ("get_latest_reviews", "SCAN reviews USING INDEX idx_reviews_created_at"):
+        "обход индекса в порядке ORDER BY, останавливается на LIMIT",
+    ("get_reviews_page", "SCAN reviews USING INDEX idx_reviews_created_at"):
+        "первая страница: обход индекса в порядке ORDER BY до LIMIT",
+    ("get_all_reviews", "SCAN reviews USING INDEX idx_reviews_created_at"):
+        "полная выгрузка отзывов по запросу администратора",
+    ("claim_broadcasts", "SCAN broadcasts USING INDEX idx_broadcasts_unclaimed"):
+        "частичный индекс содержит только невзятые рассылки",
+    ("get_registrations_page", "SCAN e USING COVERING INDEX idx_"):
+        "первая страница без фильтра или курсор на мероприятии без даты: обход индекса "
+        "времени начала в порядке ORDER BY до LIMIT",
+    ("get_registrations_page", "SCAN (subquery-"):
+        "подзапрос каждого типа уже ограничен LIMIT по индексу keyset",
+    ("get_registrations_page", "USE TEMP B-TREE FOR ORDER BY"):
+        "сортируется не больше limit строк каждого подзапроса",
+    # Потоки регистраций (Database.stream_registrations): ветки UNION ALL идут
+    # по индексам времени начала и сливаются без сортировки
+    ("stream_registrations", "SCAN e USING COVERING INDEX idx_"):
+        "выгрузка всех регистраций по индексу времени начала",
+    ("iter_registrations", "SCAN e USING COVERING INDEX idx_"):
+        "потоковая выгрузка всех регистраций в CSV",
+    ("get_all_registrations", "SCAN e USING COVERING INDEX idx_"):
+        "полный список регистраций для администратора",
+}
+
+
+def seed(db: Database):
+    for i in range(3):
+        db.add_oneshot(f"Ваншот {i}", "2030-01-0%d 19:00" % (i + 1), "Сюжет", "Локация", "500", True, capacity=5)
+        db.add_campaign(f"Кампания {i}", "2030-02-0%d 19:00" % (i + 1), "10", "Сюжет", "Локация", "700", False, capacity=5)
+    for user_id in range(100, 110):
+        db.register_for_oneshot(1, user_id, f"user{user_id}", "Игрок")
+        db.register_for_campaign(1, user_id, f"user{user_id}", "Игрок")
+        db.add_review(user_id, f"user{user_id}", "Игрок", "Отзыв")
+
+
+def capture_queries(db_name: str):
+    log = QueryLog(threshold=float("inf"))
+    db = Database(db_name=db_name, query_log=log)
+    seed(db)
+
+    captured = {}
+    current = {"method": None}
+
+    def on_execute(sql, parameters):
+        if current["method"] is None:
+            return
+        captured.setdefault((current["method"], normalize_sql(sql)), parameters)
+
+    log.on_execute = on_execute
+    for method, calls in CALLS.items():
+        current["method"] = method
+        for args in calls:
+            result = getattr(db, method)(*args)
+            if hasattr(result, "__next__"):
+                # Потоковые методы выполняют запрос только при чтении
+                list(result)
+    current["method"] = None
+    db.close()
+    return captured
+
+
+def explain(conn: sqlite3.Connection, sql: str, parameters):
+    return [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, parameters)]
+
+
+def is_suspicious(detail: str) -> bool:
+    return (detail.startswith("SCAN ") and detail != "SCAN CONSTANT ROW") or "USE TEMP B-TREE" in detail
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--verbose", action="store_true", help="печатать планы всех запросов")
+    args = parser.parse_args()
+
+    methods = {name for name in dir(Database) if not name.startswith("_") and callable(getattr(Database, name))}
+    missing = sorted(methods - SKIP_METHODS - set(CALLS))
+
+    db_name = os.path.join(tempfile.mkdtemp(), "audit.db")
+    captured = capture_queries(db_name)
+    conn = sqlite3.connect(db_name)
+
+    failures = []
+    used_allowances = set()
+    for (method, sql), parameters in sorted(captured.items()):
+        if sql.split(" ", 1)[0].upper() not in ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH"):
+            continue
+        plan = explain(conn, sql, parameters)
+        problems = []
+        for detail in plan:
+            if not is_suspicious(detail):
+                continue
+            allowance = next(
+                (key for key in ALLOWED if key[0] == method and detail.startswith(key[1])), None
+            )
+            if allowance is None:
+                problems.append(detail)
+            else:
+                used_allowances.add(allowance)
+        if problems or args.verbose:
+            print(f"{'ПРОБЛЕМА' if problems else 'ok'}  {method}: {sql}")
+            for detail in plan:
+                print(f"      {'✗' if detail in problems else ' '} {detail}")
+        if problems:
+            failures.append(method)
+    conn.close()
+
+    for allowance in sorted(set(ALLOWED) - used_allowances):
+        print(f"Лишнее исключение в ALLOWED (план изменился?): {allowance}")
+    for method in missing:
+        print(f"Метод Database.{method} не покрыт аудитом: добавьте его вызов в CALLS")
+
+    print(f"Проверено запросов: {len(captured)}, методов: {len(CALLS)}; проблем: {len(failures)}, без аудита: {len(missing)}")
+    return 1 if failures or missing else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
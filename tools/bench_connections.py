@@ -0,0 +1,54 @@
+"""Сравнение накладных расходов на соединение: connect на каждый вызов против пула.
+
+Запуск: python tools/bench_connections.py [--calls 5000]
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import Database  # noqa: E402
+
+
+def connect_per_call(db_name: str, oneshot_id: int):
+    # Так работал Database.get_connection до пула
+    conn = sqlite3.connect(db_name)
+    conn.execute("PRAGMA foreign_keys = ON")
+    cursor = conn.cursor()
+    cursor.execute("SELECT * FROM oneshots WHERE id = ?", (oneshot_id,))
+    row = cursor.fetchone()
+    conn.close()
+    return row
+
+
+def measure(label: str, func, calls: int):
+    started = time.perf_counter()
+    for _ in range(calls):
+        func()
+    elapsed = time.perf_counter() - started
+    print(f"{label:<22} {calls} вызовов: {elapsed * 1000:8.1f} мс, {elapsed / calls * 1e6:7.1f} мкс/вызов")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=5000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_name = os.path.join(tmp, "bench.db")
+        db = Database(db_name=db_name)
+        oneshot_id = db.add_oneshot("Бенчмарк", "2030-01-01 19:00", "", "", "", False)
+
+        before = measure("connect на вызов", lambda: connect_per_call(db_name, oneshot_id), args.calls)
+        after = measure("пул соединений", lambda: db.get_oneshot_by_id(oneshot_id), args.calls)
+        print(f"Ускорение: x{before / after:.1f}")
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""Память и время выгрузки регистраций: потоковый CSV против сборки списка.
+
+Старый способ — get_all_registrations() и склейка текста, как в show_all_registrations.
+После замеров /export (CSV и, если установлен openpyxl, XLSX) проходит через
+Application.process_update с заглушкой Bot API (stub_bot.py) на самой маленькой и самой
+большой базе: файл должен уйти в sendDocument. Если не ушёл — код возврата 1.
+
+Запуск: python tools/bench_export.py [--rows 100 10000 100000]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# Окружение бота задаётся до импорта bot в check_upload
+TMP = tempfile.mkdtemp()
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "1:bench")
+os.environ["ADMIN_IDS"] = "1"
+os.environ["DB_NAME"] = os.path.join(TMP, "upload.db")
+
+from database import Database  # noqa: E402
+from export import XLSX_AVAILABLE, export_registrations  # noqa: E402
+from stub_bot import StubRequest, message_update  # noqa: E402
+
+ADMIN_ID = 1
+
+
+def seed(db: Database, rows: int):
+    with db.transaction() as conn:
+        events = max(1, rows // 100)
+        conn.executemany(
+            "INSERT INTO oneshots (name, date_time, starts_at) VALUES (?, '2030-01-01 19:00', 1893513600)",
+            [(f"Ваншот {i}",) for i in range(events)],
+        )
+        conn.executemany(
+            "INSERT INTO oneshot_registrations (oneshot_id, user_id, username, first_name) VALUES (?, ?, ?, ?)",
+            ((i % events + 1, i, f"user{i}", f"Игрок {i}") for i in range(rows)),
+        )
+
+
+def build_list(db: Database):
+    registrations = db.get_all_registrations()
+    lines = [
+        f"Ваншот: \"{reg.event_name}\"\nПользователь @{reg.username}, id {reg.user_id}"
+        for reg in registrations
+    ]
+    return "Все регистрации:\n\n" + "\n\n".join(lines)
+
+
+def stream_csv(db: Database):
+    fileobj, count = export_registrations(db, "csv")
+    fileobj.close()
+    return count
+
+
+def measure(func, db: Database):
+    tracemalloc.start()
+    started = time.perf_counter()
+    func(db)
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+async def check_upload(rows: int) -> bool:
+    # /export через весь путь обработки обновления: выгрузка должна дойти до sendDocument
+    import bot
+
+    with bot.db.sync.transaction() as conn:
+        # Каждая проверка на своих данных: seed нумерует ваншоты с 1
+        for table in ("oneshot_registrations", "oneshots"):
+            conn.execute(f"DELETE FROM {table}")
+        conn.execute("DELETE FROM sqlite_sequence WHERE name = 'oneshots'")
+    seed(bot.db.sync, rows)
+
+    ok = True
+    stub = StubRequest()
+    application = bot.build_application("1:bench", request=stub)
+    await application.initialize()
+    try:
+        for command in ["/export"] + (["/export xlsx"] if XLSX_AVAILABLE else []):
+            before = stub.calls["sendDocument"]
+            await application.process_update(
+                bot.Update.de_json(message_update(rows, ADMIN_ID, command), application.bot)
+            )
+            sent = stub.calls["sendDocument"] - before
+            print(f"{command} ({rows} строк): sendDocument {'да' if sent else 'НЕТ'}")
+            ok = ok and sent == 1
+    finally:
+        await application.shutdown()
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, nargs="+", default=[100, 10000, 100000])
+    args = parser.parse_args()
+
+    print(f"{'строк':>9} | {'список: мс':>10} {'пик МБ':>8} | {'CSV-поток: мс':>13} {'пик МБ':>8}")
+    for rows in args.rows:
+        with tempfile.TemporaryDirectory() as tmp:
+            db = Database(db_name=os.path.join(tmp, "bench.db"))
+            seed(db, rows)
+            list_time, list_peak = measure(build_list, db)
+            stream_time, stream_peak = measure(stream_csv, db)
+            print(
+                f"{rows:>9} | {list_time * 1000:>10.1f} {list_peak / 2**20:>8.2f} | "
+                f"{stream_time * 1000:>13.1f} {stream_peak / 2**20:>8.2f}"
+            )
+            db.close()
+
+    async def uploads():
+        ok = True
+        for rows in sorted({min(args.rows), max(args.rows)}):
+            ok = await check_upload(rows) and ok
+        import bot
+        await bot.db.close()
+        return ok
+
+    return 0 if asyncio.run(uploads()) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
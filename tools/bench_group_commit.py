@@ -0,0 +1,117 @@
+"""Групповая запись против коммита на каждый вызов при всплеске записей.
+
+Много одновременных «пользователей» (корутин) через AsyncDatabase записываются
+на мероприятия и подписываются на уведомления, как сразу после анонса. Каждый
+десятый повторяет запись — повтор должен вернуть None только ему. Один и тот же
+поток операций выполняется с коммитом на каждый вызов (group_commit_window=None)
+и с групповой записью (group_commit.py) с разными окнами.
+
+--synchronous FULL включает fsync на каждом коммите (в боте synchronous = NORMAL,
+в режиме WAL коммит без fsync), чтобы увидеть разницу на медленном диске.
+
+Запуск: python tools/bench_group_commit.py [--ops 5000] [--concurrency 1,16,64,256]
+        [--windows 0,2,5] [--synchronous NORMAL]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from database import AsyncDatabase, ConnectionPool  # noqa: E402
+from stub_bot import percentiles  # noqa: E402
+
+FIRST_USER = 100_000
+EVENTS = 20
+
+
+class CountingDatabase(AsyncDatabase):
+    """AsyncDatabase, который считает транзакции записи."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.commits = 0
+
+    async def run(self, func, *args, **kwargs):
+        self.commits += 1
+        return await super().run(func, *args, **kwargs)
+
+
+async def burst(window, ops: int, concurrency: int) -> dict:
+    db = CountingDatabase(db_name=os.path.join(tempfile.mkdtemp(), "bench.db"), group_commit_window=window)
+    for i in range(EVENTS):
+        await db.add_oneshot(f"Ваншот {i}", "2030-01-01 19:00", "Сюжет", "Локация", "500", False, capacity=100)
+    db.commits = 0
+
+    latencies = []
+    duplicates = []
+    pending = iter(range(ops))
+
+    async def user():
+        for i in pending:
+            user_id = FIRST_USER + i
+            started = time.perf_counter()
+            if i % 3 == 2:
+                await db.add_notification_request(user_id, "oneshot")
+            else:
+                event_id = i % EVENTS + 1
+                await db.register("oneshot", event_id, user_id, f"user{user_id}", "Игрок")
+                if i % 10 == 0:
+                    # Повторное нажатие «Записаться»
+                    duplicates.append(await db.register("oneshot", event_id, user_id, f"user{user_id}", "Игрок"))
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(user() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    commits = db.commits
+    await db.close()
+
+    stats = percentiles(latencies, points=(50, 99))
+    return {
+        "ops_per_sec": ops / elapsed,
+        "p50_ms": stats["p50"] * 1000,
+        "p99_ms": stats["p99"] * 1000,
+        "commits": commits,
+        "bad_duplicates": sum(1 for result in duplicates if result is not None),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--ops", type=int, default=5000)
+    parser.add_argument("--concurrency", default="1,16,64,256")
+    parser.add_argument("--windows", default="0,2,5", help="окна групповой записи в мс через запятую")
+    parser.add_argument("--synchronous", default="NORMAL", choices=("OFF", "NORMAL", "FULL"))
+    args = parser.parse_args()
+
+    ConnectionPool.PRAGMAS = tuple(
+        f"PRAGMA synchronous = {args.synchronous}" if pragma.startswith("PRAGMA synchronous") else pragma
+        for pragma in ConnectionPool.PRAGMAS
+    )
+    modes = [("по коммиту", None)] + [
+        (f"пачки {window} мс", float(window) / 1000) for window in args.windows.split(",")
+    ]
+
+    print(f"synchronous = {args.synchronous}, {args.ops} операций")
+    print(f"{'параллельно':>11} {'режим':<14} {'оп/с':>9} {'p50 мс':>8} {'p99 мс':>8} {'коммитов':>9}")
+    failed = False
+    for concurrency in (int(value) for value in args.concurrency.split(",")):
+        for label, window in modes:
+            result = await burst(window, args.ops, concurrency)
+            print(
+                f"{concurrency:>11} {label:<14} {result['ops_per_sec']:>9.0f} {result['p50_ms']:>8.2f} "
+                f"{result['p99_ms']:>8.2f} {result['commits']:>9}"
+            )
+            if result["bad_duplicates"]:
+                print(f"ОШИБКА: {result['bad_duplicates']} повторных записей не получили None")
+                failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,283 @@
+"""Пропускная способность и задержка хэндлеров бота на наполненной базе.
+
+Синтетические обновления (/start, кнопки просмотра, записи и подписки, обычные
+сообщения и отзывы) проходят весь путь Application.process_update с настоящими
+хэндлерами; Bot API заменён заглушкой (tools/stub_bot.py), которая записывает
+отправки. База заранее наполняется до заданного масштаба.
+
+Результаты печатаются таблицей и пишутся в JSON (--output) вместе с коммитом,
+на котором сделан замер; --compare старый.json печатает изменение относительно
+прошлого замера.
+
+Запуск: python tools/bench_handlers.py [--users 10000] [--events 1000]
+        [--registrations 100000] [--ops 500] [--concurrency 1]
+        [--scenarios start,view_oneshots,...] [--output bench_handlers.json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+TMP = tempfile.mkdtemp()
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "1:bench")
+# Записи отправляют уведомление админу — этот путь тоже должен попасть в замер
+os.environ.setdefault("ADMIN_IDS", "1")
+os.environ["DB_NAME"] = os.path.join(TMP, "bench.db")
+
+from telegram import Update  # noqa: E402
+
+import bot  # noqa: E402
+from callbacks import encode_callback  # noqa: E402
+from database import Database  # noqa: E402
+from stub_bot import StubRequest, callback_update, message_update, percentiles  # noqa: E402
+
+FIRST_USER = 100_000
+# Новые пользователи для записей: каждая запись должна пройти, а не упереться в «уже записаны»
+NEW_USER = 10_000_000
+EVENT_OFFSET = 30 * 24 * 3600
+
+
+def seed(db_name: str, users: int, events: int, registrations: int):
+    db = Database(db_name=db_name)
+    db.close()
+    conn = sqlite3.connect(db_name)
+    now = int(time.time())
+    half = max(1, events // 2)
+    for table, count in (("oneshots", half), ("campaigns", max(1, events - half))):
+        rows = []
+        for i in range(count):
+            starts_at = now + EVENT_OFFSET + i * 3600
+            date_time = time.strftime("%Y-%m-%d %H:%M", time.localtime(starts_at))
+            rows.append((f"Мероприятие {i}", date_time, starts_at, "Сюжет " * 20, "Локация", "500"))
+        conn.executemany(
+            f"INSERT INTO {table} (name, date_time, starts_at, story, location, price) VALUES (?, ?, ?, ?, ?, ?)",
+            rows,
+        )
+    # Регистрации поровну между ваншотами и кампаниями, пользователи по кругу
+    for table, column, count in (
+        ("oneshot_registrations", "oneshot_id", half),
+        ("campaign_registrations", "campaign_id", max(1, events - half)),
+    ):
+        conn.executemany(
+            f"INSERT OR IGNORE INTO {table} ({column}, user_id, username, first_name) VALUES (?, ?, ?, ?)",
+            (
+                (i % count + 1, FIRST_USER + i // count % users, f"user{i}", f"Игрок {i}")
+                for i in range(registrations // 2)
+            ),
+        )
+    conn.executemany(
+        "INSERT OR IGNORE INTO notifications (user_id, event_type) VALUES (?, ?)",
+        ((FIRST_USER + i, event_type) for i in range(users // 2) for event_type in ("oneshot", "campaign")),
+    )
+    conn.executemany(
+        "INSERT INTO reviews (user_id, username, first_name, text) VALUES (?, ?, ?, ?)",
+        ((FIRST_USER + i, f"user{i}", f"Игрок {i}", "Отличная игра! " * 5) for i in range(min(users, 1000))),
+    )
+    conn.commit()
+    counts = {
+        "oneshots": conn.execute("SELECT COUNT(*) FROM oneshots").fetchone()[0],
+        "campaigns": conn.execute("SELECT COUNT(*) FROM campaigns").fetchone()[0],
+        "registrations": conn.execute(
+            "SELECT (SELECT COUNT(*) FROM oneshot_registrations) + (SELECT COUNT(*) FROM campaign_registrations)"
+        ).fetchone()[0],
+    }
+    conn.close()
+    return counts
+
+
+class Scenario:
+    """Набор синтетических обновлений одного вида."""
+
+    def __init__(self, name: str, make_update, prepare=None):
+        self.name = name
+        # make_update(i, update_id) -> dict обновления
+        self.make_update = make_update
+        # prepare(application, update) — подготовка вне замера (например, флаг отзыва в user_data)
+        self.prepare = prepare
+
+
+def build_scenarios(users: int, counts: dict, rng: random.Random) -> dict:
+    def user(i: int) -> int:
+        return FIRST_USER + rng.randrange(users)
+
+    def leave_review_flag(application, update: Update):
+        application.user_data[update.effective_user.id]["leave_review"] = True
+
+    scenarios = [
+        Scenario("start", lambda i, uid: message_update(uid, user(i), "/start")),
+        Scenario("view_oneshots", lambda i, uid: callback_update(uid, user(i), encode_callback("view", "oneshot"))),
+        Scenario("view_campaigns", lambda i, uid: callback_update(uid, user(i), encode_callback("view", "campaign"))),
+        Scenario("view_reviews", lambda i, uid: callback_update(uid, user(i), encode_callback("reviews"))),
+        Scenario(
+            "register_oneshot",
+            lambda i, uid: callback_update(
+                uid, NEW_USER + uid, encode_callback("register", "oneshot", rng.randint(1, counts['oneshots']))
+            ),
+        ),
+        Scenario(
+            "register_campaign",
+            lambda i, uid: callback_update(
+                uid, NEW_USER + uid, encode_callback("register", "campaign", rng.randint(1, counts['campaigns']))
+            ),
+        ),
+        Scenario("notify_oneshot", lambda i, uid: callback_update(uid, user(i), encode_callback("notify", "oneshot"))),
+        Scenario("notify_campaign", lambda i, uid: callback_update(uid, user(i), encode_callback("notify", "campaign"))),
+        Scenario("message_forward", lambda i, uid: message_update(uid, user(i), "Когда следующая игра?")),
+        Scenario(
+            "message_review",
+            # Каждому отзыву свой пользователь: флаг отзыва снимается после первого сообщения
+            lambda i, uid: message_update(uid, FIRST_USER + uid % users, "Спасибо за игру!"),
+            prepare=leave_review_flag,
+        ),
+    ]
+    return {scenario.name: scenario for scenario in scenarios}
+
+
+async def run_scenario(application, stub: StubRequest, scenario: Scenario, ops: int, concurrency: int,
+                       first_update_id: int) -> dict:
+    updates = []
+    for i in range(ops):
+        update = Update.de_json(scenario.make_update(i, first_update_id + i), application.bot)
+        if scenario.prepare is not None:
+            scenario.prepare(application, update)
+        updates.append(update)
+
+    latencies = []
+    sends_before = len(stub.sent)
+    calls_before = sum(stub.calls.values())
+    pending = iter(updates)
+
+    async def worker():
+        for update in pending:
+            started = time.perf_counter()
+            await application.process_update(update)
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    stats = percentiles(latencies, points=(50, 90, 99))
+    return {
+        "ops": ops,
+        "seconds": elapsed,
+        "ops_per_sec": ops / elapsed,
+        "mean_ms": sum(latencies) / len(latencies) * 1000,
+        **{f"{name}_ms": value * 1000 for name, value in stats.items()},
+        "max_ms": max(latencies) * 1000,
+        "sends": len(stub.sent) - sends_before,
+        "api_calls": sum(stub.calls.values()) - calls_before,
+    }
+
+
+def git_revision() -> str:
+    try:
+        revision = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT,
+                               capture_output=True, text=True).stdout.strip()
+        return revision + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def report(results: dict, previous: dict = None):
+    header = f"{'сценарий':<18} {'оп/с':>9} {'p50 мс':>8} {'p90 мс':>8} {'p99 мс':>8} {'отправок':>9}"
+    if previous:
+        header += f" {'оп/с было':>10} {'изм.':>7}"
+    print(header)
+    for name, result in results.items():
+        line = (
+            f"{name:<18} {result['ops_per_sec']:>9.1f} {result['p50_ms']:>8.2f} "
+            f"{result['p90_ms']:>8.2f} {result['p99_ms']:>8.2f} {result['sends']:>9}"
+        )
+        old = (previous or {}).get(name)
+        if old:
+            change = result["ops_per_sec"] / old["ops_per_sec"] - 1
+            line += f" {old['ops_per_sec']:>10.1f} {change:>+7.1%}"
+        print(line)
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--events", type=int, default=1_000)
+    parser.add_argument("--registrations", type=int, default=100_000)
+    parser.add_argument("--ops", type=int, default=500, help="обновлений на сценарий")
+    parser.add_argument("--concurrency", type=int, default=1, help="одновременно обрабатываемых обновлений")
+    parser.add_argument("--scenarios", default="", help="сценарии через запятую (по умолчанию все)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="файл для результатов в JSON")
+    parser.add_argument("--compare", help="JSON прошлого замера для сравнения")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    counts = seed(os.environ["DB_NAME"], args.users, args.events, args.registrations)
+    print(
+        f"База: {args.users} пользователей, {counts['oneshots']} ваншотов, {counts['campaigns']} кампаний, "
+        f"{counts['registrations']} регистраций ({time.perf_counter() - started:.1f} с)"
+    )
+
+    scenarios = build_scenarios(args.users, counts, random.Random(args.seed))
+    selected = [name.strip() for name in args.scenarios.split(",") if name.strip()] or list(scenarios)
+    unknown = [name for name in selected if name not in scenarios]
+    if unknown:
+        parser.error(f"неизвестные сценарии: {', '.join(unknown)}; доступны: {', '.join(scenarios)}")
+
+    stub = StubRequest()
+    application = bot.build_application("1:bench", request=stub)
+    await application.initialize()
+    await application.start()
+
+    results = {}
+    update_id = 1
+    for name in selected:
+        # Прогрев: кэши карточек и подготовленные выражения не должны попадать в замер
+        await run_scenario(application, stub, scenarios[name], min(20, args.ops), args.concurrency, update_id)
+        update_id += args.ops
+        results[name] = await run_scenario(application, stub, scenarios[name], args.ops, args.concurrency, update_id)
+        update_id += args.ops
+
+    await application.stop()
+    await application.shutdown()
+    await bot.db.close()
+
+    previous = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as fileobj:
+            previous = json.load(fileobj)["results"]
+    report(results, previous)
+
+    if args.output:
+        payload = {
+            "revision": git_revision(),
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": sys.version.split()[0],
+            "params": {
+                "users": args.users,
+                "events": args.events,
+                "registrations": counts["registrations"],
+                "ops": args.ops,
+                "concurrency": args.concurrency,
+                "seed": args.seed,
+            },
+            "results": results,
+        }
+        with open(args.output, "w", encoding="utf-8") as fileobj:
+            json.dump(payload, fileobj, ensure_ascii=False, indent=2)
+        print(f"Результаты записаны в {args.output}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,87 @@
+"""Память и время на хранение регистраций: словари против кортежей и записей.
+
+Все регистрации читаются из базы в список тремя способами: словарь на строку
+(dict(zip(columns, row)), как раньше делал Database), голые кортежи и записи
+records.Registration через row_factory (как сейчас делает get_all_registrations).
+Отдельно замеряются строки прохода напоминаний — их бот держит в памяти.
+
+Запуск: python tools/bench_records.py [--rows 10000 100000]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import REGISTRATION_FIELDS, Database  # noqa: E402
+from records import Registration  # noqa: E402
+
+REMINDER_COLUMNS = ("event_type", "event_id", "event_name", "date_time", "user_id")
+
+
+def seed(db: Database, rows: int):
+    with db.transaction() as conn:
+        events = max(1, rows // 100)
+        starts_at = int(time.time()) + 30 * 24 * 3600
+        for table, registrations, column in (
+            ("oneshots", "oneshot_registrations", "oneshot_id"),
+            ("campaigns", "campaign_registrations", "campaign_id"),
+        ):
+            conn.executemany(
+                f"INSERT INTO {table} (name, date_time, starts_at) VALUES (?, '2030-01-01 19:00', ?)",
+                [(f"Мероприятие {i}", starts_at + i * 3600) for i in range(events)],
+            )
+            conn.executemany(
+                f"INSERT INTO {registrations} ({column}, user_id, username, first_name) VALUES (?, ?, ?, ?)",
+                ((i % events + 1, i, f"user{i}", f"Игрок {i}") for i in range(rows // 2)),
+            )
+
+
+def as_dicts(db: Database, columns):
+    return [dict(zip(columns, row)) for row in db.stream_registrations(columns)]
+
+
+def as_tuples(db: Database, columns):
+    return list(db.stream_registrations(columns))
+
+
+def as_records(db: Database, columns):
+    return list(db.stream_registrations(columns, record=Registration))
+
+
+def measure(func, db: Database, columns):
+    tracemalloc.start()
+    started = time.perf_counter()
+    rows = func(db, columns)
+    elapsed = time.perf_counter() - started
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del rows
+    return elapsed, retained, peak
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, nargs="+", default=[10000, 100000])
+    args = parser.parse_args()
+
+    print(f"{'строк':>7} {'колонки':<12} {'способ':<9} {'мс':>8} {'держит МБ':>10} {'пик МБ':>8} {'байт/строку':>12}")
+    for rows in args.rows:
+        with tempfile.TemporaryDirectory() as tmp:
+            db = Database(db_name=os.path.join(tmp, "bench.db"))
+            seed(db, rows)
+            for label, columns in (("все", REGISTRATION_FIELDS), ("напоминания", REMINDER_COLUMNS)):
+                for name, func in (("словари", as_dicts), ("кортежи", as_tuples), ("записи", as_records)):
+                    elapsed, retained, peak = measure(func, db, columns)
+                    print(
+                        f"{rows:>7} {label:<12} {name:<9} {elapsed * 1000:>8.1f} {retained / 2**20:>10.2f} "
+                        f"{peak / 2**20:>8.2f} {retained / rows:>12.0f}"
+                    )
+            db.close()
+
+
+if __name__ == "__main__":
+    main()
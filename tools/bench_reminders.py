@@ -0,0 +1,204 @@
+"""Стоимость прохода напоминаний на большой базе.
+
+База наполняется прошедшими мероприятиями (с регистрациями и уже отправленными
+напоминаниями), будущими мероприятиями и мероприятиями, у которых напоминание
+созревает ровно в замороженный момент T0. Доля регистраций на созревшие
+мероприятия уже получила напоминание (--sent-fraction), как после прерванного прохода.
+
+Очередь напоминаний загружается и проход check_and_send_reminders выполняется
+с часами, остановленными на T0, с настоящими хэндлерами и заглушкой Bot API.
+Для каждого прохода считаются время, обращения к базе (вызовы методов Database
+через AsyncDatabase), SQL-выражения и отправки; второй проход после перезагрузки
+очереди проверяет, что повторно никому ничего не отправляется.
+
+Запуск: python tools/bench_reminders.py [--past-events 1000] [--future-events 1000]
+        [--due-events 60] [--registrations-per-event 100] [--sent-fraction 0.5] [--rate 0]
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from collections import Counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+TMP = tempfile.mkdtemp()
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "1:bench")
+os.environ["DB_NAME"] = os.path.join(TMP, "bench.db")
+
+from telegram.ext import CallbackContext  # noqa: E402
+
+import bot  # noqa: E402
+from broadcast import Broadcaster  # noqa: E402
+from database import EVENT_TABLES, AsyncDatabase, Database  # noqa: E402
+from querylog import QueryLog  # noqa: E402
+from reminders import REMINDER_OFFSETS  # noqa: E402
+from stub_bot import StubRequest  # noqa: E402
+
+DAY = 24 * 3600
+FIRST_USER = 100_000
+
+
+class CountingDatabase(AsyncDatabase):
+    """AsyncDatabase, который считает обращения к потокам базы по методам."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.calls = Counter()
+
+    async def run(self, func, *args, **kwargs):
+        self.calls[func.__name__] += 1
+        return await super().run(func, *args, **kwargs)
+
+    async def run_read(self, func, *args, **kwargs):
+        self.calls[func.__name__] += 1
+        return await super().run_read(func, *args, **kwargs)
+
+
+def seed(db_name: str, frozen_now: int, past: int, future: int, due: int, per_event: int, sent_fraction: float):
+    Database(db_name=db_name).close()
+    conn = sqlite3.connect(db_name)
+    real_now = int(time.time())
+    events = []
+    # Прошедшие: все три напоминания давно отправлены
+    events += [(real_now - (i + 1) * 3600, "past") for i in range(past)]
+    # Созревшие в T0: по очереди для каждого вида напоминания
+    for i in range(due):
+        offset, reminder_type, _ = REMINDER_OFFSETS[i % len(REMINDER_OFFSETS)]
+        events.append((frozen_now + int(offset.total_seconds()), reminder_type))
+    # Будущие: ни одно их напоминание в T0 ещё не созрело
+    events += [(frozen_now + 5 * DAY + (i + 1) * 3600, "future") for i in range(future)]
+
+    counts = Counter()
+    reminders = []
+    for number, (starts_at, kind) in enumerate(events):
+        event_type = "oneshot" if number % 2 else "campaign"
+        events_table, registrations_table, event_column = EVENT_TABLES[event_type]
+        date_time = time.strftime("%Y-%m-%d %H:%M", time.localtime(starts_at))
+        event_id = conn.execute(
+            f"INSERT INTO {events_table} (name, date_time, starts_at, story, location, price) VALUES (?, ?, ?, ?, ?, ?)",
+            (f"Мероприятие {number}", date_time, starts_at, "Сюжет " * 20, "Локация", "500"),
+        ).lastrowid
+        users = [FIRST_USER + (number * 7 + i) % 50_000 for i in range(per_event)]
+        conn.executemany(
+            f"INSERT OR IGNORE INTO {registrations_table} ({event_column}, user_id, username, first_name) VALUES (?, ?, ?, ?)",
+            ((event_id, user_id, f"user{user_id}", "Игрок") for user_id in users),
+        )
+        if kind == "past":
+            reminders += [(event_type, event_id, user_id, reminder_type)
+                          for user_id in users for _, reminder_type, _ in REMINDER_OFFSETS]
+        elif kind != "future":
+            already_sent = users[:int(len(users) * sent_fraction)]
+            reminders += [(event_type, event_id, user_id, kind) for user_id in already_sent]
+            counts["due_registrations"] += len(users)
+            counts["already_sent"] += len(already_sent)
+        counts["registrations"] += len(users)
+    conn.executemany(
+        "INSERT OR IGNORE INTO reminders (event_type, event_id, user_id, reminder_type) VALUES (?, ?, ?, ?)",
+        reminders,
+    )
+    conn.commit()
+    counts["reminders"] = conn.execute("SELECT COUNT(*) FROM reminders").fetchone()[0]
+    conn.close()
+    return counts
+
+
+async def reminder_pass(context, stub: StubRequest, query_log: QueryLog, frozen_now: int) -> dict:
+    db = bot.db
+    db.calls.clear()
+    statements_before = sum(count for _, count, *_ in query_log.top(limit=None))
+    sends_before = stub.calls["sendMessage"]
+
+    started = time.perf_counter()
+    await bot.load_event_reminders(None, now=frozen_now)
+    loaded = time.perf_counter()
+    await bot.check_and_send_reminders(context, now=frozen_now)
+    finished = time.perf_counter()
+
+    return {
+        "load_ms": (loaded - started) * 1000,
+        "pass_ms": (finished - loaded) * 1000,
+        "round_trips": sum(db.calls.values()),
+        "by_method": dict(db.calls),
+        "statements": sum(count for _, count, *_ in query_log.top(limit=None)) - statements_before,
+        "sends": stub.calls["sendMessage"] - sends_before,
+    }
+
+
+def report(label: str, result: dict):
+    per_send = result["pass_ms"] / result["sends"] if result["sends"] else 0.0
+    methods = ", ".join(f"{name}×{count}" for name, count in sorted(result["by_method"].items()))
+    print(
+        f"{label:<10} загрузка {result['load_ms']:8.1f} мс  проход {result['pass_ms']:8.1f} мс  "
+        f"отправок {result['sends']:6}  ({per_send:.3f} мс/отправку)  "
+        f"обращений к базе {result['round_trips']:4}  SQL {result['statements']:5}\n"
+        f"{'':<10} {methods}"
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--past-events", type=int, default=1000)
+    parser.add_argument("--future-events", type=int, default=1000)
+    parser.add_argument("--due-events", type=int, default=60, help="мероприятий с напоминанием, созревшим в T0")
+    parser.add_argument("--registrations-per-event", type=int, default=100)
+    parser.add_argument("--sent-fraction", type=float, default=0.5,
+                        help="доля регистраций созревших мероприятий, которым напоминание уже ушло")
+    parser.add_argument("--rate", type=float, default=0,
+                        help="лимит отправок в секунду, как у бота (25); 0 — без лимита, замеряется только база")
+    args = parser.parse_args()
+    # Строка лога на каждую отправку заняла бы большую часть замера
+    logging.getLogger().setLevel(logging.WARNING)
+
+    # Часы останавливаются на границе напоминаний через 10 дней от текущего момента
+    frozen_now = int(time.time()) // 3600 * 3600 + 10 * DAY
+    started = time.perf_counter()
+    counts = seed(
+        os.environ["DB_NAME"], frozen_now, args.past_events, args.future_events,
+        args.due_events, args.registrations_per_event, args.sent_fraction,
+    )
+    print(
+        f"База: {args.past_events + args.future_events + args.due_events} мероприятий, "
+        f"{counts['registrations']} регистраций, {counts['reminders']} отправленных напоминаний; "
+        f"созрело {counts['due_registrations']} (из них уже отправлено {counts['already_sent']}) "
+        f"({time.perf_counter() - started:.1f} с)"
+    )
+
+    await bot.db.close()
+    query_log = QueryLog(threshold=float("inf"))
+    bot.db = CountingDatabase(db_name=os.environ["DB_NAME"], query_log=query_log)
+    bot.job_lease.held = True
+    if not args.rate:
+        # Напоминания идут через bot.broadcaster: без лимита Bot API проход упирается в базу
+        bot.broadcaster = Broadcaster(global_rate=10 ** 9, per_chat_interval=0)
+
+    stub = StubRequest()
+    application = bot.build_application("1:bench", request=stub)
+    await application.initialize()
+    context = CallbackContext(application)
+
+    first = await reminder_pass(context, stub, query_log, frozen_now)
+    report("проход", first)
+    expected = counts["due_registrations"] - counts["already_sent"]
+    if first["sends"] != expected:
+        print(f"ОШИБКА: отправлено {first['sends']}, ожидалось {expected}")
+
+    # Перезапуск бота в тот же момент: все напоминания уже отмечены в базе
+    bot.reminder_scheduler.replace_events([], frozen_now)
+    repeat = await reminder_pass(context, stub, query_log, frozen_now)
+    report("повтор", repeat)
+    if repeat["sends"]:
+        print(f"ОШИБКА: повторно отправлено {repeat['sends']} напоминаний")
+
+    await application.shutdown()
+    await bot.db.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,122 @@
+"""Задержка обработки обновлений: webhook-сервер бота против long polling.
+
+Бот запускается с настоящими хэндлерами и заглушкой Bot API (tools/stub_bot.py).
+В webhook-режиме синтетические обновления отправляются POST-запросом на HTTP-сервер
+бота, в режиме polling — отдаются через getUpdates. Задержка — от отправки
+обновления до ответа бота пользователю (/start). --rtt имитирует сетевую задержку
+каждого вызова Bot API.
+
+Запуск: python tools/bench_webhook.py [--updates 500] [--rtt 0.05]
+"""
+import argparse
+import asyncio
+import os
+import socket
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+TMP = tempfile.mkdtemp()
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "1:bench")
+os.environ["DB_NAME"] = os.path.join(TMP, "bench.db")
+
+import httpx  # noqa: E402
+
+import bot  # noqa: E402
+from stub_bot import StubRequest, message_update, percentiles  # noqa: E402
+from webserver import SECRET_HEADER, application_dispatcher, make_web_app, start_http_server  # noqa: E402
+
+SECRET = "bench-secret"
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def wait_for_replies(stub: StubRequest, user_ids, timeout: float = 30):
+    deadline = time.perf_counter() + timeout
+    while any(uid not in stub.sent_at for uid in user_ids):
+        if time.perf_counter() > deadline:
+            raise TimeoutError("бот не ответил на все обновления")
+        await asyncio.sleep(0.001)
+
+
+async def bench_webhook(updates: int, rtt: float, first_user: int):
+    stub = StubRequest(rtt=rtt)
+    application = bot.build_application("1:bench", request=stub)
+    await application.initialize()
+    await application.start()
+    port = free_port()
+    server = start_http_server(make_web_app(application_dispatcher(application), "/telegram", SECRET), port, "127.0.0.1")
+
+    sent_at = {}
+    async with httpx.AsyncClient() as client:
+        # Проверяем, что запрос без секрета отклоняется
+        response = await client.post(f"http://127.0.0.1:{port}/telegram", json=message_update(1, 1, "/start"))
+        assert response.status_code == 403, response.status_code
+        for i in range(updates):
+            user_id = first_user + i
+            sent_at[user_id] = time.perf_counter()
+            # Доставка push-запроса от Telegram до бота
+            await asyncio.sleep(rtt / 2)
+            await client.post(
+                f"http://127.0.0.1:{port}/telegram",
+                json=message_update(i + 1, user_id, "/start"),
+                headers={SECRET_HEADER: SECRET},
+            )
+            await wait_for_replies(stub, [user_id])
+
+    server.stop()
+    await application.stop()
+    await application.shutdown()
+    return [stub.sent_at[uid] - started for uid, started in sent_at.items()]
+
+
+async def bench_polling(updates: int, rtt: float, first_user: int):
+    stub = StubRequest(rtt=rtt)
+    polling_stub = StubRequest(rtt=rtt)
+    application = bot.build_application("1:bench", request=stub, get_updates_request=polling_stub)
+    await application.initialize()
+    await application.start()
+    await application.updater.start_polling(poll_interval=0, timeout=10)
+
+    sent_at = {}
+    for i in range(updates):
+        user_id = first_user + i
+        sent_at[user_id] = time.perf_counter()
+        polling_stub.push_update(message_update(i + 1, user_id, "/start"))
+        await wait_for_replies(stub, [user_id])
+
+    await application.updater.stop()
+    await application.stop()
+    await application.shutdown()
+    return [stub.sent_at[uid] - started for uid, started in sent_at.items()]
+
+
+def report(label: str, latencies):
+    stats = percentiles(latencies)
+    print(
+        f"{label:<8} n={len(latencies)}  "
+        + "  ".join(f"{name}={value * 1000:.2f} мс" for name, value in stats.items())
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--updates", type=int, default=300)
+    parser.add_argument("--rtt", type=float, default=0.0, help="задержка каждого вызова Bot API, с")
+    args = parser.parse_args()
+
+    report("webhook", await bench_webhook(args.updates, args.rtt, first_user=10_000))
+    report("polling", await bench_polling(args.updates, args.rtt, first_user=20_000))
+    await bot.db.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,163 @@
+"""Несколько процессов-обработчиков: пропускная способность и отсутствие повторных отправок.
+
+Запускается настоящий пул процессов из workers.py с заглушкой Bot API в каждом
+процессе (tools/stub_bot.py). Обновления (/start от разных пользователей)
+раскладываются по процессам тем же UpdateRouter, что и в боевом режиме;
+--rtt имитирует сетевую задержку каждого вызова Bot API, поэтому один процесс
+упирается в последовательную обработку обновлений.
+
+Одновременно в базе лежат созревшее напоминание и рассылка о новом ваншоте:
+их должен выполнить ровно один процесс — владелец аренды фоновых задач.
+Каждое сообщение, отправленное любым процессом, возвращается в этот скрипт,
+и повторная отправка одному пользователю считается дублем.
+
+Запуск: python tools/bench_workers.py [--workers 1,2,4] [--updates 400] [--rtt 0.02]
+"""
+import argparse
+import os
+import queue
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# Процессы пула заново импортируют этот модуль, поэтому каталог создаётся один раз,
+# а DB_NAME процессы наследуют от главного
+if "BENCH_WORKERS_DIR" not in os.environ:
+    os.environ["BENCH_WORKERS_DIR"] = tempfile.mkdtemp()
+    os.environ["DB_NAME"] = os.path.join(os.environ["BENCH_WORKERS_DIR"], "bench.db")
+TMP = os.environ["BENCH_WORKERS_DIR"]
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "1:bench")
+# Внутри процесса обновления обрабатываются по очереди, чтобы мерить масштабирование
+# именно числом процессов (параллельность внутри процесса — CONCURRENT_UPDATES)
+os.environ.setdefault("CONCURRENT_UPDATES", "1")
+
+import bot  # noqa: E402
+from database import Database  # noqa: E402
+from stub_bot import StubRequest, message_update  # noqa: E402
+from workers import WorkerPool  # noqa: E402
+
+ADMIN_ID = 1
+WARMUP_USER = 500_000
+UPDATE_USER = 1_000_000
+REGISTERED_USER = 10_000
+SUBSCRIBER = 20_000
+
+
+class ReportingRequest(StubRequest):
+    """Заглушка, которая сообщает в главный процесс о каждом sendMessage."""
+
+    def __init__(self, sent_queue, rtt: float):
+        super().__init__(rtt=rtt)
+        self.sent_queue = sent_queue
+
+    async def do_request(self, url: str, method: str, request_data=None, *args, **kwargs):
+        result = await super().do_request(url, method, request_data, *args, **kwargs)
+        if url.endswith("/sendMessage"):
+            params = request_data.parameters
+            self.sent_queue.put((int(params["chat_id"]), params["text"].split("\n", 1)[0], time.time()))
+        return result
+
+
+def seed(db_name: str, registrations: int, subscribers: int):
+    db = Database(db_name=db_name)
+    # Напоминание «за 6 часов» созрело несколько секунд назад
+    date_time = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(time.time() + 6 * 3600 - 5))
+    oneshot_id = db.add_oneshot("Бенчмарк", date_time, "Сюжет", "Локация", "500", True)
+    for i in range(registrations):
+        db.register_for_oneshot(oneshot_id, REGISTERED_USER + i, f"user{i}", "Игрок")
+    for i in range(subscribers):
+        db.add_notification_request(SUBSCRIBER + i, "oneshot")
+    db.enqueue_broadcast("oneshot", oneshot_id, ADMIN_ID)
+    db.close()
+
+
+def collect(sent_queue, sends: list, until, timeout: float):
+    deadline = time.time() + timeout
+    while not until():
+        try:
+            sends.append(sent_queue.get(timeout=max(0.01, deadline - time.time())))
+        except queue.Empty:
+            raise TimeoutError("не дождались всех отправок")
+
+
+def run(workers: int, updates: int, rtt: float, registrations: int, subscribers: int) -> dict:
+    db_name = os.path.join(TMP, f"workers_{workers}.db")
+    seed(db_name, registrations, subscribers)
+    os.environ["DB_NAME"] = db_name  # процессы пула читают config при импорте
+
+    pool = WorkerPool(workers, bot.run_worker_process)
+    sent_queue = pool.context.Queue()
+    pool.args = (ReportingRequest(sent_queue, rtt),)
+    pool.start()
+    sends = []
+
+    def replies(first_user: int, count: int) -> int:
+        return sum(1 for chat_id, _, _ in sends if first_user <= chat_id < first_user + count)
+
+    # Прогрев: по одному обновлению в каждый процесс, чтобы не мерить запуск процессов
+    for i in range(workers):
+        pool.router.route(message_update(i + 1, WARMUP_USER + i, "/start"))
+    collect(sent_queue, sends, lambda: replies(WARMUP_USER, workers) >= workers, timeout=60)
+
+    started = time.time()
+    for i in range(updates):
+        pool.router.route(message_update(workers + i + 1, UPDATE_USER + i, "/start"))
+    collect(sent_queue, sends, lambda: replies(UPDATE_USER, updates) >= updates, timeout=120)
+    finished = max(sent_at for chat_id, _, sent_at in sends if chat_id >= UPDATE_USER)
+
+    collect(
+        sent_queue, sends,
+        lambda: replies(REGISTERED_USER, registrations) >= registrations and replies(SUBSCRIBER, subscribers) >= subscribers,
+        timeout=120,
+    )
+    # Даём остальным процессам время на повторную отправку, если бы аренда не работала
+    time.sleep(2)
+    pool.stop()
+    while True:
+        try:
+            sends.append(sent_queue.get_nowait())
+        except queue.Empty:
+            break
+
+    def duplicates(first_user: int, count: int) -> int:
+        chats = [chat_id for chat_id, _, _ in sends if first_user <= chat_id < first_user + count]
+        return len(chats) - len(set(chats))
+
+    return {
+        "workers": workers,
+        "throughput": updates / (finished - started),
+        "reminders": replies(REGISTERED_USER, registrations),
+        "announcements": replies(SUBSCRIBER, subscribers),
+        "duplicates": duplicates(REGISTERED_USER, registrations) + duplicates(SUBSCRIBER, subscribers)
+        + duplicates(UPDATE_USER, updates),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", default="1,2,4", help="числа процессов через запятую")
+    parser.add_argument("--updates", type=int, default=400)
+    parser.add_argument("--rtt", type=float, default=0.02, help="задержка каждого вызова Bot API, с")
+    parser.add_argument("--registrations", type=int, default=200)
+    parser.add_argument("--subscribers", type=int, default=100)
+    args = parser.parse_args()
+
+    baseline = None
+    for workers in (int(value) for value in args.workers.split(",")):
+        result = run(workers, args.updates, args.rtt, args.registrations, args.subscribers)
+        baseline = baseline or result["throughput"]
+        print(
+            f"процессов={result['workers']}  {result['throughput']:7.1f} обн/с  "
+            f"ускорение x{result['throughput'] / baseline:.2f}  "
+            f"напоминаний {result['reminders']}/{args.registrations}  "
+            f"рассылка {result['announcements']}/{args.subscribers}  "
+            f"дублей {result['duplicates']}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+"""Нагрузочная проверка записи на мероприятия с ограниченным числом мест.
+
+Несколько процессов, в каждом несколько потоков, одновременно (по общему
+барьеру) записывают разных пользователей на одни и те же мероприятия через
+Database.register — как подписчики сразу после анонса. Часть пользователей
+сразу отменяет запись (Database.cancel_registration), и освободившиеся места
+должны уходить первым из листа ожидания.
+
+После прогона проверяется, что ни одно мероприятие не переполнено, что места
+занимают ровно первые capacity записей (по порядку id), что у каждого
+пользователя не больше одной записи и что число записей в базе сходится
+с ответами вызовов. Любое нарушение или ошибка базы — код возврата 1.
+
+Запуск: python tools/stress_registrations.py [--processes 4] [--threads 4]
+        [--users 4000] [--events 2] [--capacity 50] [--cancel-fraction 0.1]
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from database import EVENT_TABLES, REGISTRATION_CONFIRMED, REGISTRATION_WAITLIST, Database  # noqa: E402
+from stub_bot import percentiles  # noqa: E402
+
+FIRST_USER = 100_000
+
+
+def seed(db_name: str, events: int, capacity: int):
+    db = Database(db_name=db_name)
+    targets = []
+    for i in range(events):
+        event_type = "oneshot" if i % 2 == 0 else "campaign"
+        if event_type == "oneshot":
+            event_id = db.add_oneshot(f"Ваншот {i}", "2030-01-01 19:00", "Сюжет", "Локация", "500", False,
+                                      capacity=capacity)
+        else:
+            event_id = db.add_campaign(f"Кампания {i}", "2030-01-01 19:00", "10", "Сюжет", "Локация", "500",
+                                       False, capacity=capacity)
+        targets.append((event_type, event_id))
+    db.close()
+    return targets
+
+
+def worker(db_name: str, targets, users, threads: int, cancel_fraction: float, seed_value: int, barrier, results):
+    # Процесс со своим Database: у каждого потока своё соединение из пула
+    db = Database(db_name=db_name)
+    rng = random.Random(seed_value)
+    plan = [(user_id, rng.choice(targets), rng.random() < cancel_fraction) for user_id in users]
+    chunks = [plan[i::threads] for i in range(threads)]
+    statuses = Counter()
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def run(chunk):
+        local_latencies = []
+        local_statuses = Counter()
+        for user_id, (event_type, event_id), cancel in chunk:
+            started = time.perf_counter()
+            try:
+                status = db.register(event_type, event_id, user_id, f"user{user_id}", "Игрок")
+                local_statuses[status] += 1
+                if cancel:
+                    removed, promoted = db.cancel_registration(event_type, event_id, user_id)
+                    local_statuses["cancelled_" + status] += 1
+                    if promoted is not None:
+                        local_statuses["promoted"] += 1
+            except sqlite3.Error as e:
+                with lock:
+                    errors.append(f"{type(e).__name__}: {e}")
+                continue
+            local_latencies.append(time.perf_counter() - started)
+        with lock:
+            latencies.extend(local_latencies)
+            statuses.update(local_statuses)
+
+    pool = [threading.Thread(target=run, args=(chunk,)) for chunk in chunks]
+    barrier.wait()
+    started = time.perf_counter()
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    db.close()
+    results.put((dict(statuses), latencies, errors, elapsed))
+
+
+def check(db_name: str, targets, capacity: int, statuses: Counter) -> list:
+    conn = sqlite3.connect(db_name)
+    problems = []
+    total = 0
+    for event_type, event_id in targets:
+        _, registrations_table, event_column = EVENT_TABLES[event_type]
+        rows = conn.execute(
+            f"SELECT id, user_id, status FROM {registrations_table} WHERE {event_column} = ? ORDER BY id",
+            (event_id,),
+        ).fetchall()
+        confirmed = [row for row in rows if row[2] == REGISTRATION_CONFIRMED]
+        waitlist = [row for row in rows if row[2] == REGISTRATION_WAITLIST]
+        total += len(rows)
+        label = f"{event_type} {event_id}"
+        if len(confirmed) > capacity:
+            problems.append(f"{label}: занято {len(confirmed)} мест из {capacity}")
+        if len(confirmed) < min(capacity, len(rows)):
+            problems.append(f"{label}: {capacity - len(confirmed)} мест свободно, а в листе ожидания {len(waitlist)}")
+        if rows[:len(confirmed)] != confirmed:
+            problems.append(f"{label}: места заняты не первыми по порядку записями")
+        duplicates = [user for user, count in Counter(row[1] for row in rows).items() if count > 1]
+        if duplicates:
+            problems.append(f"{label}: повторные записи пользователей {duplicates[:5]}")
+        print(f"  {label}: подтверждено {len(confirmed)}/{capacity}, в листе ожидания {len(waitlist)}")
+    conn.close()
+
+    # Записей в базе = успешные записи − отмены
+    cancelled = statuses["cancelled_" + REGISTRATION_CONFIRMED] + statuses["cancelled_" + REGISTRATION_WAITLIST]
+    expected = statuses[REGISTRATION_CONFIRMED] + statuses[REGISTRATION_WAITLIST] - cancelled
+    if total != expected:
+        problems.append(f"в базе {total} записей, по ответам вызовов {expected}")
+    return problems
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=4, help="потоков в каждом процессе")
+    parser.add_argument("--users", type=int, default=4000, help="всего записывающихся пользователей")
+    parser.add_argument("--events", type=int, default=2)
+    parser.add_argument("--capacity", type=int, default=50)
+    parser.add_argument("--cancel-fraction", type=float, default=0.1, help="доля пользователей, сразу отменяющих запись")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    db_name = os.path.join(tempfile.mkdtemp(), "stress.db")
+    targets = seed(db_name, args.events, args.capacity)
+
+    context = multiprocessing.get_context("spawn")
+    barrier = context.Barrier(args.processes)
+    results = context.Queue()
+    users = list(range(FIRST_USER, FIRST_USER + args.users))
+    processes = [
+        context.Process(
+            target=worker,
+            args=(db_name, targets, users[i::args.processes], args.threads, args.cancel_fraction,
+                  args.seed + i, barrier, results),
+        )
+        for i in range(args.processes)
+    ]
+    for process in processes:
+        process.start()
+    collected = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+
+    statuses = Counter()
+    latencies = []
+    errors = []
+    for process_statuses, process_latencies, process_errors, _ in collected:
+        statuses.update(process_statuses)
+        latencies.extend(process_latencies)
+        errors.extend(process_errors)
+    elapsed = max(result[3] for result in collected)
+
+    stats = percentiles(latencies, points=(50, 99))
+    print(
+        f"{args.processes} процессов × {args.threads} потоков, {args.users} пользователей на "
+        f"{args.events} мероприятий по {args.capacity} мест: {elapsed:.2f} с, "
+        f"{len(latencies) / elapsed:.0f} записей/с, p50 {stats['p50'] * 1000:.2f} мс, p99 {stats['p99'] * 1000:.2f} мс"
+    )
+    print(
+        f"  мест выдано сразу {statuses[REGISTRATION_CONFIRMED]}, в лист ожидания {statuses[REGISTRATION_WAITLIST]}, "
+        f"отменено {statuses['cancelled_' + REGISTRATION_CONFIRMED] + statuses['cancelled_' + REGISTRATION_WAITLIST]}, "
+        f"переведено из листа ожидания {statuses['promoted']}"
+    )
+    problems = check(db_name, targets, args.capacity, statuses)
+    if statuses[None]:
+        problems.append(f"{statuses[None]} записей не прошли (пользователь уже записан или нет мероприятия)")
+    for error in errors[:10]:
+        problems.append(f"ошибка базы: {error}")
+    if len(errors) > 10:
+        problems.append(f"и ещё {len(errors) - 10} ошибок базы")
+
+    for problem in problems:
+        print(f"ОШИБКА: {problem}")
+    if not problems:
+        print("Нарушений нет")
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,146 @@
+"""Заглушка Bot API для бенчмарков: отвечает на запросы бота без сети и записывает отправки."""
+import asyncio
+import json
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+from telegram.request import BaseRequest, RequestData
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+
+# Методы, которые возвращают отправленное сообщение
+MESSAGE_METHODS = {"sendMessage", "editMessageText", "forwardMessage", "sendDocument"}
+
+
+class StubRequest(BaseRequest):
+    """Отвечает на вызовы Bot API как Telegram, но мгновенно (или с задержкой rtt).
+
+    getUpdates отдаёт обновления, положенные через push_update, что позволяет
+    сравнивать long polling с webhook-режимом на одной машине.
+    """
+
+    def __init__(self, rtt: float = 0.0):
+        self.rtt = rtt
+        self.calls: Counter = Counter()
+        # (время, метод, chat_id) каждого отправленного сообщения
+        self.sent: List[Tuple[float, str, Optional[int]]] = []
+        self.sent_at: Dict[int, float] = {}
+        self._updates: Optional[asyncio.Queue] = None
+        self._message_id = 0
+        self._update_id = 0
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    @property
+    def updates(self) -> asyncio.Queue:
+        if self._updates is None:
+            self._updates = asyncio.Queue()
+        return self._updates
+
+    def push_update(self, update: dict):
+        self.updates.put_nowait(update)
+
+    def next_update_id(self) -> int:
+        self._update_id += 1
+        return self._update_id
+
+    async def _get_updates(self, timeout: float) -> list:
+        try:
+            first = await asyncio.wait_for(self.updates.get(), timeout=max(timeout, 0.01))
+        except asyncio.TimeoutError:
+            return []
+        batch = [first]
+        while not self.updates.empty():
+            batch.append(self.updates.get_nowait())
+        return batch
+
+    async def do_request(
+        self,
+        url: str,
+        method: str,
+        request_data: Optional[RequestData] = None,
+        read_timeout=None,
+        write_timeout=None,
+        connect_timeout=None,
+        pool_timeout=None,
+    ) -> Tuple[int, bytes]:
+        endpoint = url.rsplit("/", 1)[-1]
+        params = request_data.parameters if request_data else {}
+        self.calls[endpoint] += 1
+
+        if endpoint == "getUpdates":
+            # Запрос идёт до Telegram rtt/2, ответ с обновлениями возвращается ещё rtt/2
+            await asyncio.sleep(self.rtt / 2)
+            result = await self._get_updates(float(params.get("timeout", 0) or 0))
+            await asyncio.sleep(self.rtt / 2)
+            return 200, json.dumps({"ok": True, "result": result}).encode()
+
+        if self.rtt:
+            await asyncio.sleep(self.rtt)
+        if endpoint == "getMe":
+            result = BOT_USER
+        elif endpoint in MESSAGE_METHODS:
+            chat_id = params.get("chat_id")
+            chat_id = int(chat_id) if chat_id is not None else None
+            now = time.perf_counter()
+            self.sent.append((now, endpoint, chat_id))
+            if chat_id is not None:
+                self.sent_at[chat_id] = now
+            self._message_id += 1
+            result = {
+                "message_id": self._message_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id or 0, "type": "private"},
+                "text": params.get("text", ""),
+            }
+        else:
+            result = True
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+
+def make_user(user_id: int) -> dict:
+    return {"id": user_id, "is_bot": False, "first_name": f"Игрок {user_id}", "username": f"user{user_id}"}
+
+
+def message_update(update_id: int, user_id: int, text: str) -> dict:
+    message = {
+        "message_id": update_id,
+        "date": int(time.time()),
+        "chat": {"id": user_id, "type": "private"},
+        "from": make_user(user_id),
+        "text": text,
+    }
+    if text.startswith("/"):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return {"update_id": update_id, "message": message}
+
+
+def callback_update(update_id: int, user_id: int, data: str) -> dict:
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": make_user(user_id),
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": {
+                "message_id": update_id,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": BOT_USER,
+                "text": "меню",
+            },
+        },
+    }
+
+
+def percentiles(values: List[float], points=(50, 90, 99)) -> Dict[str, float]:
+    if not values:
+        return {f"p{p}": 0.0 for p in points}
+    ordered = sorted(values)
+    return {f"p{p}": ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))] for p in points}
@@ -0,0 +1,72 @@
+import asyncio
+from typing import Awaitable, Dict, Optional
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+# Предел для семафора базового класса, который никогда не достигается (см. ниже)
+UNBOUNDED = 2 ** 20
+
+
+def update_user_key(update: object) -> Optional[int]:
+    if not isinstance(update, Update):
+        return None
+    if update.effective_user is not None:
+        return update.effective_user.id
+    if update.effective_chat is not None:
+        return update.effective_chat.id
+    return None
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Параллельная обработка обновлений разных пользователей.
+
+    Обновления одного пользователя обрабатываются строго по очереди в порядке
+    поступления, поэтому его диалоги (ConversationHandler) и user_data видят
+    их так же, как при последовательной обработке. Блокировка пользователя
+    удаляется, когда у него не остаётся ожидающих обновлений.
+    """
+
+    def __init__(self, max_concurrent_updates: int = 64):
+        # Семафор базового класса берётся до блокировки пользователя, и пачка
+        # обновлений одного пользователя заняла бы все места, дожидаясь своей
+        # очереди. Поэтому ограничение применяется уже под блокировкой пользователя
+        super().__init__(max_concurrent_updates=UNBOUNDED)
+        self.limit = max_concurrent_updates
+        self._slots = asyncio.Semaphore(max_concurrent_updates)
+        self._locks: Dict[int, asyncio.Lock] = {}
+        # Сколько обновлений пользователя обрабатывается или ждёт очереди
+        self._queued: Dict[int, int] = {}
+
+    @property
+    def active_users(self) -> int:
+        return len(self._locks)
+
+    async def do_process_update(self, update: object, coroutine: Awaitable) -> None:
+        key = update_user_key(update)
+        if key is None:
+            async with self._slots:
+                await coroutine
+            return
+
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        self._queued[key] = self._queued.get(key, 0) + 1
+        try:
+            # asyncio.Lock отдаёт блокировку ожидающим по очереди, так что порядок
+            # обновлений пользователя сохраняется
+            async with lock:
+                async with self._slots:
+                    await coroutine
+        finally:
+            self._queued[key] -= 1
+            if not self._queued[key]:
+                del self._queued[key]
+                del self._locks[key]
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
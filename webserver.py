@@ -0,0 +1,70 @@
+import hmac
+import json
+import logging
+from http import HTTPStatus
+from typing import Awaitable, Callable
+
+import tornado.web
+from tornado.httpserver import HTTPServer
+from telegram import Update
+from telegram.ext import Application
+
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+# Получатель обновлений: словарь JSON от Telegram
+Dispatch = Callable[[dict], Awaitable[None]]
+
+
+def application_dispatcher(application: Application) -> Dispatch:
+    # Обновление обрабатывается в этом же процессе
+    async def dispatch(data: dict):
+        update = Update.de_json(data, application.bot)
+        if update is not None:
+            await application.update_queue.put(update)
+
+    return dispatch
+
+
+class WebhookHandler(tornado.web.RequestHandler):
+    """Принимает обновления от Telegram и передаёт их в dispatch."""
+
+    def initialize(self, dispatch: Dispatch, secret_token: str):
+        self.dispatch = dispatch
+        self.secret_token = secret_token
+
+    async def post(self):
+        token = self.request.headers.get(SECRET_HEADER, "")
+        if not hmac.compare_digest(token.encode(), self.secret_token.encode()):
+            logger.warning("Запрос к webhook с неверным секретным токеном")
+            raise tornado.web.HTTPError(HTTPStatus.FORBIDDEN)
+        try:
+            data = json.loads(self.request.body)
+        except ValueError:
+            raise tornado.web.HTTPError(HTTPStatus.BAD_REQUEST)
+        await self.dispatch(data)
+        self.set_status(HTTPStatus.OK)
+
+
+class MetricsHandler(tornado.web.RequestHandler):
+    def get(self):
+        self.set_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.write(REGISTRY.render())
+
+
+def make_web_app(dispatch: Dispatch = None, webhook_path: str = None, secret_token: str = "") -> tornado.web.Application:
+    routes = [("/metrics", MetricsHandler)]
+    if webhook_path:
+        routes.append((webhook_path, WebhookHandler, {"dispatch": dispatch, "secret_token": secret_token}))
+    return tornado.web.Application(routes)
+
+
+def start_http_server(web_app: tornado.web.Application, port: int, listen: str = "0.0.0.0") -> HTTPServer:
+    # Вызывать из работающего event loop
+    server = HTTPServer(web_app, xheaders=True)
+    server.listen(port, address=listen)
+    logger.info(f"HTTP-сервер слушает {listen}:{port}")
+    return server
@@ -0,0 +1,213 @@
+"""Режим нескольких процессов-обработчиков (WORKERS > 1).
+
+Главный процесс только принимает обновления (webhook или long polling)
+и раскладывает их по очередям процессов по user_id, поэтому обновления
+одного пользователя всегда обрабатывает один и тот же процесс по порядку,
+и его диалог (ConversationHandler, user_data) живёт в одном месте.
+
+Напоминания и рассылки выполняет только процесс, который держит аренду
+фоновых задач в базе (JobLease); остальные процессы её периодически
+пытаются взять, поэтому при падении владельца задачи переходят к другому.
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import time
+import uuid
+from typing import Callable, List, Optional
+
+from telegram import Bot, Update
+from telegram.ext import Updater
+
+from database import AsyncDatabase
+from metrics import CallbackMetric, Counter
+
+logger = logging.getLogger(__name__)
+
+# Аренда продлевается каждые COORDINATION_INTERVAL секунд и истекает через LEASE_TTL,
+# если владелец перестал её продлевать
+JOB_LEASE_NAME = "jobs"
+LEASE_TTL = 30
+COORDINATION_INTERVAL = 10
+
+# Как часто главный процесс проверяет, что процессы-обработчики живы
+SUPERVISE_INTERVAL = 1.0
+
+
+class JobLease:
+    """Аренда фоновых задач в таблице leases: в каждый момент у неё один владелец."""
+
+    def __init__(self, db: AsyncDatabase, name: str = JOB_LEASE_NAME, ttl: int = LEASE_TTL):
+        self.db = db
+        self.name = name
+        self.ttl = ttl
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.held = False
+
+    async def renew(self) -> bool:
+        now = int(time.time())
+        try:
+            self.held = await self.db.acquire_lease(self.name, self.owner, now + self.ttl, now)
+        except Exception as e:
+            # Не знаем, продлилась ли аренда, — считаем её потерянной
+            logger.error(f"Ошибка продления аренды {self.name}: {e}")
+            self.held = False
+        return self.held
+
+    async def release(self):
+        if self.held:
+            self.held = False
+            await self.db.release_lease(self.name, self.owner)
+
+
+def update_partition_key(data: dict) -> int:
+    # Пользователь обновления, а если его нет (посты каналов) — чат
+    for value in data.values():
+        if not isinstance(value, dict):
+            continue
+        user = value.get("from") or value.get("user")
+        if user:
+            return user["id"]
+        chat = value.get("chat") or value.get("message", {}).get("chat")
+        if chat:
+            return chat["id"]
+    return 0
+
+
+ROUTED_UPDATES = Counter("bot_intake_updates_total", "Обновления, переданные процессам-обработчикам", ["worker"])
+
+
+def _queue_sizes(queues: List[multiprocessing.Queue]):
+    for index, queue in enumerate(queues):
+        try:
+            yield (str(index),), queue.qsize()
+        except NotImplementedError:  # qsize недоступен на macOS
+            return
+
+
+class UpdateRouter:
+    """Раскладывает обновления (словари JSON от Telegram) по очередям процессов."""
+
+    def __init__(self, queues: List[multiprocessing.Queue]):
+        self.queues = queues
+        CallbackMetric(
+            "bot_intake_queue_size", "Обновления в очереди процесса-обработчика",
+            lambda: _queue_sizes(self.queues),
+            labelnames=["worker"],
+        )
+
+    def route(self, data: dict):
+        index = update_partition_key(data) % len(self.queues)
+        self.queues[index].put(data)
+        ROUTED_UPDATES.inc(str(index))
+
+    async def dispatch(self, data: dict):
+        self.route(data)
+
+
+def worker_entry(target: Callable, index: int, updates: multiprocessing.Queue, *args):
+    # Ctrl+C получает вся группа процессов; обработчики останавливает главный процесс,
+    # положив None в очередь, чтобы они дообработали уже принятые обновления
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    target(index, updates, *args)
+
+
+class WorkerPool:
+    def __init__(self, count: int, target: Callable, *args):
+        self.context = multiprocessing.get_context("spawn")
+        self.target = target
+        self.args = args
+        self.queues = [self.context.Queue() for _ in range(count)]
+        self.processes: List[Optional[multiprocessing.Process]] = [None] * count
+        self.router = UpdateRouter(self.queues)
+
+    def _spawn(self, index: int):
+        process = self.context.Process(
+            target=worker_entry,
+            args=(self.target, index, self.queues[index], *self.args),
+            name=f"bot-worker-{index}",
+        )
+        process.start()
+        self.processes[index] = process
+
+    def start(self):
+        for index in range(len(self.queues)):
+            self._spawn(index)
+
+    def restart_dead(self):
+        # Упавший процесс перезапускается; его необработанные обновления остались в очереди
+        for index, process in enumerate(self.processes):
+            if process is not None and not process.is_alive():
+                logger.error(f"Процесс {process.name} завершился с кодом {process.exitcode}, перезапускаем")
+                self._spawn(index)
+
+    def stop(self, timeout: float = 30):
+        for queue in self.queues:
+            queue.put(None)
+        for process in self.processes:
+            process.join(timeout)
+            if process.is_alive():
+                logger.warning(f"Процесс {process.name} не остановился, завершаем принудительно")
+                process.terminate()
+                process.join()
+
+
+async def run_intake(pool: WorkerPool, token: str):
+    """Главный процесс: принимает обновления и раздаёт их процессам пула."""
+    from config import WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET, HTTP_LISTEN, HTTP_PORT
+    from webserver import make_web_app, start_http_server
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    pool.start()
+    bot = Bot(token)
+    updater = None
+    updates: asyncio.Queue = asyncio.Queue()
+    server = None
+    async with bot:
+        try:
+            if WEBHOOK_URL:
+                server = start_http_server(
+                    make_web_app(pool.router.dispatch, WEBHOOK_PATH, WEBHOOK_SECRET), HTTP_PORT, HTTP_LISTEN
+                )
+                await bot.set_webhook(
+                    url=WEBHOOK_URL + WEBHOOK_PATH,
+                    secret_token=WEBHOOK_SECRET,
+                    allowed_updates=Update.ALL_TYPES,
+                )
+            else:
+                # HTTP-сервер нужен только для /metrics
+                server = start_http_server(make_web_app(), HTTP_PORT, HTTP_LISTEN)
+                updater = Updater(bot, updates)
+                await updater.initialize()
+                await updater.start_polling(allowed_updates=Update.ALL_TYPES)
+                loop.create_task(forward_polled_updates(updates, pool.router))
+
+            while not stop.is_set():
+                pool.restart_dead()
+                try:
+                    await asyncio.wait_for(stop.wait(), SUPERVISE_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            if server is not None:
+                server.stop()
+            if updater is not None:
+                await updater.stop()
+                await updater.shutdown()
+                # Обновления, которые уже получены, но ещё не разложены по очередям
+                while not updates.empty():
+                    pool.router.route(updates.get_nowait().to_dict())
+            await loop.run_in_executor(None, pool.stop)
+
+
+async def forward_polled_updates(updates: asyncio.Queue, router: UpdateRouter):
+    while True:
+        update = await updates.get()
+        router.route(update.to_dict())